@@ -0,0 +1,4 @@
+"""Benchmarks for the Ristorante Manager API.
+
+Run from the ``backend`` directory, e.g. ``python -m benchmarks.table_round_trips``.
+"""
@@ -0,0 +1,59 @@
+"""Batch POST /api/orders/add-items against one POST /api/orders/add-item per line
+
+A waiter entering a whole course sends every line at once; this compares the
+round trips and latency of that batch with posting the same lines one by one.
+"""
+import asyncio
+
+import server
+from benchmarks.common import asgi_client, connect, measure, parser, print_rows, seed_floor
+
+BATCH_SIZES = [1, 4, 8, 16, 32]
+
+
+async def main(args):
+    database, counter = connect(args.mock)
+    table = (await seed_floor(database, 1, 0))[0]
+    catalog = server.restaurants[server.DEFAULT_RESTAURANT_ID].catalog
+    products, doughs, extras = catalog.products, catalog.dough_types, catalog.extras
+
+    rows = []
+    async with asgi_client() as client:
+        for size in BATCH_SIZES:
+            lines = []
+            for position in range(size):
+                product = products[position % len(products)]
+                line = {"product_id": product["id"], "extra_ids": []}
+                if product["is_customizable"]:
+                    line["dough_type"] = doughs[position % len(doughs)]["name"]
+                    line["extra_ids"] = [extras[position % len(extras)]["id"]]
+                lines.append(line)
+
+            async def one_by_one():
+                for line in lines:
+                    response = await client.post(
+                        "/api/orders/add-item", json={"table_id": table["id"], **line}
+                    )
+                    response.raise_for_status()
+
+            async def batch():
+                response = await client.post(
+                    "/api/orders/add-items", json={"table_id": table["id"], "items": lines}
+                )
+                response.raise_for_status()
+
+            single = await measure(one_by_one, counter, args.repeat)
+            batched = await measure(batch, counter, args.repeat)
+            rows.append([
+                size,
+                f"{single['round_trips']:.0f}",
+                f"{batched['round_trips']:.0f}",
+                f"{single['median_ms']:.2f}",
+                f"{batched['median_ms']:.2f}",
+            ])
+
+    print_rows(["lines", "single trips", "batch trips", "single ms", "batch ms"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parser(__doc__.splitlines()[0]).parse_args()))
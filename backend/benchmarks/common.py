@@ -0,0 +1,349 @@
+"""Shared helpers for the API benchmarks
+
+Benchmarks talk to the FastAPI app in-process through httpx's ASGI transport
+and point ``server.storage`` at a scratch Mongo database. By default that database lives
+on the MongoDB at ``BENCH_MONGO_URL``; ``--mock`` swaps in mongomock-motor so
+the numbers can be reproduced on a laptop without a mongod.
+"""
+import argparse
+import asyncio
+import math
+import os
+import statistics
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+import server
+from storage.mongo import MongoStorage
+from storage.rollups import rollup_increments
+
+BENCH_MONGO_URL = os.getenv("BENCH_MONGO_URL", "mongodb://localhost:27017")
+BENCH_DATABASE = "ristorante_manager_bench"
+
+# Collection methods that cost one round trip to the server
+_ROUND_TRIP_METHODS = {
+    "find_one", "find_one_and_update", "find_one_and_delete", "insert_one", "insert_many",
+    "update_one", "update_many", "delete_one", "delete_many",
+    "replace_one", "bulk_write", "count_documents", "distinct",
+}
+
+
+class RoundTripCounter(monitoring.CommandListener):
+    """Count the commands sent to MongoDB"""
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+class _CountingCursor:
+    """Cursor proxy that counts one round trip per fetch"""
+
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._cursor, name)
+        if name == "to_list":
+            async def to_list(*args, **kwargs):
+                self._counter.count += 1
+                return await attr(*args, **kwargs)
+            return to_list
+        if callable(attr):
+            def chained(*args, **kwargs):
+                return _CountingCursor(attr(*args, **kwargs), self._counter)
+            return chained
+        return attr
+
+    def __aiter__(self):
+        self._counter.count += 1
+        return self._cursor.__aiter__()
+
+
+class _CountingCollection:
+    """Collection proxy that counts round trips the way a CommandListener would"""
+
+    def __init__(self, collection, counter):
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in ("find", "aggregate"):
+            def cursor(*args, **kwargs):
+                return _CountingCursor(attr(*args, **kwargs), self._counter)
+            return cursor
+        if name in _ROUND_TRIP_METHODS:
+            async def call(*args, **kwargs):
+                self._counter.count += 1
+                return await attr(*args, **kwargs)
+            return call
+        return attr
+
+
+class _CountingDatabase:
+    """Database proxy handing out counting collections"""
+
+    def __init__(self, database, counter):
+        self._database = database
+        self._counter = counter
+
+    def __getattr__(self, name):
+        return _CountingCollection(getattr(self._database, name), self._counter)
+
+    def __getitem__(self, name):
+        return _CountingCollection(self._database[name], self._counter)
+
+
+def parser(description):
+    """Argument parser with the options every benchmark accepts"""
+    arg_parser = argparse.ArgumentParser(description=description)
+    arg_parser.add_argument("--mock", action="store_true",
+                            help="use mongomock-motor instead of a live MongoDB")
+    arg_parser.add_argument("--repeat", type=int, default=20,
+                            help="calls per measurement")
+    return arg_parser
+
+
+def connect(mock=False):
+    """Point the app at a scratch database and return it with its round-trip counter"""
+    counter = RoundTripCounter()
+    if mock:
+        from mongomock_motor import AsyncMongoMockClient
+        database = _CountingDatabase(AsyncMongoMockClient()[BENCH_DATABASE], counter)
+    else:
+        client = AsyncIOMotorClient(BENCH_MONGO_URL, event_listeners=[counter])
+        database = client[BENCH_DATABASE]
+    server.storage = MongoStorage(database, server.DEFAULT_RESTAURANT_ID)
+    return database, counter
+
+
+def asgi_client():
+    """HTTP client wired straight into the ASGI app"""
+    transport = httpx.ASGITransport(app=server.app)
+    return httpx.AsyncClient(transport=transport, base_url="http://bench")
+
+
+async def fresh_restaurant(restaurant_id=None):
+    """Empty a restaurant of ``server.storage``, then seed and serve it"""
+    restaurant_id = restaurant_id or server.DEFAULT_RESTAURANT_ID
+    await server.storage.repository(restaurant_id).reset()
+    return await server.open_restaurant(restaurant_id)
+
+
+async def seed_floor(database, tables, items_per_table, closed_orders_per_table=0, restaurant_id=None):
+    """Seed the menu plus ``tables`` occupied tables with one open order each"""
+    restaurant = await fresh_restaurant(restaurant_id)
+    await database.tables.delete_many({"restaurant_id": restaurant.id})
+    products = restaurant.catalog.products
+
+    table_docs, orders, items = [], [], []
+    for number in range(1, tables + 1):
+        table = {
+            "id": str(uuid.uuid4()),
+            "number": number,
+            "status": "occupied",
+            "covers": 2,
+            "use_count": closed_orders_per_table + 1,
+            "is_closed": False
+        }
+        table_docs.append(table)
+        for index in range(closed_orders_per_table + 1):
+            order = {
+                "id": str(uuid.uuid4()),
+                "table_id": table["id"],
+                "created_at": datetime.now(),
+                "is_sent": False,
+                "is_closed": index < closed_orders_per_table,
+                "items_count": items_per_table,
+                "total": 0.0
+            }
+            orders.append(order)
+            if not order["is_closed"]:
+                table["order_id"] = order["id"]
+            for position in range(items_per_table):
+                product = products[position % len(products)]
+                items.append({
+                    "id": str(uuid.uuid4()),
+                    "order_id": order["id"],
+                    "product_id": product["id"],
+                    "name": product["name"],
+                    "price": product["price"],
+                    "product_type": product["type"],
+                    "dough_type": None,
+                    "extras": [],
+                    "total_price": product["price"]
+                })
+                order["total"] += product["price"]
+
+    if table_docs:
+        await restaurant.repo.insert_tables(table_docs)
+        await restaurant.repo.insert_orders(orders)
+    if items:
+        await restaurant.repo.insert_items(items)
+    return table_docs
+
+
+async def seed_restaurant(database, tables, open_orders, items_per_order, days=0, orders_per_day=0,
+                          restaurant_id=None):
+    """Seed a restaurant the size of a real one
+
+    ``tables`` tables, the first ``open_orders`` of them occupied with an open
+    order of ``items_per_order`` items, and ``days`` of closed orders,
+    ``orders_per_day`` a day with as many items, taken round the tables.
+    Closed orders get their stored receipt and rollups as closing a table
+    gives them, and those closed longer ago than the archive threshold are
+    archived. Returns the tables and the ids of the open, closed and archived
+    orders.
+    """
+    restaurant = await fresh_restaurant(restaurant_id)
+    await database.tables.delete_many({"restaurant_id": restaurant.id})
+    products = restaurant.catalog.products
+    now = datetime.now()
+
+    table_docs = [
+        {"id": str(uuid.uuid4()), "number": number, "status": "free", "covers": 0, "use_count": 0,
+         "is_closed": False}
+        for number in range(1, tables + 1)
+    ]
+    orders, items, receipts, increments = [], [], [], {}
+
+    def add_order(table, created_at, closed_at=None):
+        order = {
+            "id": str(uuid.uuid4()),
+            "table_id": table["id"],
+            "created_at": created_at,
+            "is_sent": closed_at is not None,
+            "is_closed": closed_at is not None,
+            "items_count": items_per_order,
+            "total": 0.0
+        }
+        if closed_at is not None:
+            order["closed_at"] = closed_at
+        order_items = []
+        for position in range(items_per_order):
+            product = products[position % len(products)]
+            order_items.append({
+                "id": str(uuid.uuid4()),
+                "order_id": order["id"],
+                "product_id": product["id"],
+                "name": product["name"],
+                "price": product["price"],
+                "product_type": product["type"],
+                "dough_type": None,
+                "extras": [],
+                "extra_ids": [],
+                "unit_price": product["price"],
+                "quantity": 1,
+                "total_price": product["price"]
+            })
+            order["total"] += product["price"]
+        orders.append(order)
+        items.extend(order_items)
+        table["use_count"] += 1
+        if closed_at is None:
+            table.update(status="occupied", covers=2, order_id=order["id"])
+        else:
+            receipts.append({"order_id": order["id"], **server.build_receipt(order, dict(table), order_items)})
+            # Fold the increments here, so the seed writes each rollup once
+            for increment in rollup_increments(order, order_items, restaurant.catalog.products_by_id):
+                folded = increments.setdefault(increment["id"], {**increment, "revenue": 0.0, "items_count": 0,
+                                                                 "orders_count": 0})
+                for field in ("revenue", "items_count", "orders_count"):
+                    folded[field] += increment[field]
+        return order
+
+    open_ids = [add_order(table, now)["id"] for table in table_docs[:open_orders]]
+    closed_ids, archived_ids = [], []
+    archive_before = now - timedelta(seconds=server.ARCHIVE_AFTER_SECONDS)
+    for day in range(days):
+        for index in range(orders_per_day):
+            created_at = now - timedelta(days=day, hours=1 + 12 * index / orders_per_day)
+            order = add_order(table_docs[index % tables], created_at, created_at + timedelta(minutes=45))
+            (archived_ids if order["closed_at"] < archive_before else closed_ids).append(order["id"])
+
+    repo = restaurant.repo
+    await repo.insert_tables(table_docs)
+    if orders:
+        await repo.insert_orders(orders)
+        await repo.insert_items(items)
+    if receipts:
+        await asyncio.gather(repo.save_receipts(receipts), repo.add_to_rollups(list(increments.values())))
+        await server.archive_closed_orders(repo)
+    return {"tables": table_docs, "open": open_ids, "closed": closed_ids, "archived": archived_ids}
+
+
+async def measure(call, counter, repeat, setup=None, allocations=False):
+    """Run ``call`` ``repeat`` times and return round trips per call and latency in ms
+
+    ``setup`` runs before each call and counts towards neither. With
+    ``allocations``, a second pass under tracemalloc adds ``alloc_kib``: the
+    median peak of memory a call allocated on top of what it started with.
+    """
+    if setup:
+        await setup()
+    await call()  # warm up
+    timings = []
+    round_trips = 0
+    for _ in range(repeat):
+        if setup:
+            await setup()
+        start_count = counter.count
+        started = time.perf_counter()
+        await call()
+        timings.append((time.perf_counter() - started) * 1000)
+        round_trips += counter.count - start_count
+    result = {
+        "round_trips": round_trips / repeat,
+        "median_ms": statistics.median(timings),
+        "p95_ms": percentile(timings, 0.95),
+    }
+    if allocations:
+        result["alloc_kib"] = await measure_allocations(call, repeat, setup)
+    return result
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile: the smallest value at least ``fraction`` of the values are not above"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(len(ordered) * fraction) - 1)]
+
+
+async def measure_allocations(call, repeat, setup=None):
+    """Median peak KiB ``call`` allocates, traced apart from the timed calls it would slow down"""
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(repeat):
+            if setup:
+                await setup()
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            await call()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append((peak - before) / 1024)
+    finally:
+        tracemalloc.stop()
+    return statistics.median(peaks)
+
+
+def print_rows(headers, rows):
+    """Print rows as an aligned plain-text table"""
+    widths = [max(len(str(value)) for value in column) for column in zip(headers, *rows)]
+    for row in [headers, *rows]:
+        print("  ".join(str(value).rjust(width) for value, width in zip(row, widths)))
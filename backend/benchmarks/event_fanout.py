@@ -0,0 +1,96 @@
+"""Fan-out of live events to hundreds of GET /api/events subscribers on one worker
+
+Starts the app on a local uvicorn server (no database is needed), opens one
+streaming HTTP connection per simulated tablet and measures how long a
+published event takes to reach every subscriber. The readers share the
+process with the server, so the delays are an upper bound.
+"""
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import time
+
+import httpx
+import uvicorn
+
+import server
+from benchmarks.common import print_rows
+from storage.memory import MemoryRepository
+
+SUBSCRIBER_COUNTS = [100, 300, 500]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def subscribe(client, received):
+    """Read the event stream, recording the delivery delay of each benchmark event"""
+    async with client.stream("GET", "/api/events") as response:
+        async for line in response.aiter_lines():
+            if line.startswith("data: ") and "sent_at" in line:
+                received.append(time.perf_counter() - json.loads(line[6:])["sent_at"])
+
+
+async def run(base_url, events, subscribers, event_count):
+    received = []
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=None) as client:
+        readers = [asyncio.create_task(subscribe(client, received)) for _ in range(subscribers)]
+        while len(events.subscribers) < subscribers:
+            await asyncio.sleep(0.01)
+
+        publish_costs, last_delivery = [], []
+        for sequence in range(1, event_count + 1):
+            started = time.perf_counter()
+            events.publish("benchmark", {"sent_at": started, "payload": "x" * 200})
+            publish_costs.append(time.perf_counter() - started)
+            while len(received) < subscribers * sequence:
+                await asyncio.sleep(0.001)
+            last_delivery.append(max(received[-subscribers:]))
+
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+
+    delays = sorted(received)
+    return [
+        subscribers,
+        f"{statistics.median(publish_costs) * 1e6:.0f}",
+        f"{statistics.median(delays) * 1000:.2f}",
+        f"{delays[int(len(delays) * 0.99) - 1] * 1000:.2f}",
+        f"{statistics.median(last_delivery) * 1000:.2f}",
+    ]
+
+
+async def main(args):
+    port = free_port()
+    config = uvicorn.Config(server.app, host="127.0.0.1", port=port, lifespan="off", log_level="warning")
+    uvicorn_server = uvicorn.Server(config)
+    serving = asyncio.create_task(uvicorn_server.serve())
+    while not uvicorn_server.started:
+        await asyncio.sleep(0.01)
+
+    # Events only; the restaurant is never seeded
+    restaurant = server.Restaurant(server.DEFAULT_RESTAURANT_ID, MemoryRepository())
+    server.restaurants[restaurant.id] = restaurant
+
+    rows = []
+    for subscribers in args.subscribers:
+        rows.append(await run(f"http://127.0.0.1:{port}", restaurant.events, subscribers, args.events))
+
+    uvicorn_server.should_exit = True
+    await serving
+    print_rows(["subscribers", "publish us", "median ms", "p99 ms", "all reached ms"], rows)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--subscribers", type=int, nargs="+", default=SUBSCRIBER_COUNTS,
+                            help="subscriber counts to measure")
+    arg_parser.add_argument("--events", type=int, default=50, help="events published per run")
+    asyncio.run(main(arg_parser.parse_args()))
@@ -0,0 +1,296 @@
+"""Replay captured API traffic against the app in-process
+
+Plays a capture written with CAPTURE_PATH (see capture.py) through httpx's
+ASGI transport against the memory backend or mongomock (``--storage``),
+``--speed`` times faster than it was recorded. ``--copies`` plays the capture
+that many times at once, each copy against its own freshly seeded
+restaurants, as if that many times the waiters were at work.
+
+Ids are mapped onto the copy: tables by number, catalog entries by code, and
+the ids a write handed out by their position in its response. Within a copy,
+a request waits for every request that had answered before it was recorded
+arriving, so a close never overtakes the read that came before it; requests
+that overlapped when recorded overlap again. Orders open when capture started
+are opened first; their earlier items are unknown to the copy, so requests
+touching them fail like on a fresh floor.
+
+Reports the throughput, and per route the p50/p95/p99 latency, the share of
+errors (5xx or no response) and of statuses other than recorded. With
+``--strict`` the exit status is 1 when any request got another status.
+"""
+import asyncio
+import bisect
+import heapq
+import re
+import sys
+import time
+from collections import defaultdict
+
+import orjson
+
+import server
+from benchmarks.common import asgi_client, connect, fresh_restaurant, percentile, print_rows
+from capture import UUID_PATTERN, open_capture
+from storage.memory import MemoryStorage
+
+UUID_TEXT_PATTERN = re.compile(UUID_PATTERN.pattern.decode())
+# Seconds a request waits for the request handing out an id it uses
+DEPENDENCY_TIMEOUT = 30
+# Rounding of the recorded start and duration: a request that answered this
+# close to another one arriving still counts as having answered before it
+CLOCK_SLACK = 0.000002
+ROUTE_PREFIX = "/api/restaurants/{restaurant_id}"
+
+
+def read_capture(path):
+    """Restaurant snapshots and requests of a capture, requests in time order
+
+    A capture cut short by a killed server is read up to its last whole line.
+    """
+    snapshots, requests = [], []
+    with open_capture(path, "rb") as capture_file:
+        try:
+            for line in capture_file:
+                if not line.endswith(b"\n"):
+                    break
+                entry = orjson.loads(line)
+                if "snapshot" in entry:
+                    snapshots.append(entry["snapshot"])
+                else:
+                    requests.append(entry)
+        except EOFError:
+            pass
+    requests.sort(key=lambda entry: entry["t"])
+    return snapshots, requests
+
+
+def request_order(requests):
+    """For each request, its rank by recorded end and how many of the first ranks answered before it arrived
+
+    A request only ever waits on lower ranks than its own, so no two requests
+    wait on each other.
+    """
+    ends = [request["t"] + request["ms"] / 1000 for request in requests]
+    by_end = sorted(range(len(requests)), key=ends.__getitem__)
+    ranks = [0] * len(requests)
+    for rank, index in enumerate(by_end):
+        ranks[index] = rank
+    ordered_ends = [ends[index] for index in by_end]
+    return [
+        (ranks[index], min(bisect.bisect_left(ordered_ends, request["t"] + CLOCK_SLACK), ranks[index]))
+        for index, request in enumerate(requests)
+    ]
+
+
+def restaurant_of(path):
+    """Restaurant a captured path addresses, None for the bare /api routes, and the path below it"""
+    if path.startswith("/api/restaurants/"):
+        restaurant_id, _, rest = path[len("/api/restaurants/"):].partition("/")
+        return restaurant_id, "/" + rest
+    return None, path[len("/api"):]
+
+
+class IdMap:
+    """Captured ids of one copy, mapped to the ids the copy handed out"""
+
+    def __init__(self, produced):
+        # Ids some captured write handed out; requests using them wait for it
+        self.produced = produced
+        self.ids = {}
+        self.ready = defaultdict(asyncio.Event)
+
+    def set(self, captured_id, replay_id):
+        self.ids[captured_id] = replay_id
+        self.ready[captured_id].set()
+
+    async def resolve(self, text):
+        """``text`` with every captured id replaced, once all of them are known"""
+        for captured_id in set(UUID_TEXT_PATTERN.findall(text)):
+            if captured_id in self.produced and captured_id not in self.ids:
+                try:
+                    await asyncio.wait_for(self.ready[captured_id].wait(), DEPENDENCY_TIMEOUT)
+                except asyncio.TimeoutError:
+                    self.set(captured_id, captured_id)
+        return UUID_TEXT_PATTERN.sub(lambda match: self.ids.get(match.group(), match.group()), text)
+
+
+class Completions:
+    """Requests of one copy that answered, by rank of their recorded end"""
+
+    def __init__(self, count):
+        self.done = [False] * count
+        # Every rank below this one answered
+        self.frontier = 0
+        self.waiters = []
+
+    async def wait(self, count):
+        """Wait until the first ``count`` ranks answered"""
+        if self.frontier < count:
+            ready = asyncio.Event()
+            heapq.heappush(self.waiters, (count, id(ready), ready))
+            await ready.wait()
+
+    def finish(self, rank):
+        self.done[rank] = True
+        while self.frontier < len(self.done) and self.done[self.frontier]:
+            self.frontier += 1
+        while self.waiters and self.waiters[0][0] <= self.frontier:
+            heapq.heappop(self.waiters)[2].set()
+
+
+class Copy:
+    """One copy of the captured restaurants, seeded fresh"""
+
+    def __init__(self, index, produced, count):
+        self.index = index
+        self.ids = IdMap(produced)
+        self.completions = Completions(count)
+
+    def restaurant_id(self, captured_id):
+        # Restaurants the capture has no snapshot of are not served, as they were not
+        return f"r{self.index}-{captured_id}"[:40]
+
+    async def seed(self, client, snapshot):
+        restaurant_id = self.restaurant_id(snapshot["restaurant"])
+        restaurant = await fresh_restaurant(restaurant_id)
+
+        tables = {table["number"]: table["id"] for table in await restaurant.repo.list_floor()}
+        for captured_id, number in snapshot["tables"].items():
+            if number in tables:
+                self.ids.set(captured_id, tables[number])
+        for section, entries in (("products", restaurant.catalog.products), ("extras", restaurant.catalog.extras)):
+            codes = {entry.get("code"): entry["id"] for entry in entries}
+            for captured_id, code in snapshot[section].items():
+                if code in codes:
+                    self.ids.set(captured_id, codes[code])
+
+        for captured_id, table in snapshot["open_tables"].items():
+            response = await client.post(f"/api/restaurants/{restaurant_id}/tables/open", json={
+                "table_id": self.ids.ids.get(captured_id, captured_id), "covers": table["covers"]
+            })
+            if response.status_code == 200:
+                self.ids.set(table["order_id"], response.json()["order_id"])
+
+    async def play(self, client, request, order, default_restaurant, results):
+        rank, after = order
+        try:
+            await self.completions.wait(after)
+            await self.send(client, request, default_restaurant, results)
+        finally:
+            self.completions.finish(rank)
+
+    async def send(self, client, request, default_restaurant, results):
+        captured_restaurant, path = restaurant_of(request["path"])
+        restaurant_id = self.restaurant_id(captured_restaurant or default_restaurant)
+        path = await self.ids.resolve(path)
+        query = await self.ids.resolve(request.get("query", ""))
+        body = await self.ids.resolve(request.get("body", ""))
+        route = request["route"].replace(ROUTE_PREFIX, "/api", 1)
+
+        started = time.perf_counter()
+        try:
+            response = await client.request(
+                request["method"],
+                f"/api/restaurants/{restaurant_id}{path}" + (f"?{query}" if query else ""),
+                content=body.encode() if body else None,
+                headers={"content-type": "application/json"} if body else None
+            )
+        except Exception:
+            results.append((route, (time.perf_counter() - started) * 1000, None, request["status"]))
+            status, replay_ids = None, []
+        else:
+            results.append((route, (time.perf_counter() - started) * 1000, response.status_code, request["status"]))
+            status = response.status_code
+            replay_ids = [value.decode() for value in UUID_PATTERN.findall(response.content)]
+
+        # Requests waiting on ids this one should have handed out go ahead either way
+        captured_ids = request.get("ids", [])
+        if status is not None and status < 400 and len(replay_ids) == len(captured_ids):
+            for captured_id, replay_id in zip(captured_ids, replay_ids):
+                self.ids.set(captured_id, replay_id)
+        else:
+            for captured_id in captured_ids:
+                if captured_id not in self.ids.ids:
+                    self.ids.set(captured_id, captured_id)
+
+
+def use_storage(storage):
+    if storage == "memory":
+        server.storage = MemoryStorage()
+    else:
+        connect(mock=storage == "mock")
+    server.restaurants.clear()
+
+
+def report(results, elapsed):
+    by_route = defaultdict(list)
+    for result in results:
+        by_route[result[0]].append(result)
+
+    rows = []
+    for route, route_results in sorted(by_route.items()):
+        latencies = [latency for _, latency, _, _ in route_results]
+        errors = sum(1 for _, _, status, _ in route_results if status is None or status >= 500)
+        mismatched = sum(1 for _, _, status, recorded in route_results if status != recorded)
+        rows.append([
+            route, len(route_results),
+            f"{percentile(latencies, 0.5):.2f}", f"{percentile(latencies, 0.95):.2f}",
+            f"{percentile(latencies, 0.99):.2f}",
+            f"{100 * errors / len(route_results):.1f}", f"{100 * mismatched / len(route_results):.1f}"
+        ])
+    print_rows(["route", "requests", "p50 ms", "p95 ms", "p99 ms", "errors %", "other status %"], rows)
+    print(f"\n{len(results)} requests in {elapsed:.2f} s: {len(results) / elapsed:.1f} requests/s")
+    return sum(1 for _, _, status, recorded in results if status != recorded)
+
+
+async def main(args):
+    snapshots, requests = read_capture(args.capture)
+    if not requests:
+        raise SystemExit("The capture holds no requests")
+    use_storage(args.storage)
+    default_restaurant = server.DEFAULT_RESTAURANT_ID
+    if snapshots and default_restaurant not in {snapshot["restaurant"] for snapshot in snapshots}:
+        default_restaurant = snapshots[0]["restaurant"]
+    produced = {captured_id for request in requests for captured_id in request.get("ids", [])}
+    orders = request_order(requests)
+
+    results = []
+    async with asgi_client() as client:
+        copies = [Copy(index, produced, len(requests)) for index in range(args.copies)]
+        for copy in copies:
+            for snapshot in snapshots:
+                await copy.seed(client, snapshot)
+
+        first = requests[0]["t"]
+        started = time.perf_counter()
+        tasks = []
+        for request, order in zip(requests, orders):
+            delay = (request["t"] - first) / args.speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.extend(
+                asyncio.create_task(copy.play(client, request, order, default_restaurant, results))
+                for copy in copies
+            )
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    mismatched = report(results, elapsed)
+    if args.strict and mismatched:
+        print(f"{mismatched} requests got another status than recorded")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("capture", help="capture file written with CAPTURE_PATH")
+    arg_parser.add_argument("--storage", choices=["memory", "mock", "mongo"], default="memory",
+                            help="backend to replay against; mongo uses BENCH_MONGO_URL")
+    arg_parser.add_argument("--speed", type=float, default=1.0, help="times faster than recorded")
+    arg_parser.add_argument("--copies", type=int, default=1, help="copies of the capture played at once")
+    arg_parser.add_argument("--strict", action="store_true",
+                            help="exit with status 1 when a request gets another status than recorded")
+    sys.exit(asyncio.run(main(arg_parser.parse_args())))
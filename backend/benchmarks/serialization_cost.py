@@ -0,0 +1,137 @@
+"""Serialization cost of the table listing and the receipt, before and after
+
+"before" replays the path the API used to take: every document walked by the
+recursive serialize_mongo_doc, then FastAPI's jsonable_encoder, then
+json.dumps inside JSONResponse. "after" is what the routes do now: documents
+fetched without _id go straight into ORJSONResponse.
+"""
+import argparse
+import timeit
+import uuid
+from datetime import datetime
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+import server
+from benchmarks.common import print_rows
+
+TABLE_COUNTS = [12, 60, 120]
+RECEIPT_SIZES = [10, 50, 200]
+
+
+def legacy_serialize_mongo_doc(doc):
+    """The recursive walk the routes used before projecting _id out"""
+    if doc is None:
+        return None
+
+    result = {}
+    for key, value in doc.items():
+        if isinstance(value, ObjectId):
+            result[key] = str(value)
+        elif isinstance(value, list):
+            result[key] = [legacy_serialize_mongo_doc(item) if isinstance(item, dict) else
+                           str(item) if isinstance(item, ObjectId) else item
+                           for item in value]
+        elif isinstance(value, dict):
+            result[key] = legacy_serialize_mongo_doc(value)
+        else:
+            result[key] = value
+    return result
+
+
+def make_table(number, with_id):
+    table = {
+        "id": str(uuid.uuid4()),
+        "number": number,
+        "status": "occupied",
+        "covers": 4,
+        "use_count": 17,
+        "is_closed": False,
+        "items_count": 6,
+        "total": 71.5
+    }
+    if with_id:
+        table["_id"] = ObjectId()
+    return table
+
+
+def make_item(position, order_id, with_id):
+    item = {
+        "id": str(uuid.uuid4()),
+        "order_id": order_id,
+        "product_id": str(uuid.uuid4()),
+        "name": "Margherita",
+        "price": 9.0,
+        "product_type": "pizzeria" if position % 2 else "kitchen",
+        "dough_type": "Senza Glutine" if position % 4 == 1 else "Classica",
+        "extras": [{"id": str(uuid.uuid4()), "name": "Bufala", "price": 2.0}],
+        "total_price": 13.0
+    }
+    if with_id:
+        item["_id"] = ObjectId()
+    return item
+
+
+def make_receipt_parts(size, with_id):
+    order = {
+        "id": str(uuid.uuid4()),
+        "table_id": str(uuid.uuid4()),
+        "created_at": datetime.now(),
+        "is_sent": True,
+        "is_closed": False,
+        "items_count": size,
+        "total": 13.0 * size
+    }
+    if with_id:
+        order["_id"] = ObjectId()
+    items = [make_item(position, order["id"], with_id) for position in range(size)]
+    return order, make_table(1, with_id), items
+
+
+def tables_before(tables):
+    content = [legacy_serialize_mongo_doc(table) for table in tables]
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def tables_after(tables):
+    return ORJSONResponse(tables).body
+
+
+def receipt_before(order, table, items):
+    order = legacy_serialize_mongo_doc(order)
+    table = legacy_serialize_mongo_doc(table)
+    items = [legacy_serialize_mongo_doc(item) for item in items]
+    return JSONResponse(jsonable_encoder(server.build_receipt(order, table, items))).body
+
+
+def receipt_after(order, table, items):
+    return ORJSONResponse(server.build_receipt(order, table, items)).body
+
+
+def per_call_us(function, *args, repeat):
+    return min(timeit.repeat(lambda: function(*args), number=repeat, repeat=5)) / repeat * 1e6
+
+
+def main(args):
+    rows = []
+    for count in TABLE_COUNTS:
+        legacy = [make_table(number, True) for number in range(count)]
+        projected = [make_table(number, False) for number in range(count)]
+        before = per_call_us(tables_before, legacy, repeat=args.repeat)
+        after = per_call_us(tables_after, projected, repeat=args.repeat)
+        rows.append([f"GET /api/tables ({count} tables)", f"{before:.1f}", f"{after:.1f}", f"{before / after:.1f}x"])
+
+    for size in RECEIPT_SIZES:
+        before = per_call_us(receipt_before, *make_receipt_parts(size, True), repeat=args.repeat)
+        after = per_call_us(receipt_after, *make_receipt_parts(size, False), repeat=args.repeat)
+        rows.append([f"GET receipt ({size} items)", f"{before:.1f}", f"{after:.1f}", f"{before / after:.1f}x"])
+
+    print_rows(["response", "before us", "after us", "speedup"], rows)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--repeat", type=int, default=200, help="calls per timing run")
+    main(arg_parser.parse_args())
@@ -0,0 +1,306 @@
+"""Latency, allocations and round trips of every route, with a regression gate
+
+Seeds a synthetic restaurant sized by ``--tables``, ``--open-orders``,
+``--items-per-order`` and ``--months`` of closed history
+(``--orders-per-day``), then calls each route through httpx's ASGI transport
+and records per call the median and p95 latency, the Mongo round trips and the
+peak memory allocated (``alloc_kib``, traced in a separate pass). Two scaling
+curves follow on freshly seeded restaurants: GET /api/tables as the occupied
+floor grows (``--curve-tables``), and GET /api/orders/{id}/receipt of an open
+order and of a closed one with its receipt stored, as orders grow
+(``--curve-items``).
+
+Results are written as JSON to ``--output``. With ``--baseline`` they are
+compared with an earlier results file: a case regresses when its round trips
+go up at all, or its median latency or allocations go up by more than
+``--tolerance`` and by more than noise. Regressions are listed in the results
+and the run exits with status 1, so CI can gate on it. ``--compare RESULTS``
+compares a results file with the baseline without running anything.
+
+mongomock runs in-process, so with ``--mock`` its own work counts towards
+latency and allocations; compare only results taken on the same storage.
+"""
+import asyncio
+import platform
+from datetime import date, datetime, timedelta
+
+import orjson
+
+import server
+from benchmarks.common import asgi_client, connect, measure, parser, print_rows, seed_restaurant
+
+RESULTS_VERSION = 1
+DAYS_PER_MONTH = 30
+# Days of history the export case streams
+EXPORT_DAYS = 7
+# Lines of the add-items case
+BATCH_LINES = 5
+COMPARED_METRICS = ("median_ms", "alloc_kib")
+# Changes smaller than this are noise, whatever the tolerance
+NOISE_FLOORS = {"median_ms": 0.05, "alloc_kib": 4.0}
+
+
+def call(client, method, path, **kwargs):
+    """Request expected to succeed"""
+    async def request():
+        response = await client.request(method, path, **kwargs)
+        response.raise_for_status()
+        return response
+    return request
+
+
+def route_cases(client, seeded, args):
+    """Name, call and setup of each route case, reads first so the writes don't change what they read"""
+    restaurant = server.restaurants[server.DEFAULT_RESTAURANT_ID]
+    products = restaurant.catalog.products
+    table_id = seeded["tables"][0]["id"]
+    order_id = seeded["open"][0]
+    today = date.today()
+    line = {"table_id": table_id, "product_id": products[0]["id"]}
+
+    cases = [
+        ("get_tables", call(client, "GET", "/api/tables"), None),
+        ("get_tables_unchanged", call(client, "GET", "/api/tables", params={"since": seeded["seq"]}), None),
+        ("get_table", call(client, "GET", f"/api/tables/{table_id}"), None),
+        ("get_table_bootstrap", call(client, "GET", f"/api/tables/{table_id}/bootstrap"), None),
+        ("get_table_bootstrap_cached", call(client, "GET", f"/api/tables/{table_id}/bootstrap",
+                                            params={"catalog_version": restaurant.catalog.version}), None),
+        ("get_order_for_table", call(client, "GET", f"/api/orders/table/{table_id}"), None),
+        ("get_order", call(client, "GET", f"/api/orders/{order_id}"), None),
+        ("get_receipt", call(client, "GET", f"/api/orders/{order_id}/receipt"), None),
+    ]
+    if seeded["closed"]:
+        cases.append(("get_receipt_stored", call(client, "GET", f"/api/orders/{seeded['closed'][0]}/receipt"), None))
+    if seeded["archived"]:
+        cases.append(("get_order_archived", call(client, "GET", f"/api/orders/{seeded['archived'][0]}"), None))
+    cases += [
+        ("get_products", call(client, "GET", "/api/products"), None),
+        ("get_categories", call(client, "GET", "/api/products/categories"), None),
+        ("get_dough_types", call(client, "GET", "/api/dough-types"), None),
+        ("get_extras", call(client, "GET", "/api/extras"), None),
+        ("export_catalog", call(client, "GET", "/api/catalog/export"), None),
+        ("export_orders", call(client, "GET", "/api/exports/orders", params={
+            "start": (today - timedelta(days=EXPORT_DAYS - 1)).isoformat(), "end": today.isoformat()
+        }), None),
+        ("get_sales_report_day", call(client, "GET", "/api/reports/day"), None),
+        ("get_sales_report_product", call(client, "GET", "/api/reports/product"), None),
+        ("get_station_tickets", call(client, "GET", "/api/stations/kitchen/tickets"), None),
+        ("add_item", call(client, "POST", "/api/orders/add-item", json=line), None),
+        ("add_items", call(client, "POST", "/api/orders/add-items", json={
+            "table_id": table_id,
+            "items": [{"product_id": product["id"]} for product in products[:BATCH_LINES]]
+        }), None),
+    ]
+
+    # Each removal takes one off a line the setup adds two to
+    added = {}
+
+    async def add_two():
+        response = await client.post("/api/orders/add-item", json={**line, "product_id": products[1]["id"],
+                                                                    "quantity": 2})
+        added["item_id"] = response.json()["item"]["id"]
+
+    async def remove_one():
+        response = await client.delete(f"/api/orders/items/{added['item_id']}", params={"quantity": 1})
+        response.raise_for_status()
+
+    cases.append(("remove_item", remove_one, add_two))
+    cases.append(("send_order", call(client, "POST", f"/api/orders/{order_id}/send"),
+                  call(client, "POST", "/api/orders/add-item", json=line)))
+
+    if len(seeded["tables"]) > len(seeded["open"]):
+        spare_id = seeded["tables"][-1]["id"]
+        spare = {"table_id": spare_id, "covers": 2}
+
+        # The setups find the spare table as the other case left it, so they don't check
+        async def close_spare():
+            await client.post(f"/api/tables/{spare_id}/close")
+
+        async def open_spare():
+            await client.post("/api/tables/open", json=spare)
+
+        cases.append(("open_table", call(client, "POST", "/api/tables/open", json=spare), close_spare))
+        cases.append(("close_table", call(client, "POST", f"/api/tables/{spare_id}/close"), open_spare))
+    return cases
+
+
+async def floor_curve(client, database, counter, args):
+    """GET /api/tables with every table occupied, as the floor grows"""
+    points = []
+    for tables in args.curve_tables:
+        await seed_restaurant(database, tables, tables, args.items_per_order)
+        result = await measure(call(client, "GET", "/api/tables"), counter, args.repeat, allocations=True)
+        points.append({"tables": tables, **result})
+    return points
+
+
+async def receipt_curves(client, database, counter, args):
+    """GET /api/orders/{id}/receipt of an open order, built per call, and of a closed one, as orders grow"""
+    curves = {"get_receipt_open": [], "get_receipt_stored": []}
+    for items in args.curve_items:
+        # One order closed an hour ago, its receipt stored and not archived yet
+        seeded = await seed_restaurant(database, 2, 1, items, days=1, orders_per_day=1)
+        for name, order_ids in (("get_receipt_open", seeded["open"]), ("get_receipt_stored", seeded["closed"])):
+            result = await measure(call(client, "GET", f"/api/orders/{order_ids[0]}/receipt"), counter,
+                                   args.repeat, allocations=True)
+            curves[name].append({"items": items, **result})
+    return curves
+
+
+def measurements(results):
+    """Name and metrics of every case and curve point of a results file"""
+    for name, result in results["cases"].items():
+        yield name, result
+    for curve, points in results["curves"].items():
+        for point in points:
+            x_name = "tables" if "tables" in point else "items"
+            yield f"{curve}[{x_name}={point[x_name]}]", point
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of ``results`` against ``baseline``
+
+    A case of the baseline the results lack is a regression too, so dropping
+    a case can't get it past the gate.
+    """
+    before = dict(measurements(baseline))
+    current = dict(measurements(results))
+    regressions = [
+        {"case": name, "metric": "missing", "baseline": None, "current": None}
+        for name in before if name not in current
+    ]
+    for name, result in current.items():
+        if name not in before:
+            continue
+        if result["round_trips"] > before[name]["round_trips"]:
+            regressions.append({"case": name, "metric": "round_trips", "baseline": before[name]["round_trips"],
+                                "current": result["round_trips"]})
+        for metric in COMPARED_METRICS:
+            if metric not in result or metric not in before[name]:
+                continue
+            now, previous = result[metric], before[name][metric]
+            if now > previous * (1 + tolerance) and now - previous > NOISE_FLOORS[metric]:
+                regressions.append({"case": name, "metric": metric, "baseline": previous, "current": now})
+    return regressions
+
+
+def print_results(results):
+    rows = [
+        [name, f"{result['round_trips']:g}", f"{result['median_ms']:.2f}", f"{result['p95_ms']:.2f}",
+         f"{result.get('alloc_kib', 0):.1f}"]
+        for name, result in measurements(results)
+    ]
+    print_rows(["case", "round trips", "median ms", "p95 ms", "alloc KiB"], rows)
+
+
+def print_regressions(regressions):
+    if not regressions:
+        print("\nNo regressions against the baseline")
+        return
+    print(f"\n{len(regressions)} regressions against the baseline:")
+    print_rows(["case", "metric", "baseline", "current"], [
+        [regression["case"], regression["metric"], format_metric(regression["baseline"]),
+         format_metric(regression["current"])]
+        for regression in regressions
+    ])
+
+
+def format_metric(value):
+    return "-" if value is None else f"{value:.2f}"
+
+
+def load_results(path):
+    with open(path, "rb") as results_file:
+        results = orjson.loads(results_file.read())
+    if results.get("version") != RESULTS_VERSION:
+        raise SystemExit(f"{path} is not a version {RESULTS_VERSION} results file")
+    return results
+
+
+def check_baseline(results, baseline, tolerance):
+    """Regressions against the baseline, noting when it was taken on another storage or size"""
+    for key in ("storage", "restaurant"):
+        if results[key] != baseline[key]:
+            print(f"Note: the baseline {key} differs, {baseline[key]} against {results[key]}")
+    regressions = compare(results, baseline, tolerance)
+    new_cases = [name for name, _ in measurements(results) if name not in dict(measurements(baseline))]
+    if new_cases:
+        print(f"Note: not in the baseline, so not compared: {', '.join(new_cases)}")
+    print_regressions(regressions)
+    return regressions
+
+
+async def run(args):
+    database, counter = connect(args.mock)
+    seeded = await seed_restaurant(
+        database, args.tables, args.open_orders, args.items_per_order,
+        days=args.months * DAYS_PER_MONTH, orders_per_day=args.orders_per_day
+    )
+
+    cases = {}
+    async with asgi_client() as client:
+        seeded["seq"] = int((await client.get("/api/tables")).headers["X-Change-Seq"])
+        for name, case, setup in route_cases(client, seeded, args):
+            cases[name] = await measure(case, counter, args.repeat, setup=setup, allocations=True)
+
+        curves = {"get_tables": await floor_curve(client, database, counter, args)}
+        curves.update(await receipt_curves(client, database, counter, args))
+
+    return {
+        "version": RESULTS_VERSION,
+        "taken_at": datetime.now().isoformat(timespec="seconds"),
+        "storage": "mongomock" if args.mock else "mongo",
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "restaurant": {
+            "tables": args.tables,
+            "open_orders": args.open_orders,
+            "items_per_order": args.items_per_order,
+            "months": args.months,
+            "orders_per_day": args.orders_per_day,
+        },
+        "cases": cases,
+        "curves": curves,
+    }
+
+
+async def main(args):
+    if not 1 <= args.open_orders <= args.tables:
+        raise SystemExit("--open-orders must be from 1 to --tables")
+    if args.compare:
+        results = load_results(args.compare)
+    else:
+        results = await run(args)
+    print_results(results)
+
+    regressions = []
+    if args.baseline:
+        regressions = check_baseline(results, load_results(args.baseline), args.tolerance)
+    if not args.compare:
+        results["regressions"] = regressions
+        with open(args.output, "wb") as results_file:
+            results_file.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+        print(f"\nResults written to {args.output}")
+    return regressions
+
+
+if __name__ == "__main__":
+    arg_parser = parser(__doc__.splitlines()[0])
+    arg_parser.add_argument("--tables", type=int, default=30)
+    arg_parser.add_argument("--open-orders", type=int, default=20)
+    arg_parser.add_argument("--items-per-order", type=int, default=8)
+    arg_parser.add_argument("--months", type=int, default=1, help="months of closed orders")
+    arg_parser.add_argument("--orders-per-day", type=int, default=40, help="closed orders a day")
+    arg_parser.add_argument("--curve-tables", type=int, nargs="+", default=[12, 30, 60, 120])
+    arg_parser.add_argument("--curve-items", type=int, nargs="+", default=[2, 10, 40, 160])
+    arg_parser.add_argument("--output", default="benchmark-results.json", help="results file to write")
+    arg_parser.add_argument("--baseline", help="results file to compare with")
+    arg_parser.add_argument("--tolerance", type=float, default=0.25,
+                            help="share latency and allocations may grow by before they regress")
+    arg_parser.add_argument("--compare", metavar="RESULTS",
+                            help="compare this results file with --baseline instead of running")
+    parsed = arg_parser.parse_args()
+    if parsed.compare and not parsed.baseline:
+        arg_parser.error("--compare needs --baseline")
+    if asyncio.run(main(parsed)):
+        raise SystemExit(1)
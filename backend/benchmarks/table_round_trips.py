@@ -0,0 +1,40 @@
+"""Round trips and latency of GET /api/tables as the floor grows
+
+The floor view should cost the same number of database round trips whether
+the restaurant has 12 tables or 120, and whether each open order holds two
+items or forty.
+"""
+import asyncio
+
+from benchmarks.common import asgi_client, connect, measure, parser, print_rows, seed_floor
+
+TABLE_COUNTS = [12, 30, 60, 120]
+ITEMS_PER_TABLE = [2, 10, 40]
+
+
+async def main(args):
+    database, counter = connect(args.mock)
+    rows = []
+    async with asgi_client() as client:
+        for tables in TABLE_COUNTS:
+            for items in ITEMS_PER_TABLE:
+                await seed_floor(database, tables, items)
+
+                async def call():
+                    response = await client.get("/api/tables")
+                    response.raise_for_status()
+
+                result = await measure(call, counter, args.repeat)
+                rows.append([
+                    tables,
+                    items,
+                    f"{result['round_trips']:.0f}",
+                    f"{result['median_ms']:.2f}",
+                    f"{result['p95_ms']:.2f}",
+                ])
+
+    print_rows(["tables", "items/table", "round trips", "median ms", "p95 ms"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parser(__doc__.splitlines()[0]).parse_args()))
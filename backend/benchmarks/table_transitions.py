@@ -0,0 +1,105 @@
+"""Round trips of opening and closing a table, and waiters racing to do both
+
+Concurrent waiters open and close a handful of tables at random through the
+ASGI app, first on the in-memory backend and then on Mongo (``--mock`` for
+mongomock-motor). Afterwards every occupied table must hold exactly one open
+order and every free table none. The round trips of one open and one close are
+counted on Mongo.
+"""
+import asyncio
+import random
+from collections import Counter
+
+import server
+from benchmarks.common import asgi_client, connect, fresh_restaurant, parser, print_rows
+from storage.memory import MemoryStorage
+
+
+async def seed():
+    restaurant = await fresh_restaurant()
+    return restaurant.repo, [table["id"] for table in await restaurant.repo.list_floor()]
+
+
+async def waiter(client, table_ids, operations, statuses):
+    for _ in range(operations):
+        table_id = random.choice(table_ids)
+        if random.random() < 0.5:
+            response = await client.post("/api/tables/open", json={"table_id": table_id, "covers": 2})
+            statuses["open", response.status_code] += 1
+        else:
+            response = await client.post(f"/api/tables/{table_id}/close")
+            statuses["close", response.status_code] += 1
+
+
+async def check_floor(repo, table_ids):
+    """Tables whose open orders do not match their status"""
+    broken = []
+    for table_id in table_ids:
+        table = await repo.get_table(table_id)
+        open_orders = await repo.list_open_orders(table_id)
+        expected = [table["order_id"]] if table["status"] == "occupied" else []
+        if [order["id"] for order in open_orders] != expected:
+            broken.append(table["number"])
+    return broken
+
+
+async def race(client, args):
+    repo, table_ids = await seed()
+    table_ids = table_ids[:args.tables]
+    statuses = Counter()
+    await asyncio.gather(*(
+        waiter(client, table_ids, args.operations, statuses) for _ in range(args.waiters)
+    ))
+
+    print_rows(
+        ["route", "status", "responses"],
+        [[route, status, count] for (route, status), count in sorted(statuses.items())]
+    )
+    broken = await check_floor(repo, table_ids)
+    if broken:
+        raise SystemExit(f"tables {broken} do not have exactly one open order while occupied")
+    print(f"{type(repo).__name__}, {len(table_ids)} tables, {args.waiters} waiters: "
+          "every table has the open orders its status says")
+
+
+async def round_trips(client, counter, args):
+    repo, table_ids = await seed()
+    table_id = table_ids[0]
+    product_id = (await repo.load_catalog())[0][0]["id"]
+
+    opens, closes = [], []
+    for _ in range(args.repeat):
+        start = counter.count
+        response = await client.post("/api/tables/open", json={"table_id": table_id, "covers": 2})
+        response.raise_for_status()
+        opens.append(counter.count - start)
+
+        await client.post("/api/orders/add-item", json={"table_id": table_id, "product_id": product_id})
+        start = counter.count
+        response = await client.post(f"/api/tables/{table_id}/close")
+        response.raise_for_status()
+        closes.append(counter.count - start)
+
+    print_rows(
+        ["route", "round trips"],
+        [["open", f"{sum(opens) / len(opens):.0f}"], ["close", f"{sum(closes) / len(closes):.0f}"]]
+    )
+
+
+async def main(args):
+    async with asgi_client() as client:
+        server.storage = MemoryStorage()
+        await race(client, args)
+        print()
+        database, counter = connect(args.mock)
+        await race(client, args)
+        print()
+        await round_trips(client, counter, args)
+
+
+if __name__ == "__main__":
+    arg_parser = parser(__doc__.splitlines()[0])
+    arg_parser.add_argument("--tables", type=int, default=4, help="tables the waiters race on")
+    arg_parser.add_argument("--waiters", type=int, default=32, help="concurrent waiters")
+    arg_parser.add_argument("--operations", type=int, default=50, help="opens or closes per waiter")
+    asyncio.run(main(arg_parser.parse_args()))
@@ -0,0 +1,65 @@
+"""Latency of one restaurant's routes as more restaurants share the database
+
+Restaurants are added in steps, each seeded with the same floor of occupied
+tables, open orders and closed history. After every step the floor, a table's
+order and its receipt are timed for the first restaurant through its
+/api/restaurants/{id} routes. Every query leads with the restaurant on a
+restaurant-prefixed index, so on MongoDB the numbers stay flat as restaurants
+are added. mongomock (``--mock``) has no indexes and scans every document, so
+it only checks the round trips.
+"""
+import asyncio
+
+import server
+from benchmarks.common import asgi_client, connect, measure, parser, print_rows, seed_floor
+
+RESTAURANT_COUNTS = [1, 2, 4, 8, 16]
+
+
+def restaurant_id(index):
+    return f"bench-{index}"
+
+
+async def main(args):
+    database, counter = connect(args.mock)
+    server.restaurants.clear()
+    prefix = f"/api/restaurants/{restaurant_id(0)}"
+
+    rows = []
+    seeded = 0
+    async with asgi_client() as client:
+        for count in args.restaurants:
+            for index in range(seeded, count):
+                tables = await seed_floor(database, args.tables, args.items, args.closed, restaurant_id(index))
+                if index == 0:
+                    table_id = tables[0]["id"]
+                    order_id = tables[0]["order_id"]
+            seeded = max(seeded, count)
+
+            async def get_tables():
+                (await client.get(f"{prefix}/tables")).raise_for_status()
+
+            async def get_order():
+                (await client.get(f"{prefix}/orders/table/{table_id}")).raise_for_status()
+
+            async def get_receipt():
+                (await client.get(f"{prefix}/orders/{order_id}/receipt")).raise_for_status()
+
+            for route, call in (("tables", get_tables), ("order", get_order), ("receipt", get_receipt)):
+                result = await measure(call, counter, args.repeat)
+                rows.append([
+                    count, route,
+                    f"{result['round_trips']:.0f}", f"{result['median_ms']:.2f}", f"{result['p95_ms']:.2f}"
+                ])
+
+    print_rows(["restaurants", "route", "round trips", "median ms", "p95 ms"], rows)
+
+
+if __name__ == "__main__":
+    arg_parser = parser(__doc__.splitlines()[0])
+    arg_parser.add_argument("--restaurants", type=int, nargs="+", default=RESTAURANT_COUNTS,
+                            help="restaurant counts to measure at")
+    arg_parser.add_argument("--tables", type=int, default=20, help="occupied tables per restaurant")
+    arg_parser.add_argument("--items", type=int, default=10, help="items per order")
+    arg_parser.add_argument("--closed", type=int, default=5, help="closed orders per table")
+    asyncio.run(main(arg_parser.parse_args()))
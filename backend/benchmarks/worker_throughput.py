@@ -0,0 +1,112 @@
+"""Requests per second of the read routes as the number of worker processes grows
+
+Starts ``server.py serve --workers N`` for each worker count on the storage
+picked by ``--storage`` (Mongo at MONGO_URL by default) and drives it with
+concurrent keep-alive connections for a fixed time. The load generator runs
+on the same machine, so keep the worker counts below the core count to see
+the scaling rather than contention.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.common import print_rows
+from benchmarks.event_fanout import free_port
+
+WORKER_COUNTS = [1, 2, 4]
+# Read routes without ids, so every run asks for the same thing
+PATHS = ["/api/tables", "/api/products", "/api/products/categories", "/api/dough-types"]
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_server(workers, port, storage):
+    env = dict(os.environ, STORAGE_BACKEND=storage)
+    if storage == "sqlite":
+        env.setdefault("SQLITE_PATH", os.path.join(tempfile.gettempdir(), "ristorante_benchmark.db"))
+    return subprocess.Popen(
+        [sys.executable, "server.py", "serve", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+async def wait_until_ready(client):
+    deadline = time.perf_counter() + 60
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/api/tables")).status_code == 200:
+                # Give the other workers time to finish starting up
+                await asyncio.sleep(2)
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+async def drive(client, paths, deadline, latencies, errors):
+    position = 0
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            response = await client.get(paths[position % len(paths)])
+            if response.status_code != 200:
+                errors.append(response.status_code)
+        except httpx.TransportError as error:
+            errors.append(type(error).__name__)
+        latencies.append(time.perf_counter() - started)
+        position += 1
+
+
+async def run(workers, args):
+    port = free_port()
+    process = start_server(workers, port, args.storage)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30) as client:
+            await wait_until_ready(client)
+
+            latencies, errors = [], []
+            started = time.perf_counter()
+            deadline = started + args.duration
+            await asyncio.gather(*(
+                drive(client, PATHS, deadline, latencies, errors) for _ in range(args.concurrency)
+            ))
+            elapsed = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait()
+
+    latencies.sort()
+    return [
+        workers,
+        len(latencies),
+        f"{len(latencies) / elapsed:.0f}",
+        f"{statistics.median(latencies) * 1000:.2f}",
+        f"{latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f}",
+        len(errors),
+    ]
+
+
+async def main(args):
+    rows = []
+    for workers in args.workers:
+        rows.append(await run(workers, args))
+    print_rows(["workers", "requests", "req/s", "median ms", "p99 ms", "errors"], rows)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--workers", type=int, nargs="+", default=WORKER_COUNTS,
+                            help="worker counts to measure")
+    arg_parser.add_argument("--storage", default="mongo", choices=["mongo", "sqlite"],
+                            help="STORAGE_BACKEND of the server under test; the workers must share it")
+    arg_parser.add_argument("--concurrency", type=int, default=64, help="concurrent connections")
+    arg_parser.add_argument("--duration", type=float, default=10, help="seconds per worker count")
+    asyncio.run(main(arg_parser.parse_args()))
@@ -0,0 +1,127 @@
+"""Capture of live API traffic, for replaying it against a scratch backend
+
+With CAPTURE_PATH set, every /api request is written to that file as one
+JSON line (gzip-compressed when the path ends in .gz):
+
+    {"t": 12.5, "method": "POST", "path": "/api/tables/open", "route": "/api/tables/open",
+     "body": "{...}", "status": 200, "ms": 3.1, "ids": ["..."]}
+
+``t`` is seconds since capture started and ``ms`` the time the app took.
+``query`` and ``body`` are left out when empty. ``ids`` lists the UUIDs in
+the response of a write, in order, so a replay can map the ids the original
+server handed out to those its own copy hands out. The log starts with one
+``{"snapshot": ...}`` line per restaurant, see ``server.capture_snapshot``.
+Each start of the server begins a new capture; with several worker processes,
+put ``{pid}`` in CAPTURE_PATH to give each its own file.
+
+The event stream and profiling requests are not captured. See
+benchmarks/replay.py for playing a capture back.
+"""
+import gzip
+import os
+import re
+import time
+
+import orjson
+
+UUID_PATTERN = re.compile(rb"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+# Responses bigger than this are not searched for ids
+MAX_ID_SCAN_BYTES = 256 * 1024
+
+
+def open_capture(path: str, mode: str):
+    """Capture file at ``path``, gzip-compressed if it ends in .gz"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+# A capture is flushed at least this often, so killing the server loses little
+FLUSH_SECONDS = 1.0
+
+
+class CaptureLog:
+    """Capture file, written through the file's buffer"""
+
+    def __init__(self, path: str):
+        self.file = open_capture(path.replace("{pid}", str(os.getpid())), "wb")
+        self.started = time.monotonic()
+        self.flushed = self.started
+
+    def write(self, entry: dict):
+        self.file.write(orjson.dumps(entry) + b"\n")
+        now = time.monotonic()
+        if now - self.flushed >= FLUSH_SECONDS:
+            self.file.flush()
+            self.flushed = now
+
+    def write_snapshot(self, snapshot: dict):
+        self.write({"snapshot": snapshot})
+
+    def close(self):
+        self.file.close()
+
+
+def captured(scope) -> bool:
+    """API requests, leaving out the event stream and operators' profiling requests"""
+    if scope["type"] != "http" or not scope["path"].startswith("/api/") or scope["path"].endswith("/events"):
+        return False
+    return b"profile=" not in scope["query_string"] and all(name != b"x-profile" for name, _ in scope["headers"])
+
+
+class CaptureMiddleware:
+    """ASGI middleware appending each API request, with its status and timing, to a CaptureLog"""
+
+    def __init__(self, app, log: CaptureLog):
+        self.app = app
+        self.log = log
+
+    async def __call__(self, scope, receive, send):
+        if not captured(scope):
+            await self.app(scope, receive, send)
+            return
+
+        body = []
+        response = []
+        status = 500
+
+        async def receive_body():
+            message = await receive()
+            if message["type"] == "http.request":
+                body.append(message.get("body", b""))
+            return message
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and scope["method"] != "GET":
+                response.append(message.get("body", b""))
+            await send(message)
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive_body, send_with_status)
+        finally:
+            elapsed = time.monotonic() - started
+            route = scope.get("route")
+            entry = {
+                "t": round(started - self.log.started, 6),
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": route.path if route is not None else "unmatched",
+                "status": status,
+                "ms": round(elapsed * 1000, 3),
+            }
+            if scope["query_string"]:
+                entry["query"] = scope["query_string"].decode("latin-1")
+            request_body = b"".join(body)
+            if request_body:
+                entry["body"] = request_body.decode("utf-8", "replace")
+            response_body = b"".join(response)
+            if response_body and len(response_body) <= MAX_ID_SCAN_BYTES:
+                ids = UUID_PATTERN.findall(response_body)
+                if ids:
+                    entry["ids"] = [value.decode() for value in ids]
+            self.log.write(entry)
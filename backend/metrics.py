@@ -0,0 +1,210 @@
+"""Request and database instrumentation, rendered in the Prometheus text format"""
+import contextvars
+import threading
+import time
+from typing import Dict, Sequence, Tuple
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 64)
+
+
+def format_labels(names: Sequence[str], values: Tuple) -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str]):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{format_labels(self.labels, labels)} {value}"
+
+
+class Gauge:
+    def __init__(self, name: str, help: str, labels: Sequence[str]):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def set(self, value: float, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{format_labels(self.labels, labels)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Per label set: per-bucket counts (last one is +Inf), sum
+        self.series: Dict[Tuple, list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = series[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        names = self.labels + ("le",)
+        for labels, (counts, total) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{format_labels(names, labels + (bound,))} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labels, labels)} {total}"
+            yield f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to handle a request, by route template",
+    ["method", "route"], LATENCY_BUCKETS
+))
+requests_total = registry.register(Counter(
+    "http_requests_total", "Requests handled, by route template and status",
+    ["method", "route", "status"]
+))
+request_round_trips = registry.register(Histogram(
+    "http_request_mongo_round_trips", "MongoDB commands sent while handling a request",
+    ["method", "route"], ROUND_TRIP_BUCKETS
+))
+mongo_command_duration = registry.register(Histogram(
+    "mongo_command_duration_seconds", "Time for MongoDB to answer a command",
+    ["collection", "command"], LATENCY_BUCKETS
+))
+mongo_command_failures = registry.register(Counter(
+    "mongo_command_failures_total", "MongoDB commands that failed",
+    ["collection", "command"]
+))
+write_behind_queue_depth = registry.register(Gauge(
+    "write_behind_queue_depth", "Buffered writes of a restaurant not stored yet",
+    ["restaurant"]
+))
+write_behind_flush_duration = registry.register(Histogram(
+    "write_behind_flush_duration_seconds", "Time to flush a batch of buffered writes",
+    ["restaurant"], LATENCY_BUCKETS
+))
+write_behind_flush_failures = registry.register(Counter(
+    "write_behind_flush_failures_total", "Flushes of buffered writes that failed and were retried",
+    ["restaurant"]
+))
+
+# Round trips of the request being handled; Motor carries the context into its threads
+current_round_trips = contextvars.ContextVar("current_round_trips", default=None)
+
+
+class RoundTrips:
+    def __init__(self):
+        self.count = 0
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Time every command by collection and count it against the current request"""
+
+    def __init__(self):
+        self.pending = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get("collection", "")
+        self.pending[(event.connection_id, event.request_id)] = collection
+        round_trips = current_round_trips.get()
+        if round_trips is not None:
+            round_trips.count += 1
+
+    def succeeded(self, event):
+        collection = self.pending.pop((event.connection_id, event.request_id), "")
+        mongo_command_duration.observe(event.duration_micros / 1e6, collection, event.command_name)
+
+    def failed(self, event):
+        collection = self.pending.pop((event.connection_id, event.request_id), "")
+        mongo_command_duration.observe(event.duration_micros / 1e6, collection, event.command_name)
+        mongo_command_failures.inc(collection, event.command_name)
+
+
+mongo_commands = MongoCommandTimer()
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and round trips per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        round_trips = RoundTrips()
+        token = current_round_trips.set(round_trips)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_round_trips.reset(token)
+            # The router stores the matched route in the scope; unmatched paths share one label
+            route = scope.get("route")
+            template = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            request_duration.observe(elapsed, method, template)
+            requests_total.inc(method, template, status)
+            request_round_trips.observe(round_trips.count, method, template)
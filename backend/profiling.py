@@ -0,0 +1,261 @@
+"""Profiles of single requests, for operators chasing a slow route in production
+
+A request carrying ``X-Profile: pstats`` or ``X-Profile: speedscope`` (or
+``?profile=``) and the operator token in ``X-Profile-Token`` runs under
+cProfile. Its response is replaced by the profile, a pstats file or speedscope
+JSON, with the handler's status in ``X-Profiled-Status`` and the time split by
+where it went in ``X-Profile-Breakdown``.
+
+The middleware is only installed when PROFILE_TOKEN is set, so without it
+requests pay nothing. cProfile sees the whole event loop thread: other requests
+handled meanwhile land in the profile too, and only one request is profiled at
+a time.
+"""
+import cProfile
+import hmac
+import marshal
+import time
+from typing import Dict, List, Tuple
+from urllib.parse import parse_qs
+
+import orjson
+
+PROFILE_FORMATS = {"pstats", "speedscope"}
+
+# Where the time of a profiled request went, by the code it was spent in. Motor
+# runs PyMongo, BSON decoding included, in worker threads, so the event loop
+# sits in its selector while it waits on MongoDB.
+STORAGE_WAIT = "storage_wait"
+STORAGE = "storage"
+JSON_ENCODING = "json_encoding"
+APP = "app"
+FRAMEWORK = "framework"
+OTHER = "other"
+
+STORAGE_PATHS = ("/storage/", "/motor/", "/pymongo/", "/bson/", "/mongomock", "/sqlite3/")
+JSON_PATHS = ("/json/", "/fastapi/encoders.py")
+FRAMEWORK_PATHS = ("/fastapi/", "/starlette/", "/anyio/", "/pydantic", "/uvicorn/", "/h11/", "/asyncio/")
+
+# Call paths whose share of the time drops below this are left out of speedscope profiles
+MIN_SPEEDSCOPE_SECONDS = 1e-6
+
+
+def category(function: Tuple[str, int, str]) -> str:
+    filename, _, name = function
+    if filename == "~":
+        if "select" in name or "poll" in name:
+            return STORAGE_WAIT
+        if "orjson" in name or "json" in name:
+            return JSON_ENCODING
+        if "sqlite3" in name:
+            return STORAGE
+        return OTHER
+    if any(path in filename for path in STORAGE_PATHS):
+        return STORAGE
+    if any(path in filename for path in JSON_PATHS):
+        return JSON_ENCODING
+    if filename.endswith("/starlette/responses.py") and name == "render":
+        return JSON_ENCODING
+    if any(path in filename for path in FRAMEWORK_PATHS):
+        return FRAMEWORK
+    if filename.endswith(("server.py", "metrics.py")):
+        return APP
+    return OTHER
+
+
+def breakdown(stats: dict) -> Dict[str, float]:
+    """Seconds spent in each category
+
+    Own times add up without counting a call twice. Builtins and the standard
+    library count towards whoever called them, so a deepcopy in the storage
+    code is storage time.
+    """
+    shares: Dict[tuple, Dict[str, float]] = {}
+
+    def share(function, visiting) -> Dict[str, float]:
+        if function in shares:
+            return shares[function]
+        own = category(function)
+        if own != OTHER or function in visiting:
+            return {own: 1.0}
+        callers = stats[function][4]
+        total = sum(edge[2] for edge in callers.values())
+        if not total:
+            return {OTHER: 1.0}
+        result = {}
+        for caller, edge in callers.items():
+            if caller not in stats:
+                continue
+            for name, fraction in share(caller, visiting | {function}).items():
+                result[name] = result.get(name, 0.0) + fraction * edge[2] / total
+        shares[function] = result
+        return result
+
+    seconds = {name: 0.0 for name in (STORAGE_WAIT, STORAGE, JSON_ENCODING, APP, FRAMEWORK, OTHER)}
+    for function, (_, _, own_time, _, _) in stats.items():
+        for name, fraction in share(function, frozenset()).items():
+            seconds[name] += own_time * fraction
+    return seconds
+
+
+def frame_name(function: Tuple[str, int, str]) -> str:
+    filename, line, name = function
+    return name if filename == "~" else f"{name} ({filename.rsplit('/', 1)[-1]}:{line})"
+
+
+def speedscope(stats: dict, title: str, seconds: Dict[str, float]) -> dict:
+    """Speedscope file of the call tree rebuilt from cProfile's caller/callee times
+
+    cProfile keeps the time of each caller-callee pair, not of whole stacks, so
+    a function's time below each caller is split in proportion to the calls
+    from that caller. A second profile holds the time by category.
+    """
+    frames: List[dict] = []
+    frame_index: Dict[tuple, int] = {}
+
+    def frame(key, name, filename="", line=0) -> int:
+        if key not in frame_index:
+            frame_index[key] = len(frames)
+            frames.append({"name": name, "file": filename, "line": line})
+        return frame_index[key]
+
+    callees: Dict[tuple, List[tuple]] = {}
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees.setdefault(caller, []).append((function, cumulative))
+
+    samples, weights = [], []
+
+    def walk(function, stack, scale):
+        own_time = stats[function][2]
+        stack = stack + [frame(function, frame_name(function), function[0], function[1])]
+        if own_time * scale >= MIN_SPEEDSCOPE_SECONDS:
+            samples.append(stack)
+            weights.append(own_time * scale)
+        on_stack = {frames[index]["name"] for index in stack}
+        for callee, edge_time in callees.get(function, []):
+            callee_cumulative = stats[callee][3]
+            # Recursion is cut at its first repeat
+            if frame_name(callee) in on_stack or not callee_cumulative:
+                continue
+            if edge_time * scale < MIN_SPEEDSCOPE_SECONDS:
+                continue
+            walk(callee, stack, edge_time * scale / callee_cumulative)
+
+    for function, (_, _, _, _, callers) in stats.items():
+        if not callers:
+            walk(function, [], 1.0)
+
+    total = sum(weights)
+    categories = [name for name, spent in seconds.items() if spent]
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": title,
+        "exporter": "ristorante-manager",
+        "activeProfileIndex": 0,
+        "shared": {"frames": frames + [{"name": name} for name in categories]},
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": title,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": samples,
+                "weights": weights,
+            },
+            {
+                "type": "sampled",
+                "name": f"{title} by category",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(seconds.values()),
+                "samples": [[len(frames) + index] for index in range(len(categories))],
+                "weights": [seconds[name] for name in categories],
+            },
+        ],
+    }
+
+
+def requested_format(scope) -> str:
+    """Profile format a request asks for, "" if it asks for none"""
+    for name, value in scope["headers"]:
+        if name == b"x-profile":
+            return value.decode("latin-1")
+    if b"profile=" in scope["query_string"]:
+        return parse_qs(scope["query_string"].decode("latin-1")).get("profile", [""])[0]
+    return ""
+
+
+class ProfilingMiddleware:
+    """ASGI middleware answering operator-requested profiles instead of responses"""
+
+    def __init__(self, app, token: str):
+        self.app = app
+        self.token = token.encode()
+        self.busy = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profile_format = requested_format(scope)
+        if not profile_format:
+            await self.app(scope, receive, send)
+            return
+
+        token = dict(scope["headers"]).get(b"x-profile-token", b"")
+        if not hmac.compare_digest(token, self.token):
+            await respond(send, 403, b'{"detail":"Profiling needs the operator token"}')
+            return
+        if profile_format not in PROFILE_FORMATS:
+            await respond(send, 400, b'{"detail":"Profile format must be pstats or speedscope"}')
+            return
+        if self.busy:
+            await respond(send, 409, b'{"detail":"Another request is being profiled"}')
+            return
+
+        status = 500
+
+        async def discard(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        self.busy = True
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                await self.app(scope, receive, discard)
+            finally:
+                profiler.disable()
+        finally:
+            self.busy = False
+        elapsed = time.perf_counter() - started
+
+        profiler.create_stats()
+        seconds = breakdown(profiler.stats)
+        title = f"{scope['method']} {scope['path']}"
+        if profile_format == "pstats":
+            body, media_type = marshal.dumps(profiler.stats), b"application/octet-stream"
+        else:
+            body, media_type = orjson.dumps(speedscope(profiler.stats, title, seconds)), b"application/json"
+
+        summary = ";".join(f"{name}={spent:.6f}" for name, spent in seconds.items())
+        filename = f"profile.{'pstats' if profile_format == 'pstats' else 'speedscope.json'}"
+        await respond(send, 200, body, media_type, [
+            (b"x-profiled-status", str(status).encode()),
+            (b"x-profile-breakdown", f"{summary};wall={elapsed:.6f}".encode()),
+            (b"content-disposition", f'attachment; filename="{filename}"'.encode()),
+        ])
+
+
+async def respond(send, status: int, body: bytes, media_type: bytes = b"application/json", headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", media_type), (b"content-length", str(len(body)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
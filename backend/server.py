@@ -1,17 +1,35 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel, Field
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Optional, Dict, Any
-from datetime import datetime
+from datetime import date, datetime, time, timedelta
 import os
 from dotenv import load_dotenv
 import uuid
 import json
+import asyncio
+import base64
+import binascii
+import csv
+import io
+import logging
+import re
+import unicodedata
+import orjson
 from bson import ObjectId
 
+import capture
+import metrics
+import profiling
+from write_behind import WriteBehindBuffer
+from storage import Repository, create_storage, order_line_key
+from storage.rollups import ROLLUP_DIMENSIONS, TIME_DIMENSIONS, rollup_increments
+
 load_dotenv()
 
+logger = logging.getLogger("ristorante")
+
 # Custom JSON encoder to handle MongoDB ObjectId
 class JSONEncoder(json.JSONEncoder):
     def default(self, o):
@@ -35,26 +53,6 @@ class PyObjectId(ObjectId):
     def __get_pydantic_json_schema__(cls, field_schema):
         field_schema.update(type="string")
 
-# Custom response model for MongoDB documents
-def serialize_mongo_doc(doc: dict) -> dict:
-    """Convert MongoDB document to serializable dict"""
-    if doc is None:
-        return None
-    
-    result = {}
-    for key, value in doc.items():
-        if isinstance(value, ObjectId):
-            result[key] = str(value)
-        elif isinstance(value, list):
-            result[key] = [serialize_mongo_doc(item) if isinstance(item, dict) else 
-                          str(item) if isinstance(item, ObjectId) else item 
-                          for item in value]
-        elif isinstance(value, dict):
-            result[key] = serialize_mongo_doc(value)
-        else:
-            result[key] = value
-    return result
-
 app = FastAPI(title="Ristorante Manager API", version="1.0.0")
 
 # CORS middleware
@@ -64,12 +62,66 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Change-Seq"],
 )
 
-# Database connection
-MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017/ristorante_manager")
-client = AsyncIOMotorClient(MONGO_URL)
-db = client.ristorante_manager
+# Per-route latency and Mongo round trips, served on /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Operators holding PROFILE_TOKEN can profile single requests; without it the
+# middleware is not installed at all
+if os.getenv("PROFILE_TOKEN"):
+    app.add_middleware(profiling.ProfilingMiddleware, token=os.environ["PROFILE_TOKEN"])
+
+# CAPTURE_PATH records every API request for benchmarks/replay.py; without it
+# the middleware is not installed at all
+capture_log = capture.CaptureLog(os.environ["CAPTURE_PATH"]) if os.getenv("CAPTURE_PATH") else None
+if capture_log:
+    app.add_middleware(capture.CaptureMiddleware, log=capture_log)
+
+# Restaurants this process serves. The default one also answers on the bare
+# /api routes, for clients from before there were several restaurants
+DEFAULT_RESTAURANT_ID = os.getenv("DEFAULT_RESTAURANT_ID", "default")
+RESTAURANT_IDS = list(dict.fromkeys([DEFAULT_RESTAURANT_ID] + [
+    restaurant_id.strip() for restaurant_id in os.getenv("RESTAURANTS", "").split(",") if restaurant_id.strip()
+]))
+
+# Database connection, chosen by STORAGE_BACKEND
+storage = create_storage(DEFAULT_RESTAURANT_ID, event_listeners=[metrics.mongo_commands])
+
+# How often each process checks whether the menu catalog changed elsewhere
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "30"))
+
+# Longest a station may wait for tickets in one request, and how often a
+# waiting request re-checks the queue for tickets queued by other processes
+TICKETS_MAX_WAIT_SECONDS = float(os.getenv("TICKETS_MAX_WAIT_SECONDS", "30"))
+TICKETS_RECHECK_SECONDS = float(os.getenv("TICKETS_RECHECK_SECONDS", "2"))
+
+# How often each process checks the change sequence for writes made by other
+# worker processes, to pass them on to its own event streams; 0 turns it off
+CHANGES_POLL_SECONDS = float(os.getenv("CHANGES_POLL_SECONDS", "1"))
+
+# Event stream tuning: idle keepalive interval and per-subscriber backlog
+EVENTS_KEEPALIVE_SECONDS = float(os.getenv("EVENTS_KEEPALIVE_SECONDS", "15"))
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+
+# How long a worker may hold the seeding lock before another one takes over
+SEED_LOCK_SECONDS = float(os.getenv("SEED_LOCK_SECONDS", "30"))
+
+# Closed orders move to the archive this long after closing, checked every
+# interval and moved in batches
+ARCHIVE_AFTER_SECONDS = float(os.getenv("ARCHIVE_AFTER_SECONDS", str(6 * 3600)))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "300"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+
+# Writes no response waits on (use counts) are buffered and flushed in
+# batches of up to this many, at least this often
+WRITE_BEHIND_MAX_WRITES = int(os.getenv("WRITE_BEHIND_MAX_WRITES", "500"))
+WRITE_BEHIND_MAX_DELAY_SECONDS = float(os.getenv("WRITE_BEHIND_MAX_DELAY_SECONDS", "1"))
+
+# Delta sync re-sends this many changes before `since`, so a write numbered
+# just before a read but stored just after it still reaches the client
+SYNC_OVERLAP = int(os.getenv("SYNC_OVERLAP", "20"))
 
 # Pydantic models
 class Table(BaseModel):
@@ -135,10 +187,13 @@ class OrderItem(BaseModel):
     product_id: str
     name: str
     price: float
+    unit_price: Optional[float] = None
+    quantity: int = 1
     total_price: float
     dough_type: Optional[str] = None
     product_type: str
     extras: List[OrderItemExtra] = []
+    extra_ids: List[str] = []
     
     class Config:
         json_encoders = {
@@ -159,22 +214,60 @@ class Order(BaseModel):
         }
 
 # Request models
+class ProductEntry(BaseModel):
+    code: str
+    name: str
+    price: float
+    category: str
+    type: str  # kitchen, pizzeria
+    is_customizable: bool = False
+
+class DoughTypeEntry(BaseModel):
+    code: str
+    name: str
+    additional_price: float = 0.0
+
+class ExtraEntry(BaseModel):
+    code: str
+    name: str
+    price: float
+
+class CatalogImport(BaseModel):
+    products: List[ProductEntry] = []
+    dough_types: List[DoughTypeEntry] = []
+    extras: List[ExtraEntry] = []
+
 class OpenTableRequest(BaseModel):
     table_id: str
     covers: int
 
-class AddItemRequest(BaseModel):
-    table_id: str
+class AddItemLine(BaseModel):
     product_id: str
     dough_type: Optional[str] = None
     extra_ids: List[str] = []
+    quantity: int = Field(default=1, ge=1)
+
+class AddItemRequest(AddItemLine):
+    table_id: str
+
+class AddItemsRequest(BaseModel):
+    table_id: str
+    items: List[AddItemLine] = Field(min_length=1)
 
 # Initialize database with seed data
-async def init_database():
-    # Check if data already exists
-    if await db.tables.count_documents({}) > 0:
-        return
-    
+async def init_database(repo: Repository):
+    """Seed a restaurant once, however many workers start together"""
+    owner = str(uuid.uuid4())
+    while not await repo.is_seeded():
+        if await repo.claim_seed_lock(owner, SEED_LOCK_SECONDS):
+            await seed_database(repo)
+            await repo.mark_seeded(owner)
+            return
+        
+        # Another worker is seeding; serve once it is done
+        await asyncio.sleep(0.5)
+
+async def seed_database(repo: Repository):
     # Seed tables
     tables = []
     for i in range(1, 13):
@@ -188,7 +281,8 @@ async def init_database():
         }
         tables.append(table)
     
-    await db.tables.insert_many(tables)
+    # Keyed on number and code, so a seed interrupted halfway can simply run again
+    await repo.insert_missing("tables", "number", tables)
     
     # Seed products
     products = [
@@ -219,8 +313,6 @@ async def init_database():
         {"id": str(uuid.uuid4()), "name": "Gelato Artigianale", "price": 6.0, "category": "dessert", "type": "kitchen", "is_customizable": False}
     ]
     
-    await db.products.insert_many(products)
-    
     # Seed dough types
     dough_types = [
         {"id": str(uuid.uuid4()), "name": "Classica", "additional_price": 0.0},
@@ -229,8 +321,6 @@ async def init_database():
         {"id": str(uuid.uuid4()), "name": "Senza Glutine", "additional_price": 2.0}
     ]
     
-    await db.dough_types.insert_many(dough_types)
-    
     # Seed extras
     extras = [
         {"id": str(uuid.uuid4()), "name": "Mozzarella senza lattosio", "price": 1.5},
@@ -239,294 +329,1218 @@ async def init_database():
         {"id": str(uuid.uuid4()), "name": "Prosciutto crudo", "price": 2.0}
     ]
     
-    await db.extras.insert_many(extras)
+    # Codes stay stable across renames, so menu imports can match on them
+    for entry in products + dough_types + extras:
+        entry["code"] = catalog_code(entry["name"])
+    
+    await repo.insert_missing("products", "code", products)
+    await repo.insert_missing("dough_types", "code", dough_types)
+    await repo.insert_missing("extras", "code", extras)
+
+def catalog_code(name: str) -> str:
+    """Stable code of a seeded catalog entry: "Tiramisù" becomes tiramisu"""
+    ascii_name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", "-", ascii_name.lower()).strip("-")
+
+# Menu catalog cache
+class CatalogCache:
+    """In-process copy of a restaurant's menu, valid for one catalog version"""
+    
+    def __init__(self, repo: Repository):
+        self.repo = repo
+        self.version = None
+        self.products = []
+        self.products_by_id = {}
+        self.categories = []
+        self.menu = {}
+        self.dough_types = []
+        self.dough_types_by_name = {}
+        self.extras = []
+        self.extras_by_id = {}
+    
+    @property
+    def etag(self) -> str:
+        return f'"catalog-{self.version}"'
+    
+    async def load(self, version: int):
+        products, dough_types, extras = await self.repo.load_catalog()
+        
+        self.products = products
+        self.products_by_id = {product["id"]: product for product in products}
+        self.categories = sorted({product["category"] for product in products})
+        self.menu = {category: [product for product in products if product["category"] == category]
+                     for category in self.categories}
+        self.dough_types = dough_types
+        self.dough_types_by_name = {dough["name"]: dough for dough in dough_types}
+        self.extras = extras
+        self.extras_by_id = {extra["id"]: extra for extra in extras}
+        self.version = version
+    
+    async def refresh(self):
+        """Reload if the stored catalog version moved"""
+        version = await self.repo.get_catalog_version()
+        if version != self.version:
+            await self.load(version)
+    
+    async def invalidate(self):
+        """Bump the catalog version after a menu change and reload"""
+        await self.load(await self.repo.bump_catalog_version())
+
+async def watch_catalog():
+    """Pick up menu changes made by other processes"""
+    while True:
+        await asyncio.sleep(CATALOG_REFRESH_SECONDS)
+        for restaurant in list(restaurants.values()):
+            try:
+                await restaurant.catalog.refresh()
+            except Exception:
+                logger.exception("Catalog refresh of restaurant %s failed", restaurant.id)
+
+# Order archive
+async def archive_closed_orders(repo: Repository, older_than: float = ARCHIVE_AFTER_SECONDS) -> int:
+    """Move orders closed more than `older_than` seconds ago out of the live collections"""
+    closed_before = datetime.now() - timedelta(seconds=older_than)
+    archived = 0
+    while True:
+        moved = await repo.archive_closed_orders(closed_before, ARCHIVE_BATCH_SIZE)
+        archived += moved
+        if moved < ARCHIVE_BATCH_SIZE:
+            return archived
+
+async def watch_archive():
+    """Keep the live order collections down to the current service"""
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+        for restaurant in list(restaurants.values()):
+            try:
+                archived = await archive_closed_orders(restaurant.repo)
+                if archived:
+                    logger.info("Archived %d closed orders of restaurant %s", archived, restaurant.id)
+            except Exception:
+                logger.exception("Order archiving of restaurant %s failed", restaurant.id)
+
+async def watch_changes():
+    """Pass writes made by other worker processes on to this process's event streams and stations"""
+    while True:
+        await asyncio.sleep(CHANGES_POLL_SECONDS)
+        for restaurant in list(restaurants.values()):
+            if restaurant.own_changes is None:
+                continue
+            try:
+                await restaurant.check_changes()
+            except Exception:
+                logger.exception("Change check of restaurant %s failed", restaurant.id)
+
+def catalog_response(request: Request, catalog: CatalogCache, content) -> Response:
+    """Serve catalog data tagged with the catalog version"""
+    headers = {"ETag": catalog.etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if catalog.etag in tags or "*" in tags:
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(content, headers=headers)
+
+# Live change events
+RESYNC_MESSAGE = "event: resync\ndata: {}\n\n"
+
+class EventBroker:
+    """Fan change events out to every connected event stream"""
+    
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers = set()
+    
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        return queue
+    
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+    
+    def publish(self, event_type: str, data: dict):
+        # Encode once, however many tablets are listening
+        message = f"event: {event_type}\ndata: {orjson.dumps(data).decode()}\n\n"
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # A subscriber that fell behind drops its backlog and refetches
+                self.drop_backlog(queue)
+    
+    def resync(self):
+        """Have every subscriber refetch what changed, for writes this process has no events of"""
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(RESYNC_MESSAGE)
+            except asyncio.QueueFull:
+                self.drop_backlog(queue)
+    
+    @staticmethod
+    def drop_backlog(queue: asyncio.Queue):
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(RESYNC_MESSAGE)
+
+# Station ticket queues
+STATIONS = ["kitchen", "pizzeria", "gluten_free"]
+
+def station_for(item: dict) -> str:
+    """Station that prepares an order item"""
+    if item["product_type"] == "kitchen":
+        return "kitchen"
+    if item.get("dough_type") == "Senza Glutine":
+        return "gluten_free"
+    return "pizzeria"
+
+# Restaurants
+class Restaurant:
+    """A restaurant served by this process, with its menu cache, event stream, write buffer and station wakeups"""
+    
+    def __init__(self, restaurant_id: str, repo: Repository):
+        self.id = restaurant_id
+        self.repo = repo
+        self.catalog = CatalogCache(repo)
+        self.events = EventBroker()
+        self.writes = WriteBehindBuffer(repo, restaurant_id, WRITE_BEHIND_MAX_WRITES, WRITE_BEHIND_MAX_DELAY_SECONDS)
+        # Replaced on every notify, so each waiter holds the event for its own round
+        self.station_wakeups = {station: asyncio.Event() for station in STATIONS}
+        # Change numbers this process handed out and check_changes has not passed
+        # yet; None where no other process can write
+        self.own_changes = set() if storage.shared and CHANGES_POLL_SECONDS > 0 else None
+        self.seen_change = None
+        self.resync_due = False
+    
+    def notify_station(self, station: str):
+        wakeup = self.station_wakeups[station]
+        self.station_wakeups[station] = asyncio.Event()
+        wakeup.set()
+    
+    async def check_changes(self):
+        """Resync the event streams and wake the stations if another process wrote since the last check"""
+        seq = await self.repo.get_sequence(CHANGES_SEQUENCE)
+        foreign = False
+        if self.seen_change is not None and seq > self.seen_change:
+            own = sum(1 for change in self.own_changes if self.seen_change < change <= seq)
+            foreign = own < seq - self.seen_change
+        self.own_changes = {change for change in self.own_changes if change > seq}
+        self.seen_change = seq
+        # A write is numbered before it is stored, so the streams are told once
+        # more on the next check, when it is surely there to fetch
+        if foreign or self.resync_due:
+            self.events.resync()
+            for station in STATIONS:
+                self.notify_station(station)
+        self.resync_due = foreign
+
+restaurants: Dict[str, Restaurant] = {}
+
+async def backfill_open_order_totals(repo: Repository):
+    """Store the running totals of open orders from before they were kept, before anything adds to them
+
+    Closed orders without totals are added up when read, see order_total.
+    """
+    tables = [table for table in await repo.list_floor() if table["status"] == "occupied"]
+    open_orders = await asyncio.gather(*(repo.list_open_orders(table["id"]) for table in tables))
+    legacy = [order for orders in open_orders for order in orders if "total" not in order]
+    if not legacy:
+        return
+    items = await repo.list_items([order["id"] for order in legacy])
+    await repo.set_order_totals([
+        {
+            "id": order["id"],
+            "items_count": sum(item.get("quantity", 1) for item in items if item["order_id"] == order["id"]),
+            "total": order_total(order, [item for item in items if item["order_id"] == order["id"]])
+        }
+        for order in legacy
+    ])
+
+async def open_restaurant(restaurant_id: str) -> Restaurant:
+    """Seed a restaurant if it is new, load its menu and start serving it"""
+    restaurant = Restaurant(restaurant_id, storage.repository(restaurant_id))
+    await init_database(restaurant.repo)
+    await asyncio.gather(restaurant.catalog.refresh(), backfill_open_order_totals(restaurant.repo))
+    previous = restaurants.get(restaurant_id)
+    if previous is not None:
+        await previous.writes.close()
+    restaurant.writes.start()
+    restaurants[restaurant_id] = restaurant
+    return restaurant
+
+def current_restaurant(request: Request) -> Restaurant:
+    """The restaurant named in the path, the default one on the bare /api routes"""
+    restaurant = restaurants.get(request.path_params.get("restaurant_id", DEFAULT_RESTAURANT_ID))
+    if restaurant is None:
+        raise HTTPException(status_code=404, detail="Restaurant not found")
+    return restaurant
+
+def current_repository(restaurant: Restaurant = Depends(current_restaurant)) -> Repository:
+    return restaurant.repo
+
+async def capture_snapshot(restaurant: Restaurant) -> dict:
+    """What a replay needs to map a restaurant's ids onto a freshly seeded copy
+
+    Tables are matched by number and catalog entries by code; tables open
+    when capture started are opened on the copy before playing.
+    """
+    tables = await restaurant.repo.list_floor()
+    return {
+        "restaurant": restaurant.id,
+        "tables": {table["id"]: table["number"] for table in tables},
+        "open_tables": {
+            table["id"]: {"covers": table["covers"], "order_id": table["order_id"]}
+            for table in tables if table["status"] == "occupied" and table.get("order_id")
+        },
+        "products": {
+            product["id"]: product["code"] for product in restaurant.catalog.products if product.get("code")
+        },
+        "extras": {extra["id"]: extra["code"] for extra in restaurant.catalog.extras if extra.get("code")},
+    }
+
+# Receipts
+def order_total(order: dict, items: List[dict]) -> float:
+    """An order's running total; orders from before totals were kept add up their items"""
+    if "total" in order:
+        return order["total"]
+    return sum(item["total_price"] for item in items)
+
+def build_receipt(order: dict, table: dict, items: List[dict]) -> dict:
+    """Group an order's items by station and count the doughs in one pass"""
+    sections = {station: [] for station in STATIONS}
+    dough_summary = {}
+    for item in items:
+        sections[station_for(item)].append(item)
+        if item["product_type"] == "pizzeria" and item.get("dough_type"):
+            dough_type = item["dough_type"]
+            dough_summary[dough_type] = dough_summary.get(dough_type, 0) + item.get("quantity", 1)
+    
+    return {
+        "order": order,
+        "table": table,
+        "kitchen_items": sections["kitchen"],
+        "pizzeria_items": sections["pizzeria"],
+        "gluten_free_items": sections["gluten_free"],
+        "dough_summary": dough_summary,
+        "total": order_total(order, items)
+    }
+
+background_tasks = []
 
 @app.on_event("startup")
 async def startup_event():
-    await init_database()
+    await storage.setup()
+    await asyncio.gather(*(open_restaurant(restaurant_id) for restaurant_id in RESTAURANT_IDS))
+    if capture_log:
+        for restaurant in restaurants.values():
+            capture_log.write_snapshot(await capture_snapshot(restaurant))
+    background_tasks.append(asyncio.create_task(watch_catalog()))
+    background_tasks.append(asyncio.create_task(watch_archive()))
+    if storage.shared and CHANGES_POLL_SECONDS > 0:
+        background_tasks.append(asyncio.create_task(watch_changes()))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*(restaurant.writes.close() for restaurant in restaurants.values()))
+    if capture_log:
+        capture_log.close()
+    await storage.close()
 
-# API Routes
+# API Routes, served for the default restaurant under /api and for every
+# restaurant under /api/restaurants/{restaurant_id}
+api = APIRouter()
 
 # Tables
-@app.get("/api/tables")
-async def get_tables():
-    """Get all tables with their current status"""
-    tables = await db.tables.find({"is_closed": False}).to_list(None)
-    tables = [serialize_mongo_doc(table) for table in tables]
-    
-    # Get active orders count for each table
-    for table in tables:
-        orders = await db.orders.find({"table_id": table["id"], "is_closed": False}).to_list(None)
-        orders = [serialize_mongo_doc(order) for order in orders]
-        items_count = 0
-        total = 0.0
-        
-        for order in orders:
-            items = await db.order_items.find({"order_id": order["id"]}).to_list(None)
-            items = [serialize_mongo_doc(item) for item in items]
-            items_count += len(items)
-            total += sum(item["total_price"] for item in items)
-        
-        table["items_count"] = items_count
-        table["total"] = total
+# Change sequence numbers for delta sync
+CHANGES_SEQUENCE = "changes"
+
+async def next_change(restaurant: Restaurant) -> int:
+    """Number the next write that changes what the floor or an order shows"""
+    change_seq = await restaurant.repo.next_sequence(CHANGES_SEQUENCE)
+    if restaurant.own_changes is not None:
+        # This process publishes its own events; check_changes skips these
+        restaurant.own_changes.add(change_seq)
+    return change_seq
+
+@api.get("/tables")
+async def get_tables(since: Optional[int] = None, repo: Repository = Depends(current_repository)):
+    """Get all tables with their current status
+
+    The X-Change-Seq header carries the change sequence number the floor is
+    current to. With `since`, returns only the tables changed after it as
+    {"seq", "tables"}; nothing changed costs a single counter read.
+    """
+    # Read the counter before the data, so the data is at least as new as seq
+    seq = await repo.get_sequence(CHANGES_SEQUENCE)
+    if since is None:
+        return ORJSONResponse(await repo.list_floor(), headers={"X-Change-Seq": str(seq)})
     
-    return tables
+    tables = await repo.list_floor(since=max(since - SYNC_OVERLAP, 0)) if seq > since else []
+    return ORJSONResponse({"seq": seq, "tables": tables})
 
-@app.get("/api/tables/{table_id}")
-async def get_table(table_id: str):
+@api.get("/tables/{table_id}")
+async def get_table(table_id: str, repo: Repository = Depends(current_repository)):
     """Get table details"""
-    table = await db.tables.find_one({"id": table_id})
+    table = await repo.get_table(table_id)
     if not table:
         raise HTTPException(status_code=404, detail="Table not found")
     
-    table = serialize_mongo_doc(table)
-    
     # Get active order
-    active_order = await db.orders.find_one({"table_id": table_id, "is_closed": False})
+    active_order = await repo.get_table_order(table)
     if active_order:
-        active_order = serialize_mongo_doc(active_order)
-        items = await db.order_items.find({"order_id": active_order["id"]}).to_list(None)
-        items = [serialize_mongo_doc(item) for item in items]
+        items = await repo.list_items([active_order["id"]])
         table["active_order"] = active_order
         table["items"] = items
     
-    return table
+    return ORJSONResponse(table)
 
-@app.post("/api/tables/open")
-async def open_table(request: OpenTableRequest):
-    """Open a table with number of covers"""
-    table = await db.tables.find_one({"id": request.table_id})
+@api.get("/tables/{table_id}/bootstrap")
+async def get_table_bootstrap(table_id: str, catalog_version: Optional[int] = None,
+                              restaurant: Restaurant = Depends(current_restaurant)):
+    """Everything the menu screen of a table needs, in one request
+
+    Returns {"table", "catalog_version", "catalog", "order"}. catalog holds the
+    categories, the products grouped by category, the dough types and the
+    extras; it is null when `catalog_version` is the current version, so a
+    client keeping the menu only downloads it after it changed. order is
+    {"order", "items", "total"} for the active order, or null, and the
+    X-Change-Seq header carries the change sequence number it is current to.
+    """
+    repo = restaurant.repo
+    catalog = restaurant.catalog
+    # Read the counter before the data, so the data is at least as new as seq
+    seq, table = await asyncio.gather(repo.get_sequence(CHANGES_SEQUENCE), repo.get_table(table_id))
     if not table:
         raise HTTPException(status_code=404, detail="Table not found")
     
-    # Update table status
-    await db.tables.update_one(
-        {"id": request.table_id},
-        {
-            "$set": {
-                "status": "occupied",
-                "covers": request.covers
-            },
-            "$inc": {"use_count": 1}
+    order = None
+    active_order = await repo.get_table_order(table)
+    if active_order:
+        items = await repo.list_items([active_order["id"]])
+        order = {
+            "order": active_order,
+            "items": items,
+            "total": order_total(active_order, items)
+        }
+    
+    menu = None
+    if catalog_version != catalog.version:
+        menu = {
+            "categories": catalog.categories,
+            "products": catalog.menu,
+            "dough_types": catalog.dough_types,
+            "extras": catalog.extras
         }
-    )
     
-    # Create new order
+    return ORJSONResponse({
+        "table": table,
+        "catalog_version": catalog.version,
+        "catalog": menu,
+        "order": order
+    }, headers={"X-Change-Seq": str(seq)})
+
+async def table_conflict(repo: Repository, table_id: str, detail: str):
+    """404 if the table does not exist, otherwise a 409 with ``detail``"""
+    if not await repo.get_table(table_id):
+        raise HTTPException(status_code=404, detail="Table not found")
+    raise HTTPException(status_code=409, detail=detail)
+
+@api.post("/tables/open")
+async def open_table(request: OpenTableRequest, restaurant: Restaurant = Depends(current_restaurant)):
+    """Open a table with number of covers"""
+    repo = restaurant.repo
+    change_seq = await next_change(restaurant)
     order = {
         "id": str(uuid.uuid4()),
         "table_id": request.table_id,
         "created_at": datetime.now(),
         "is_sent": False,
-        "is_closed": False
+        "is_closed": False,
+        "items_count": 0,
+        "total": 0.0,
+        "change_seq": change_seq
     }
     
-    await db.orders.insert_one(order)
+    # Claim the table first; only one of two waiters opening it at once gets
+    # through, and only the winner's order is ever stored. The order is found
+    # through the table's order_id, so nothing reads it before it is claimed
+    table = await repo.occupy_table(request.table_id, request.covers, order["id"], change_seq)
+    if not table:
+        await table_conflict(repo, request.table_id, "Table is already open")
+    await repo.insert_orders([order])
+    
+    # Nobody waits on the use count, so it is stored in the background
+    restaurant.writes.increment("tables", request.table_id, "use_count")
+    use_count = table.get("use_count", 0) + restaurant.writes.unapplied_increment(
+        "tables", request.table_id, "use_count"
+    )
+    
+    restaurant.events.publish("table_opened", {
+        "table_id": request.table_id,
+        "order_id": order["id"],
+        "covers": request.covers,
+        "use_count": use_count
+    })
     
     return {"message": "Table opened successfully", "order_id": order["id"]}
 
-@app.post("/api/tables/{table_id}/close")
-async def close_table(table_id: str):
+@api.post("/tables/{table_id}/close")
+async def close_table(table_id: str, restaurant: Restaurant = Depends(current_restaurant)):
     """Close a table"""
-    table = await db.tables.find_one({"id": table_id})
+    repo = restaurant.repo
+    # Free the table first, so a second close of the same table gets a 409
+    change_seq = await next_change(restaurant)
+    table = await repo.release_table(table_id, change_seq)
     if not table:
-        raise HTTPException(status_code=404, detail="Table not found")
+        await table_conflict(repo, table_id, "Table is not open")
     
-    # Close active order
-    await db.orders.update_many(
-        {"table_id": table_id, "is_closed": False},
-        {"$set": {"is_closed": True}}
-    )
+    if table.get("order_id"):
+        order_ids = [table["order_id"]]
+    else:
+        # Tables opened before their order was recorded on them
+        order_ids = [order["id"] for order in await repo.list_open_orders(table_id)]
     
-    # Reset table
-    await db.tables.update_one(
-        {"id": table_id},
-        {
-            "$set": {
-                "status": "free",
-                "covers": 0
-            }
-        }
+    closed_at = datetime.now()
+    closed_orders, items = await asyncio.gather(
+        asyncio.gather(*(repo.close_order(order_id, closed_at, change_seq) for order_id in order_ids)),
+        repo.list_items(order_ids)
     )
     
+    # Materialize the receipts of the orders just closed; they never change again
+    receipts = []
+    increments = []
+    for order in closed_orders:
+        if not order:
+            continue
+        order_items = [item for item in items if item["order_id"] == order["id"]]
+        receipt = build_receipt(order, table, order_items)
+        receipts.append({"order_id": order["id"], **receipt})
+        increments.extend(rollup_increments(order, order_items, restaurant.catalog.products_by_id))
+    
+    if receipts:
+        # Fold the sales into the report rollups alongside
+        await asyncio.gather(repo.save_receipts(receipts), repo.add_to_rollups(increments))
+    
+    restaurant.events.publish("table_closed", {"table_id": table_id})
+    
     return {"message": "Table closed successfully"}
 
 # Products
-@app.get("/api/products")
-async def get_products(category: Optional[str] = None):
+@api.get("/products")
+async def get_products(request: Request, category: Optional[str] = None,
+                       restaurant: Restaurant = Depends(current_restaurant)):
     """Get all products or by category"""
-    filter_query = {}
+    catalog = restaurant.catalog
+    products = catalog.products
     if category:
-        filter_query["category"] = category
+        products = [product for product in products if product["category"] == category]
     
-    products = await db.products.find(filter_query).to_list(None)
-    products = [serialize_mongo_doc(product) for product in products]
-    return products
+    return catalog_response(request, catalog, products)
 
-@app.get("/api/products/categories")
-async def get_categories():
+@api.get("/products/categories")
+async def get_categories(request: Request, restaurant: Restaurant = Depends(current_restaurant)):
     """Get all product categories"""
-    categories = await db.products.distinct("category")
-    return categories
+    return catalog_response(request, restaurant.catalog, restaurant.catalog.categories)
 
 # Dough types and extras
-@app.get("/api/dough-types")
-async def get_dough_types():
+@api.get("/dough-types")
+async def get_dough_types(request: Request, restaurant: Restaurant = Depends(current_restaurant)):
     """Get all dough types"""
-    dough_types = await db.dough_types.find().to_list(None)
-    dough_types = [serialize_mongo_doc(dough_type) for dough_type in dough_types]
-    return dough_types
+    return catalog_response(request, restaurant.catalog, restaurant.catalog.dough_types)
 
-@app.get("/api/extras")
-async def get_extras():
+@api.get("/extras")
+async def get_extras(request: Request, restaurant: Restaurant = Depends(current_restaurant)):
     """Get all extras"""
-    extras = await db.extras.find().to_list(None)
-    extras = [serialize_mongo_doc(extra) for extra in extras]
-    return extras
+    return catalog_response(request, restaurant.catalog, restaurant.catalog.extras)
 
-# Orders
-@app.post("/api/orders/add-item")
-async def add_item_to_order(request: AddItemRequest):
-    """Add an item to an active order"""
-    # Get active order for table
-    active_order = await db.orders.find_one({"table_id": request.table_id, "is_closed": False})
-    if not active_order:
-        raise HTTPException(status_code=404, detail="No active order found for this table")
+@api.post("/catalog/refresh")
+async def refresh_catalog_cache(restaurant: Restaurant = Depends(current_restaurant)):
+    """Reload the menu after it was changed in the database"""
+    await restaurant.catalog.invalidate()
+    return {"message": "Catalog refreshed", "version": restaurant.catalog.version}
+
+# Catalog import and export
+CATALOG_SECTIONS = {"products": ProductEntry, "dough_types": DoughTypeEntry, "extras": ExtraEntry}
+CATALOG_CSV_COLUMNS = ["section", "code", "name", "price", "category", "type", "is_customizable"]
+
+def catalog_csv_rows(section: str, entries: List[dict]):
+    for entry in entries:
+        price = entry["additional_price"] if section == "dough_types" else entry["price"]
+        yield [
+            section, entry["code"], entry["name"], price,
+            entry.get("category", ""), entry.get("type", ""), entry.get("is_customizable", "")
+        ]
+
+def parse_catalog_csv(text: str) -> dict:
+    """Sections of a CSV catalog; dough types keep their additional price in the price column"""
+    sections = {section: [] for section in CATALOG_SECTIONS}
+    for row in csv.DictReader(io.StringIO(text)):
+        section = row.get("section")
+        if section not in sections:
+            raise HTTPException(status_code=400, detail=f"Unknown catalog section {section!r}")
+        if section == "dough_types":
+            entry = {"code": row["code"], "name": row["name"], "additional_price": row["price"]}
+        elif section == "extras":
+            entry = {"code": row["code"], "name": row["name"], "price": row["price"]}
+        else:
+            entry = {field: row[field] for field in CATALOG_CSV_COLUMNS[1:] if row.get(field)}
+        sections[section].append(entry)
+    return sections
+
+@api.get("/catalog/export")
+async def export_catalog(format: str = "json", repo: Repository = Depends(current_repository)):
+    """Download products, dough types and extras as JSON or CSV, keyed on their codes"""
+    if format not in ("json", "csv"):
+        raise HTTPException(status_code=400, detail="Unsupported export format")
+    products, dough_types, extras = await repo.load_catalog()
+    sections = {
+        section: [
+            {field: entry.get(field) for field in model.model_fields}
+            for entry in sorted(entries, key=lambda entry: entry.get("code") or "")
+            if entry.get("code")
+        ]
+        for (section, model), entries in zip(CATALOG_SECTIONS.items(), (products, dough_types, extras))
+    }
+    
+    headers = {"Content-Disposition": f'attachment; filename="catalog.{format}"'}
+    if format == "json":
+        return ORJSONResponse(sections, headers=headers)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CATALOG_CSV_COLUMNS)
+    for section, entries in sections.items():
+        writer.writerows(catalog_csv_rows(section, entries))
+    return Response(buffer.getvalue(), media_type="text/csv", headers=headers)
+
+@api.post("/catalog/import")
+async def import_catalog(request: Request, format: str = "json", restaurant: Restaurant = Depends(current_restaurant)):
+    """Insert or update products, dough types and extras from a JSON or CSV export
+
+    Entries are matched on their code with one bulk write of upserts per
+    collection; entries missing from the file are left alone. The catalog
+    version is bumped when anything changed, so every cache reloads.
+    """
+    if format not in ("json", "csv"):
+        raise HTTPException(status_code=400, detail="Unsupported import format")
+    body = await request.body()
+    try:
+        if format == "json":
+            catalog_import = CatalogImport.model_validate_json(body)
+        else:
+            catalog_import = CatalogImport.model_validate(parse_catalog_csv(body.decode("utf-8-sig")))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Catalog CSV must be UTF-8")
+    except ValidationError as error:
+        raise HTTPException(status_code=422, detail=error.errors(include_url=False, include_context=False))
+    
+    sections = {section: getattr(catalog_import, section) for section in CATALOG_SECTIONS}
+    for section, entries in sections.items():
+        codes = [entry.code for entry in entries]
+        if len(set(codes)) != len(codes):
+            raise HTTPException(status_code=400, detail=f"Duplicate codes in {section}")
     
-    active_order = serialize_mongo_doc(active_order)
+    counts = dict(zip(sections, await asyncio.gather(*(
+        restaurant.repo.upsert_catalog_entries(section, [{"id": str(uuid.uuid4()), **entry.model_dump()} for entry in entries])
+        for section, entries in sections.items()
+    ))))
+    if any(count["inserted"] or count["updated"] for count in counts.values()):
+        await restaurant.catalog.invalidate()
+    return {**counts, "version": restaurant.catalog.version}
+
+# Order item pricing
+async def lookup_catalog(repo: Repository, collection: str, field: str, keys: set, cached: dict) -> dict:
+    """Resolve keys from the catalog cache, fetching any misses in one query"""
+    found = {key: cached[key] for key in keys if key in cached}
+    missing = [key for key in keys if key not in found]
+    if missing:
+        docs = await repo.find_catalog_entries(collection, field, missing)
+        found.update((doc[field], doc) for doc in docs)
+    return found
+
+async def resolve_catalog(restaurant: Restaurant, lines: List[AddItemLine]):
+    """Get the products, dough types and extras referenced by order lines"""
+    product_ids = {line.product_id for line in lines}
+    dough_names = {line.dough_type for line in lines if line.dough_type}
+    extra_ids = {extra_id for line in lines for extra_id in line.extra_ids}
     
-    # Get product
-    product = await db.products.find_one({"id": request.product_id})
+    repo, catalog = restaurant.repo, restaurant.catalog
+    return await asyncio.gather(
+        lookup_catalog(repo, "products", "id", product_ids, catalog.products_by_id),
+        lookup_catalog(repo, "dough_types", "name", dough_names, catalog.dough_types_by_name),
+        lookup_catalog(repo, "extras", "id", extra_ids, catalog.extras_by_id),
+    )
+
+def build_order_item(order_id: str, line: AddItemLine, products: dict, doughs: dict, extras: dict) -> dict:
+    """Price an order line into an order item document
+
+    unit_price is the price of one, dough and extras included; total_price
+    is that times the quantity.
+    """
+    product = products.get(line.product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    product = serialize_mongo_doc(product)
-    
-    # Calculate total price
-    total_price = product["price"]
+    # Calculate the price of one
+    unit_price = product["price"]
     
     # Create order item
     order_item = {
         "id": str(uuid.uuid4()),
-        "order_id": active_order["id"],
-        "product_id": request.product_id,
+        "order_id": order_id,
+        "product_id": line.product_id,
         "name": product["name"],
         "price": product["price"],
         "product_type": product["type"],
-        "dough_type": request.dough_type,
-        "extras": []
+        "dough_type": line.dough_type,
+        "extras": [],
+        "extra_ids": []
     }
     
     # Add dough price if applicable
-    if request.dough_type:
-        dough = await db.dough_types.find_one({"name": request.dough_type})
+    if line.dough_type:
+        dough = doughs.get(line.dough_type)
         if dough:
-            dough = serialize_mongo_doc(dough)
-            total_price += dough["additional_price"]
+            unit_price += dough["additional_price"]
     
     # Add extras if applicable
-    if request.extra_ids:
-        for extra_id in request.extra_ids:
-            extra = await db.extras.find_one({"id": extra_id})
-            if extra:
-                extra = serialize_mongo_doc(extra)
-                order_item["extras"].append({
-                    "id": str(uuid.uuid4()),
-                    "name": extra["name"],
-                    "price": extra["price"]
-                })
-                total_price += extra["price"]
+    for extra_id in sorted(line.extra_ids):
+        extra = extras.get(extra_id)
+        if extra:
+            order_item["extras"].append({
+                "id": str(uuid.uuid4()),
+                "name": extra["name"],
+                "price": extra["price"]
+            })
+            order_item["extra_ids"].append(extra_id)
+            unit_price += extra["price"]
     
-    order_item["total_price"] = total_price
+    order_item["unit_price"] = unit_price
+    order_item["quantity"] = line.quantity
+    order_item["total_price"] = unit_price * line.quantity
+    return order_item
+
+def fold_order_items(items: List[dict]) -> List[dict]:
+    """Merge the lines of one request that are the same dish, adding up their quantities"""
+    folded = {}
+    for item in items:
+        line = folded.get(order_line_key(item))
+        if line is None:
+            folded[order_line_key(item)] = item
+            continue
+        line["quantity"] += item["quantity"]
+        line["total_price"] += item["total_price"]
+    return list(folded.values())
+
+# Live updates
+@api.get("/events")
+async def stream_events(restaurant: Restaurant = Depends(current_restaurant)):
+    """Stream table and order changes as Server-Sent Events"""
+    events = restaurant.events
+    queue = events.subscribe()
     
-    await db.order_items.insert_one(order_item)
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout=EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+        finally:
+            events.unsubscribe(queue)
     
-    return {"message": "Item added successfully", "item": order_item}
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-@app.delete("/api/orders/items/{item_id}")
-async def remove_item_from_order(item_id: str):
-    """Remove an item from an order"""
-    result = await db.order_items.delete_one({"id": item_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Item not found")
+# Orders
+@api.post("/orders/add-item")
+async def add_item_to_order(request: AddItemRequest, restaurant: Restaurant = Depends(current_restaurant)):
+    """Add an item to an active order
+
+    An identical line of the order that was not sent yet has the quantity
+    added instead, and comes back as the item.
+    """
+    repo = restaurant.repo
+    # Get active order for table
+    active_order, change_seq = await asyncio.gather(repo.get_open_order(request.table_id), next_change(restaurant))
+    if not active_order:
+        raise HTTPException(status_code=404, detail="No active order found for this table")
+    
+    # Price the item from the menu catalog
+    products, doughs, extras = await resolve_catalog(restaurant, [request])
+    order_item = build_order_item(active_order["id"], request, products, doughs, extras)
+    order_item["change_seq"] = change_seq
+    
+    stored = await repo.merge_items(active_order["id"], [order_item], change_seq)
+    
+    # Keep the running totals on the order
+    order = await repo.add_to_order_totals(
+        active_order["id"], order_item["quantity"], order_item["total_price"], change_seq
+    )
+    
+    restaurant.events.publish("items_added", {
+        "table_id": request.table_id,
+        "order_id": active_order["id"],
+        "items": stored,
+        "items_count": order["items_count"],
+        "total": order["total"]
+    })
     
-    return {"message": "Item removed successfully"}
+    return ORJSONResponse({"message": "Item added successfully", "item": stored[0], "total": order["total"]})
 
-@app.get("/api/orders/table/{table_id}")
-async def get_order_for_table(table_id: str):
-    """Get active order for a table"""
-    active_order = await db.orders.find_one({"table_id": table_id, "is_closed": False})
+@api.post("/orders/add-items")
+async def add_items_to_order(request: AddItemsRequest, restaurant: Restaurant = Depends(current_restaurant)):
+    """Add several items to an active order at once, merging identical lines as add-item does"""
+    repo = restaurant.repo
+    active_order, change_seq = await asyncio.gather(repo.get_open_order(request.table_id), next_change(restaurant))
     if not active_order:
-        raise HTTPException(status_code=404, detail="No active order found")
+        raise HTTPException(status_code=404, detail="No active order found for this table")
     
-    active_order = serialize_mongo_doc(active_order)
+    # Price every line before writing anything, so a bad line rejects the batch
+    products, doughs, extras = await resolve_catalog(restaurant, request.items)
+    order_items = fold_order_items([
+        {**build_order_item(active_order["id"], line, products, doughs, extras), "change_seq": change_seq}
+        for line in request.items
+    ])
     
-    # Get order items
-    items = await db.order_items.find({"order_id": active_order["id"]}).to_list(None)
-    items = [serialize_mongo_doc(item) for item in items]
+    stored = await repo.merge_items(active_order["id"], order_items, change_seq)
     
-    # Calculate total
-    total = sum(item["total_price"] for item in items)
+    # Keep the running totals on the order
+    order = await repo.add_to_order_totals(
+        active_order["id"],
+        sum(item["quantity"] for item in order_items),
+        sum(item["total_price"] for item in order_items),
+        change_seq
+    )
     
-    return {
-        "order": active_order,
+    restaurant.events.publish("items_added", {
+        "table_id": request.table_id,
+        "order_id": active_order["id"],
+        "items": stored,
+        "items_count": order["items_count"],
+        "total": order["total"]
+    })
+    
+    return ORJSONResponse({
+        "message": "Items added successfully",
+        "items": stored,
+        "total": order["total"]
+    })
+
+@api.delete("/orders/items/{item_id}")
+async def remove_item_from_order(item_id: str, quantity: Optional[int] = None,
+                                 restaurant: Restaurant = Depends(current_restaurant)):
+    """Remove an item from an order
+
+    With `quantity`, only that many are taken off the line; the line goes
+    when no more are left. The item comes back while some are.
+    """
+    if quantity is not None and quantity < 1:
+        raise HTTPException(status_code=400, detail="Quantity must be at least 1")
+    repo = restaurant.repo
+    change_seq = await next_change(restaurant)
+    if quantity is not None:
+        item = await repo.decrement_item(item_id, quantity, change_seq)
+        if item:
+            order = await repo.add_to_order_totals(
+                item["order_id"], -quantity, -quantity * item["unit_price"], change_seq
+            )
+            if order:
+                restaurant.events.publish("item_updated", {
+                    "table_id": order["table_id"],
+                    "order_id": item["order_id"],
+                    "item": item,
+                    "items_count": order["items_count"],
+                    "total": order["total"]
+                })
+            return ORJSONResponse({
+                "message": "Item quantity reduced",
+                "item": item,
+                "total": order["total"] if order else 0.0
+            })
+    
+    item = await repo.delete_item(item_id, change_seq)
+    if not item:
+        raise HTTPException(status_code=404, detail="Item not found")
+    
+    # Keep the running totals on the order
+    order = await repo.add_to_order_totals(
+        item["order_id"], -item.get("quantity", 1), -item["total_price"], change_seq
+    )
+    
+    if order:
+        restaurant.events.publish("item_removed", {
+            "table_id": order["table_id"],
+            "order_id": item["order_id"],
+            "item_id": item_id,
+            "items_count": order["items_count"],
+            "total": order["total"]
+        })
+    
+    return {"message": "Item removed successfully", "total": order["total"] if order else 0.0}
+
+@api.get("/orders/table/{table_id}")
+async def get_order_for_table(table_id: str, since: Optional[int] = None,
+                              repo: Repository = Depends(current_repository)):
+    """Get active order for a table
+
+    The X-Change-Seq header carries the change sequence number the order is
+    current to. With `since`, returns {"seq", "order", "items", "deleted_item_ids",
+    "total"} where order is null unless it changed, items holds only the items
+    changed after `since` and deleted_item_ids the items removed since.
+    """
+    # Read the counter before the data, so the data is at least as new as seq
+    seq = await repo.get_sequence(CHANGES_SEQUENCE)
+    if since is not None and seq <= since:
+        return ORJSONResponse({"seq": seq, "order": None, "items": [], "deleted_item_ids": [], "total": None})
+    
+    active_order = await repo.get_open_order(table_id)
+    if not active_order:
+        raise HTTPException(status_code=404, detail="No active order found")
+    
+    if since is None:
+        items = await repo.list_items([active_order["id"]])
+        return ORJSONResponse({
+            "order": active_order,
+            "items": items,
+            "total": order_total(active_order, items)
+        }, headers={"X-Change-Seq": str(seq)})
+    
+    after = max(since - SYNC_OVERLAP, 0)
+    items, deleted_item_ids = await asyncio.gather(
+        repo.list_items([active_order["id"]], since=after),
+        repo.list_deleted_items(active_order["id"], after)
+    )
+    # Adding up an order without a stored total takes all of its items
+    total = active_order["total"] if "total" in active_order else order_total(
+        active_order, await repo.list_items([active_order["id"]])
+    )
+    return ORJSONResponse({
+        "seq": seq,
+        "order": active_order if active_order.get("change_seq", 0) > after else None,
         "items": items,
+        "deleted_item_ids": deleted_item_ids,
         "total": total
-    }
+    })
 
-@app.post("/api/orders/{order_id}/send")
-async def send_order(order_id: str):
+@api.post("/orders/{order_id}/send")
+async def send_order(order_id: str, restaurant: Restaurant = Depends(current_restaurant)):
     """Send an order to kitchen/pizzeria"""
-    result = await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {"is_sent": True}}
-    )
+    repo = restaurant.repo
+    change_seq = await next_change(restaurant)
+    order = await repo.mark_order_sent(order_id, change_seq)
     
-    if result.matched_count == 0:
+    if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    return {"message": "Order sent successfully"}
+    # Claim the items not sent yet, so a repeated send never queues them twice
+    batch_id = str(uuid.uuid4())
+    items = await repo.claim_unsent_items(order_id, batch_id, change_seq)
+    
+    # One ticket per station, numbered in the station's own sequence
+    by_station = {}
+    for item in items:
+        by_station.setdefault(station_for(item), []).append(item)
+    
+    tickets = []
+    for station, station_items in by_station.items():
+        tickets.append({
+            "id": str(uuid.uuid4()),
+            "station": station,
+            "seq": await repo.next_sequence(f"station:{station}"),
+            "order_id": order_id,
+            "table_id": order["table_id"],
+            "items": station_items,
+            "status": "pending",
+            "created_at": datetime.now()
+        })
+    
+    if tickets:
+        await repo.insert_tickets(tickets)
+        for ticket in tickets:
+            restaurant.notify_station(ticket["station"])
+    
+    restaurant.events.publish("order_sent", {"table_id": order["table_id"], "order_id": order_id})
+    
+    return {
+        "message": "Order sent successfully",
+        "tickets": [{"id": ticket["id"], "station": ticket["station"], "seq": ticket["seq"]} for ticket in tickets]
+    }
 
-@app.get("/api/orders/{order_id}/receipt")
-async def get_receipt(order_id: str):
+@api.get("/orders/{order_id}/receipt")
+async def get_receipt(order_id: str, repo: Repository = Depends(current_repository)):
     """Get receipt for an order"""
-    order = await db.orders.find_one({"id": order_id})
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
+    # Closed orders have their receipt stored at close time
+    stored, order = await asyncio.gather(
+        repo.get_stored_receipt(order_id),
+        repo.get_order(order_id)
+    )
+    if stored:
+        return ORJSONResponse(stored)
     
-    order = serialize_mongo_doc(order)
+    if order:
+        table, items = await asyncio.gather(
+            repo.get_table(order["table_id"]),
+            repo.list_items([order_id])
+        )
+    else:
+        # Orders closed long ago live in the archive with their items
+        order = await repo.get_archived_order(order_id)
+        if not order:
+            raise HTTPException(status_code=404, detail="Order not found")
+        items = order.pop("items")
+        table = await repo.get_table(order["table_id"])
     
-    # Get table
-    table = await db.tables.find_one({"id": order["table_id"]})
-    table = serialize_mongo_doc(table)
+    return ORJSONResponse(build_receipt(order, table, items))
+
+@api.get("/orders/{order_id}")
+async def get_order(order_id: str, repo: Repository = Depends(current_repository)):
+    """Get an order with its items, whether live or archived"""
+    order = await repo.get_order(order_id)
+    if order:
+        items = await repo.list_items([order_id])
+    else:
+        order = await repo.get_archived_order(order_id)
+        if not order:
+            raise HTTPException(status_code=404, detail="Order not found")
+        items = order.pop("items")
     
-    # Get items
-    items = await db.order_items.find({"order_id": order_id}).to_list(None)
-    items = [serialize_mongo_doc(item) for item in items]
+    return ORJSONResponse({
+        "order": order,
+        "items": items,
+        "total": order_total(order, items)
+    })
+
+# Exports
+EXPORT_CSV_COLUMNS = [
+    "cursor", "order_id", "table_id", "created_at", "closed_at", "is_closed", "order_total",
+    "item_id", "product_id", "name", "product_type", "dough_type", "extras", "price", "quantity",
+    "total_price"
+]
+
+def encode_cursor(order: dict) -> str:
+    """Resume token pointing just past an exported order"""
+    position = [order["created_at"].isoformat(), order["id"]]
+    return base64.urlsafe_b64encode(orjson.dumps(position)).decode()
+
+def decode_cursor(token: str):
+    try:
+        created_at, order_id = orjson.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.fromisoformat(created_at), order_id
+    except (binascii.Error, orjson.JSONDecodeError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def order_csv_rows(order: dict, cursor: str):
+    """One row per item; an order without items still gets a row"""
+    order_columns = [
+        cursor, order["id"], order["table_id"], order["created_at"].isoformat(),
+        order["closed_at"].isoformat() if order.get("closed_at") else "",
+        order["is_closed"], order_total(order, order["items"])
+    ]
+    for item in order["items"] or [None]:
+        if item is None:
+            yield order_columns + [""] * 9
+            continue
+        yield order_columns + [
+            item["id"], item["product_id"], item["name"], item["product_type"], item.get("dough_type") or "",
+            "; ".join(extra["name"] for extra in item.get("extras", [])), item["price"], item.get("quantity", 1),
+            item["total_price"]
+        ]
+
+@api.get("/exports/orders")
+async def export_orders(start: date, end: date, format: str = "ndjson", after: Optional[str] = None,
+                        repo: Repository = Depends(current_repository)):
+    """Stream orders created from `start` to `end` (inclusive) with their items, as NDJSON or CSV
+
+    Orders come in (created_at, id) order. Every NDJSON line and every CSV row
+    carries the cursor of its order; pass the cursor of the last order received
+    in full as `after` to resume an interrupted download.
+    """
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="Unsupported export format")
+    position = decode_cursor(after) if after else None
+    orders = repo.iter_orders(
+        datetime.combine(start, time.min),
+        datetime.combine(end + timedelta(days=1), time.min),
+        position
+    )
     
-    # Group items by type
-    kitchen_items = [item for item in items if item["product_type"] == "kitchen"]
-    pizzeria_items = [item for item in items if item["product_type"] == "pizzeria" and item.get("dough_type") != "Senza Glutine"]
-    gluten_free_items = [item for item in items if item["product_type"] == "pizzeria" and item.get("dough_type") == "Senza Glutine"]
+    async def ndjson_lines():
+        async for order in orders:
+            items = order.pop("items")
+            yield orjson.dumps({"cursor": encode_cursor(order), "order": order, "items": items}) + b"\n"
     
-    # Count dough types
-    dough_summary = {}
-    for item in items:
-        if item["product_type"] == "pizzeria" and item.get("dough_type"):
-            dough_type = item["dough_type"]
-            dough_summary[dough_type] = dough_summary.get(dough_type, 0) + 1
+    async def csv_lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_CSV_COLUMNS)
+        yield buffer.getvalue()
+        async for order in orders:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(order_csv_rows(order, encode_cursor(order)))
+            yield buffer.getvalue()
     
-    total = sum(item["total_price"] for item in items)
+    filename = f"orders-{start.isoformat()}-{end.isoformat()}.{format}"
+    return StreamingResponse(
+        ndjson_lines() if format == "ndjson" else csv_lines(),
+        media_type="application/x-ndjson" if format == "ndjson" else "text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# Reports
+@api.get("/reports/{dimension}")
+async def get_sales_report(dimension: str, start: Optional[str] = None, end: Optional[str] = None,
+                           repo: Repository = Depends(current_repository)):
+    """Revenue and item counts of closed orders per day, hour, product, category or dough type"""
+    if dimension not in ROLLUP_DIMENSIONS:
+        raise HTTPException(status_code=404, detail="Report not found")
     
-    return {
-        "order": order,
-        "table": table,
-        "kitchen_items": kitchen_items,
-        "pizzeria_items": pizzeria_items,
-        "gluten_free_items": gluten_free_items,
-        "dough_summary": dough_summary,
-        "total": total
-    }
+    rows = await repo.list_rollups(dimension, start, end)
+    if dimension not in TIME_DIMENSIONS:
+        rows.sort(key=lambda row: row["revenue"], reverse=True)
+    
+    return ORJSONResponse({
+        "dimension": dimension,
+        "rows": rows,
+        "revenue": sum(row["revenue"] for row in rows),
+        "items_count": sum(row["items_count"] for row in rows)
+    })
+
+# Instrumentation
+@app.get("/metrics")
+async def get_metrics():
+    """Request and database timings in the Prometheus text format"""
+    return Response(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+# Maintenance commands
+async def reconcile_order_totals(repo: Repository, fix: bool = False) -> int:
+    """Compare stored order totals with their items and report the drift"""
+    checked = 0
+    drifted = []
+    async for order in repo.audit_order_totals():
+        checked += 1
+        if (order.get("items_count") != order["actual_items_count"]
+                or abs(order.get("total", 0.0) - order["actual_total"]) > 0.005):
+            drifted.append(order)
+            print(
+                f"order {order['id']} (table {order['table_id']}): "
+                f"stored {order.get('items_count')} items / {order.get('total')}, "
+                f"actual {order['actual_items_count']} items / {order['actual_total']}"
+            )
+    
+    if fix and drifted:
+        await repo.set_order_totals([
+            {
+                "id": order["id"],
+                "items_count": order["actual_items_count"],
+                "total": float(order["actual_total"])
+            }
+            for order in drifted
+        ])
+    
+    print(f"Checked {checked} orders, {len(drifted)} drifted{', fixed' if fix and drifted else ''}")
+    return 1 if drifted and not fix else 0
+
+async def rebuild_sales_rollups(repo: Repository) -> int:
+    """Recompute the report rollups from every closed order"""
+    written = await repo.rebuild_rollups()
+    print(f"Rebuilt {written} sales rollups")
+    return 0
+
+# Stations
+@api.get("/stations/{station}/tickets")
+async def get_station_tickets(station: str, wait: float = 0, limit: int = 50,
+                              restaurant: Restaurant = Depends(current_restaurant)):
+    """Get pending tickets for a station in queue order, waiting up to `wait` seconds for new ones"""
+    if station not in STATIONS:
+        raise HTTPException(status_code=404, detail="Station not found")
+    
+    deadline = asyncio.get_running_loop().time() + min(max(wait, 0), TICKETS_MAX_WAIT_SECONDS)
+    while True:
+        # Take the wakeup before reading, so a ticket queued in between is not missed
+        wakeup = restaurant.station_wakeups[station]
+        tickets = await restaurant.repo.list_pending_tickets(station, limit)
+        
+        remaining = deadline - asyncio.get_running_loop().time()
+        if tickets or remaining <= 0:
+            return ORJSONResponse(tickets)
+        
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=min(remaining, TICKETS_RECHECK_SECONDS))
+        except asyncio.TimeoutError:
+            pass
+
+@api.post("/stations/{station}/tickets/{ticket_id}/ack")
+async def ack_station_ticket(station: str, ticket_id: str, repo: Repository = Depends(current_repository)):
+    """Mark a ticket as taken by the station"""
+    if not await repo.ack_ticket(station, ticket_id, datetime.now()):
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    
+    return {"message": "Ticket acknowledged"}
+
+app.include_router(api, prefix="/api")
+app.include_router(api, prefix="/api/restaurants/{restaurant_id}")
+
+async def run_for_restaurants(command, restaurant_ids: List[str]) -> int:
+    """Run a maintenance command on each restaurant; non-zero if it failed for any"""
+    status = 0
+    for restaurant_id in restaurant_ids:
+        print(f"Restaurant {restaurant_id}")
+        status = max(status, await command(storage.repository(restaurant_id)))
+    return status
 
 if __name__ == "__main__":
+    import argparse
+    import sys
+    
+    parser = argparse.ArgumentParser(description="Ristorante Manager API")
+    parser.set_defaults(host="0.0.0.0", port=8001, workers=int(os.getenv("WEB_CONCURRENCY", "1")))
+    commands = parser.add_subparsers(dest="command")
+    serve = commands.add_parser(
+        "serve",
+        help="run the API server (default)",
+        description="Run the API server. Under gunicorn use "
+                    "`gunicorn -k uvicorn.workers.UvicornWorker -w N server:app` instead."
+    )
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=8001)
+    serve.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")),
+                       help="worker processes, each with its own connection pool (default: $WEB_CONCURRENCY or 1)")
+    reconcile = commands.add_parser("reconcile", help="check stored order totals against their items")
+    reconcile.add_argument("--fix", action="store_true", help="rewrite the totals that drifted")
+    rebuild = commands.add_parser("rebuild-rollups", help="recompute the sales report rollups from closed orders")
+    archive = commands.add_parser("archive", help="move closed orders out of the live collections now")
+    archive.add_argument("--older-than", type=float, default=ARCHIVE_AFTER_SECONDS,
+                         help="seconds since closing (default: $ARCHIVE_AFTER_SECONDS)")
+    for command in (reconcile, rebuild, archive):
+        command.add_argument("--restaurant", action="append", dest="restaurants", metavar="ID",
+                             help="restaurant to run on, repeatable (default: every one in $RESTAURANTS)")
+    args = parser.parse_args()
+    
+    async def archive_now(repo):
+        print(f"Archived {await archive_closed_orders(repo, args.older_than)} closed orders")
+        return 0
+    
+    maintenance = {
+        "reconcile": lambda repo: reconcile_order_totals(repo, args.fix),
+        "rebuild-rollups": rebuild_sales_rollups,
+        "archive": archive_now,
+    }
+    if args.command in maintenance:
+        sys.exit(asyncio.run(run_for_restaurants(maintenance[args.command], args.restaurants or RESTAURANT_IDS)))
+    
+    if args.workers > 1 and not storage.shared:
+        parser.error(f"--workers {args.workers} needs storage the workers share; "
+                     f"with this STORAGE_BACKEND each worker would keep its own data")
+    
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    if args.workers > 1:
+        # Workers import the app themselves; seeding is safe to race
+        uvicorn.run("server:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
\ No newline at end of file
@@ -0,0 +1,40 @@
+"""Storage backends behind the API
+
+STORAGE_BACKEND picks one: "mongo" (default, MONGO_URL), "memory" or
+"sqlite" (SQLITE_PATH). The Mongo database is the one named in MONGO_URL,
+ristorante_manager if it names none. MONGO_MAX_POOL_SIZE and
+MONGO_MIN_POOL_SIZE size the Motor connection pool of each worker process.
+"""
+import os
+
+from .base import COLLECTIONS, RESTAURANT_ID_PATTERN, Repository, Storage, order_line_key
+
+
+def create_storage(legacy_restaurant_id: str, event_listeners=()) -> Storage:
+    """Build the configured backend
+
+    Mongo documents written before restaurants existed are handed to
+    ``legacy_restaurant_id``; ``event_listeners`` are pymongo command listeners.
+    """
+    backend = os.getenv("STORAGE_BACKEND", "mongo")
+
+    if backend == "mongo":
+        from motor.motor_asyncio import AsyncIOMotorClient
+        from .mongo import MongoStorage
+        client = AsyncIOMotorClient(
+            os.getenv("MONGO_URL", "mongodb://localhost:27017/ristorante_manager"),
+            maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+            minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+            event_listeners=list(event_listeners)
+        )
+        return MongoStorage(client.get_default_database("ristorante_manager"), legacy_restaurant_id)
+
+    if backend == "memory":
+        from .memory import MemoryStorage
+        return MemoryStorage()
+
+    if backend == "sqlite":
+        from .sqlite import SqliteStorage
+        return SqliteStorage(os.getenv("SQLITE_PATH", "ristorante_manager.db"))
+
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}")
@@ -0,0 +1,329 @@
+import heapq
+import re
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+# Collections every backend stores, in the shape the API returns them
+COLLECTIONS = [
+    "tables",
+    "orders",
+    "order_items",
+    "tombstones",
+    "products",
+    "dough_types",
+    "extras",
+    "receipts",
+    "station_tickets",
+    "counters",
+    "meta",
+    "sales_rollups",
+    "archived_orders",
+]
+
+# Restaurant ids end up in index keys and SQLite table names, so they stay plain
+RESTAURANT_ID_PATTERN = re.compile(r"[a-z0-9][a-z0-9_-]{0,39}")
+
+
+def order_line_key(item: dict) -> tuple:
+    """What makes two order lines the same dish at the same price
+
+    Unsent lines with equal keys are merged into one with the quantities added.
+    Lines stored before quantities existed carry no unit_price and never merge.
+    """
+    return item["product_id"], item.get("dough_type"), tuple(item.get("extra_ids", ())), item.get("unit_price")
+
+
+async def merge_sorted(key, *streams):
+    """Merge async iterators that are each sorted by ``key``"""
+    heads = []
+    for index, stream in enumerate(streams):
+        iterator = stream.__aiter__()
+        async for doc in iterator:
+            heads.append((key(doc), index, doc, iterator))
+            break
+    heapq.heapify(heads)
+
+    while heads:
+        _, index, doc, iterator = heads[0]
+        yield doc
+        async for following in iterator:
+            heapq.heapreplace(heads, (key(following), index, following, iterator))
+            break
+        else:
+            heapq.heappop(heads)
+
+
+class Repository(ABC):
+    """Storage of one restaurant, used by the API routes
+
+    Every read and write stays within the restaurant. Documents go in and
+    come out as plain dicts without any storage-specific fields such as
+    Mongo's _id or restaurant_id; callers may mutate what they get back. Writes
+    that change what the floor or an order shows stamp the documents they touch
+    with a ``change_seq``, for clients syncing only what changed.
+    """
+
+    # Lifecycle
+    @abstractmethod
+    async def reset(self):
+        """Delete every document of the restaurant (benchmarks and tests only)"""
+
+    # Seeding
+    @abstractmethod
+    async def is_seeded(self) -> bool:
+        """Whether the seed data was written"""
+
+    @abstractmethod
+    async def claim_seed_lock(self, owner: str, lease_seconds: float) -> bool:
+        """Take the seeding lock for ``owner`` unless another owner holds an unexpired lease"""
+
+    @abstractmethod
+    async def mark_seeded(self, owner: str):
+        """Record that ``owner`` finished seeding"""
+
+    @abstractmethod
+    async def insert_missing(self, collection: str, field: str, docs: List[dict]):
+        """Insert the documents whose ``field`` value is not stored yet"""
+
+    @abstractmethod
+    async def insert_tables(self, tables: List[dict]):
+        """Add tables"""
+
+    # Catalog
+    @abstractmethod
+    async def load_catalog(self):
+        """Return (products, dough_types, extras)"""
+
+    @abstractmethod
+    async def find_catalog_entries(self, collection: str, field: str, keys: Iterable[str]) -> List[dict]:
+        """Catalog documents of one collection whose ``field`` is one of ``keys``"""
+
+    @abstractmethod
+    async def get_catalog_version(self) -> int:
+        """Stored catalog version, 0 if the catalog was never bumped"""
+
+    @abstractmethod
+    async def bump_catalog_version(self) -> int:
+        """Increment the catalog version and return the new value"""
+
+    @abstractmethod
+    async def upsert_catalog_entries(self, collection: str, entries: List[dict]) -> Dict[str, int]:
+        """Insert or update catalog documents matched on their ``code``
+
+        An entry's ``id`` is only stored when the entry is inserted. Returns the
+        inserted, updated and unchanged counts.
+        """
+
+    # Tables
+    @abstractmethod
+    async def list_floor(self, since: Optional[int] = None) -> List[dict]:
+        """Tables in service, each with items_count and total of its open orders
+
+        With ``since``, only the tables that changed, or whose orders changed,
+        after that change sequence number.
+        """
+
+    @abstractmethod
+    async def get_table(self, table_id: str) -> Optional[dict]:
+        """A table by id"""
+
+    @abstractmethod
+    async def occupy_table(self, table_id: str, covers: int, order_id: str, change_seq: int) -> Optional[dict]:
+        """Move a free table to occupied with ``covers`` and its order
+
+        Returns the updated table, or None if the table is missing or not free.
+        """
+
+    @abstractmethod
+    async def release_table(self, table_id: str, change_seq: int) -> Optional[dict]:
+        """Move an occupied table back to free with no covers
+
+        Returns the table as it was, or None if the table is missing or not occupied.
+        """
+
+    # Orders
+    @abstractmethod
+    async def insert_orders(self, orders: List[dict]):
+        """Add orders"""
+
+    @abstractmethod
+    async def get_order(self, order_id: str) -> Optional[dict]:
+        """An order by id"""
+
+    @abstractmethod
+    async def get_open_order(self, table_id: str) -> Optional[dict]:
+        """The open order of a table, see get_table_order"""
+
+    @abstractmethod
+    async def get_table_order(self, table: dict) -> Optional[dict]:
+        """The open order of a table already read: the one its order_id names
+
+        Tables opened before their order was recorded on them fall back to the
+        open order with their table_id.
+        """
+
+    @abstractmethod
+    async def list_open_orders(self, table_id: str) -> List[dict]:
+        """Every open order of a table"""
+
+    @abstractmethod
+    async def close_order(self, order_id: str, closed_at: datetime, change_seq: int) -> Optional[dict]:
+        """Close an open order at ``closed_at``; return it closed, None if it was not open"""
+
+    @abstractmethod
+    async def archive_closed_orders(self, closed_before: datetime, limit: int) -> int:
+        """Move up to ``limit`` orders closed before ``closed_before`` and their items to the archive"""
+
+    @abstractmethod
+    async def get_archived_order(self, order_id: str) -> Optional[dict]:
+        """An archived order by id, with its items embedded under its "items" key"""
+
+    @abstractmethod
+    async def mark_order_sent(self, order_id: str, change_seq: int) -> Optional[dict]:
+        """Flag an order as sent; return it, or None if it does not exist"""
+
+    @abstractmethod
+    async def add_to_order_totals(self, order_id: str, items_count: int, total: float,
+                                  change_seq: int) -> Optional[dict]:
+        """Add to an order's running totals; return the updated order"""
+
+    @abstractmethod
+    def iter_orders(self, start: datetime, end: datetime,
+                    after: Optional[Tuple[datetime, str]] = None) -> AsyncIterator[dict]:
+        """Yield live and archived orders created in [start, end) with their items under "items"
+
+        Orders come ordered by (created_at, id), beginning after ``after``.
+        """
+
+    # Order items
+    @abstractmethod
+    async def insert_items(self, items: List[dict]):
+        """Add order items"""
+
+    @abstractmethod
+    async def merge_items(self, order_id: str, items: List[dict], change_seq: int) -> List[dict]:
+        """Add order lines, each merged into an unsent line of the order with the same order_line_key
+
+        A merged line gets the new line's quantity and total_price added and
+        its change_seq. Returns each line as stored after the call.
+        """
+
+    @abstractmethod
+    async def decrement_item(self, item_id: str, quantity: int, change_seq: int) -> Optional[dict]:
+        """Take ``quantity`` off a line holding more than that
+
+        Returns the line after the change, or None if it does not exist or
+        holds ``quantity`` or fewer.
+        """
+
+    @abstractmethod
+    async def list_items(self, order_ids: List[str], since: Optional[int] = None) -> List[dict]:
+        """Items of the given orders, in insertion order; with ``since``, only those changed after it"""
+
+    @abstractmethod
+    async def delete_item(self, item_id: str, change_seq: int) -> Optional[dict]:
+        """Remove an item, leaving a tombstone; return it, or None if it does not exist"""
+
+    @abstractmethod
+    async def list_deleted_items(self, order_id: str, since: int) -> List[str]:
+        """Ids of the order's items deleted after change ``since``"""
+
+    @abstractmethod
+    async def claim_unsent_items(self, order_id: str, batch_id: str, change_seq: int) -> List[dict]:
+        """Stamp the order's items not sent yet with ``batch_id`` and return them"""
+
+    # Receipts
+    @abstractmethod
+    async def save_receipts(self, receipts: List[dict]):
+        """Store receipts, replacing any stored for the same order_id"""
+
+    @abstractmethod
+    async def get_stored_receipt(self, order_id: str) -> Optional[dict]:
+        """The stored receipt of an order, without its order_id key"""
+
+    # Station tickets
+    @abstractmethod
+    async def next_sequence(self, name: str) -> int:
+        """Allocate the next value of a named counter"""
+
+    @abstractmethod
+    async def get_sequence(self, name: str) -> int:
+        """Last value allocated from a named counter, 0 if none was"""
+
+    @abstractmethod
+    async def insert_tickets(self, tickets: List[dict]):
+        """Queue station tickets"""
+
+    @abstractmethod
+    async def list_pending_tickets(self, station: str, limit: int) -> List[dict]:
+        """Pending tickets of a station, lowest sequence first"""
+
+    @abstractmethod
+    async def ack_ticket(self, station: str, ticket_id: str, acked_at) -> bool:
+        """Mark a ticket acknowledged; False if the station has no such ticket"""
+
+    # Sales rollups
+    @abstractmethod
+    async def add_to_rollups(self, increments: List[dict]):
+        """Add revenue, items_count and orders_count to rollups, creating missing ones"""
+
+    @abstractmethod
+    async def list_rollups(self, dimension: str, start: Optional[str] = None, end: Optional[str] = None) -> List[dict]:
+        """Rollups of one dimension with start <= key <= end, ordered by key"""
+
+    @abstractmethod
+    async def rebuild_rollups(self) -> int:
+        """Recompute every rollup from the closed and archived orders; return how many were written"""
+
+    # Deferred writes
+    @abstractmethod
+    async def apply_writes(self, writes: List[dict]):
+        """Apply writes queued by a write-behind buffer, in order
+
+        ``{"collection", "id", "inc": {field: amount}}`` adds to fields of the
+        document with that id and ``{"collection", "insert": doc}`` inserts a
+        document.
+        """
+
+    # Maintenance
+    @abstractmethod
+    def audit_order_totals(self) -> AsyncIterator[dict]:
+        """Yield every order's stored totals next to the totals of its items
+
+        Each entry has id, table_id, items_count, total, actual_items_count
+        and actual_total.
+        """
+
+    @abstractmethod
+    async def set_order_totals(self, totals: List[Dict]):
+        """Overwrite items_count and total of the orders in ``totals``"""
+
+
+class Storage(ABC):
+    """Data of every restaurant, handed out as one Repository per restaurant"""
+
+    # Whether other processes opening the same storage see the same data
+    shared = True
+
+    def __init__(self):
+        self.repositories: Dict[str, Repository] = {}
+
+    async def setup(self):
+        """Create the indexes or schema the queries rely on"""
+
+    async def close(self):
+        """Release connections"""
+
+    def repository(self, restaurant_id: str) -> Repository:
+        """The repository of one restaurant, created on first use"""
+        repository = self.repositories.get(restaurant_id)
+        if repository is None:
+            if not RESTAURANT_ID_PATTERN.fullmatch(restaurant_id):
+                raise ValueError(f"Invalid restaurant id {restaurant_id!r}")
+            repository = self.repositories[restaurant_id] = self.open_repository(restaurant_id)
+        return repository
+
+    @abstractmethod
+    def open_repository(self, restaurant_id: str) -> Repository:
+        """Build the repository of one restaurant"""
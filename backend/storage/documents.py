@@ -0,0 +1,498 @@
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from .base import Repository, merge_sorted, order_line_key
+from .rollups import rollup_increments
+
+# Field each collection is keyed on; everything else is keyed on "id"
+KEY_FIELDS = {"receipts": "order_id"}
+
+# Fields the stores keep a lookup on, besides the key
+INDEXED_FIELDS = {
+    "orders": ["table_id"],
+    "order_items": ["order_id"],
+    "tombstones": ["order_id"],
+    "station_tickets": ["station"],
+    "sales_rollups": ["dimension"],
+}
+
+# Datetime fields the stores keep sorted, together with the key, for find_range
+SORTED_FIELDS = {
+    "orders": "created_at",
+    "archived_orders": "created_at",
+}
+
+# Orders read per query while exporting
+EXPORT_BATCH_SIZE = 200
+
+
+def key_field(collection: str) -> str:
+    return KEY_FIELDS.get(collection, "id")
+
+
+class DocumentStore(ABC):
+    """Minimal document storage the non-Mongo repositories are written against
+
+    ``find`` filters on equality: a list value matches any of its elements and
+    None matches a missing field. Documents come back in insertion order.
+    """
+
+    @abstractmethod
+    def transaction(self):
+        """Context manager grouping the writes of one repository call"""
+
+    @abstractmethod
+    def find(self, collection: str, **filters) -> List[dict]:
+        """Documents matching every filter"""
+
+    @abstractmethod
+    def find_range(self, collection: str, start: datetime, end: datetime,
+                   after: Optional[Tuple[datetime, str]], limit: int) -> List[dict]:
+        """Up to ``limit`` documents whose SORTED_FIELDS field is in ``[start, end)``
+
+        They come ordered by that field and then the key, starting past the
+        ``(field, key)`` pair ``after``.
+        """
+
+    @abstractmethod
+    def insert(self, collection: str, docs: List[dict]):
+        """Add documents"""
+
+    @abstractmethod
+    def put(self, collection: str, doc: dict):
+        """Insert ``doc`` or replace the document with the same key"""
+
+    @abstractmethod
+    def delete(self, collection: str, key: str):
+        """Remove the document with ``key``"""
+
+    @abstractmethod
+    def clear(self):
+        """Remove every document"""
+
+
+class DocumentRepository(Repository):
+    """Repository over a DocumentStore
+
+    Every method runs without awaiting, so on one event loop each call is
+    atomic the same way a single Mongo update is.
+    """
+
+    def __init__(self, store: DocumentStore):
+        self.store = store
+
+    def find_one(self, collection: str, **filters) -> Optional[dict]:
+        docs = self.store.find(collection, **filters)
+        return docs[0] if docs else None
+
+    async def reset(self):
+        with self.store.transaction():
+            self.store.clear()
+
+    # Seeding
+    async def is_seeded(self) -> bool:
+        return self.find_one("meta", id="seed", done=True) is not None
+
+    async def claim_seed_lock(self, owner: str, lease_seconds: float) -> bool:
+        now = datetime.now()
+        with self.store.transaction():
+            lock = self.find_one("meta", id="seed")
+            if lock and (lock["done"] or (lock["owner"] != owner and lock["expires_at"] >= now)):
+                return False
+            self.store.put("meta", {
+                "id": "seed",
+                "owner": owner,
+                "expires_at": now + timedelta(seconds=lease_seconds),
+                "done": False
+            })
+        return True
+
+    async def mark_seeded(self, owner: str):
+        with self.store.transaction():
+            lock = self.find_one("meta", id="seed", owner=owner)
+            if lock:
+                lock["done"] = True
+                self.store.put("meta", lock)
+
+    async def insert_missing(self, collection: str, field: str, docs: List[dict]):
+        with self.store.transaction():
+            stored = {doc.get(field) for doc in self.store.find(collection)}
+            self.store.insert(collection, [doc for doc in docs if doc[field] not in stored])
+
+    async def insert_tables(self, tables: List[dict]):
+        with self.store.transaction():
+            self.store.insert("tables", tables)
+
+    # Catalog
+    async def load_catalog(self):
+        return self.store.find("products"), self.store.find("dough_types"), self.store.find("extras")
+
+    async def find_catalog_entries(self, collection: str, field: str, keys: Iterable[str]) -> List[dict]:
+        return self.store.find(collection, **{field: list(keys)})
+
+    async def get_catalog_version(self) -> int:
+        meta = self.find_one("meta", id="catalog")
+        return meta["version"] if meta else 0
+
+    async def bump_catalog_version(self) -> int:
+        with self.store.transaction():
+            meta = self.find_one("meta", id="catalog") or {"id": "catalog", "version": 0}
+            meta["version"] += 1
+            self.store.put("meta", meta)
+        return meta["version"]
+
+    async def upsert_catalog_entries(self, collection: str, entries: List[dict]) -> Dict[str, int]:
+        counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+        with self.store.transaction():
+            stored = {doc.get("code"): doc for doc in self.store.find(collection)}
+            for entry in entries:
+                doc = stored.get(entry["code"])
+                if doc is None:
+                    doc = stored[entry["code"]] = dict(entry)
+                    counts["inserted"] += 1
+                else:
+                    changes = {field: value for field, value in entry.items() if field != "id"}
+                    if all(doc.get(field) == value for field, value in changes.items()):
+                        counts["unchanged"] += 1
+                        continue
+                    doc.update(changes)
+                    counts["updated"] += 1
+                self.store.put(collection, doc)
+        return counts
+
+    # Tables
+    async def list_floor(self, since: Optional[int] = None) -> List[dict]:
+        tables = self.store.find("tables", is_closed=False)
+        if since is not None:
+            changed = {table["id"] for table in tables if table.get("change_seq", 0) > since}
+            changed.update(
+                order["table_id"] for order in self.store.find("orders")
+                if order.get("change_seq", 0) > since
+            )
+            tables = [table for table in tables if table["id"] in changed]
+
+        totals = {}
+        for order in self.store.find("orders", is_closed=False):
+            summary = totals.setdefault(order["table_id"], {"items_count": 0, "total": 0.0})
+            summary["items_count"] += order.get("items_count", 0)
+            summary["total"] += order.get("total", 0.0)
+
+        for table in tables:
+            summary = totals.get(table["id"])
+            table["items_count"] = summary["items_count"] if summary else 0
+            table["total"] = float(summary["total"]) if summary else 0.0
+        return tables
+
+    async def get_table(self, table_id: str) -> Optional[dict]:
+        return self.find_one("tables", id=table_id)
+
+    async def occupy_table(self, table_id: str, covers: int, order_id: str, change_seq: int) -> Optional[dict]:
+        with self.store.transaction():
+            table = self.find_one("tables", id=table_id, status="free")
+            if table:
+                table["status"] = "occupied"
+                table["covers"] = covers
+                table["order_id"] = order_id
+                table["change_seq"] = change_seq
+                self.store.put("tables", table)
+        return table
+
+    async def release_table(self, table_id: str, change_seq: int) -> Optional[dict]:
+        with self.store.transaction():
+            table = self.find_one("tables", id=table_id, status="occupied")
+            if table:
+                released = dict(table, status="free", covers=0, change_seq=change_seq)
+                released.pop("order_id", None)
+                self.store.put("tables", released)
+        return table
+
+    # Orders
+    async def insert_orders(self, orders: List[dict]):
+        with self.store.transaction():
+            self.store.insert("orders", orders)
+
+    async def get_order(self, order_id: str) -> Optional[dict]:
+        return self.find_one("orders", id=order_id)
+
+    async def get_open_order(self, table_id: str) -> Optional[dict]:
+        table = self.find_one("tables", id=table_id)
+        return await self.get_table_order(table) if table else None
+
+    async def get_table_order(self, table: dict) -> Optional[dict]:
+        if table.get("order_id"):
+            return self.find_one("orders", id=table["order_id"], is_closed=False)
+        if table["status"] == "occupied":
+            return self.find_one("orders", table_id=table["id"], is_closed=False)
+        return None
+
+    async def list_open_orders(self, table_id: str) -> List[dict]:
+        return self.store.find("orders", table_id=table_id, is_closed=False)
+
+    async def close_order(self, order_id: str, closed_at: datetime, change_seq: int) -> Optional[dict]:
+        with self.store.transaction():
+            order = self.find_one("orders", id=order_id, is_closed=False)
+            if order:
+                order["is_closed"] = True
+                order["closed_at"] = closed_at
+                order["change_seq"] = change_seq
+                self.store.put("orders", order)
+        return order
+
+    async def archive_closed_orders(self, closed_before: datetime, limit: int) -> int:
+        with self.store.transaction():
+            orders = [
+                order for order in self.store.find("orders", is_closed=True)
+                if order.get("closed_at") is None or order["closed_at"] < closed_before
+            ][:limit]
+            if not orders:
+                return 0
+
+            by_order = {}
+            for item in self.store.find("order_items", order_id=[order["id"] for order in orders]):
+                by_order.setdefault(item["order_id"], []).append(item)
+            for order in orders:
+                self.store.put("archived_orders", {**order, "items": by_order.get(order["id"], [])})
+                for item in by_order.get(order["id"], []):
+                    self.store.delete("order_items", item["id"])
+                for tombstone in self.store.find("tombstones", order_id=order["id"]):
+                    self.store.delete("tombstones", tombstone["id"])
+                self.store.delete("orders", order["id"])
+        return len(orders)
+
+    async def iter_orders(self, start: datetime, end: datetime,
+                          after: Optional[Tuple[datetime, str]] = None) -> AsyncIterator[dict]:
+        last_key = None
+        async for order in merge_sorted(lambda order: (order["created_at"], order["id"]),
+                                        self.iter_order_pages("orders", start, end, after),
+                                        self.iter_order_pages("archived_orders", start, end, after)):
+            # An order archived between two pages can show up on both sides
+            key = (order["created_at"], order["id"])
+            if key != last_key:
+                last_key = key
+                yield order
+
+    async def iter_order_pages(self, collection: str, start: datetime, end: datetime,
+                               after: Optional[Tuple[datetime, str]]) -> AsyncIterator[dict]:
+        """Orders of ``collection`` with their items, read one page at a time"""
+        while True:
+            orders = self.store.find_range(collection, start, end, after, EXPORT_BATCH_SIZE)
+            live = [order["id"] for order in orders if "items" not in order]
+            by_order = {}
+            for item in self.store.find("order_items", order_id=live):
+                by_order.setdefault(item["order_id"], []).append(item)
+            for order in orders:
+                if "items" not in order:
+                    order["items"] = by_order.get(order["id"], [])
+                yield order
+            if len(orders) < EXPORT_BATCH_SIZE:
+                return
+            after = (orders[-1]["created_at"], orders[-1]["id"])
+
+    async def get_archived_order(self, order_id: str) -> Optional[dict]:
+        return self.find_one("archived_orders", id=order_id)
+
+    async def mark_order_sent(self, order_id: str, change_seq: int) -> Optional[dict]:
+        with self.store.transaction():
+            order = self.find_one("orders", id=order_id)
+            if order:
+                order["is_sent"] = True
+                order["change_seq"] = change_seq
+                self.store.put("orders", order)
+        return order
+
+    async def add_to_order_totals(self, order_id: str, items_count: int, total: float,
+                                  change_seq: int) -> Optional[dict]:
+        with self.store.transaction():
+            order = self.find_one("orders", id=order_id)
+            if order:
+                order["items_count"] = order.get("items_count", 0) + items_count
+                order["total"] = order.get("total", 0.0) + total
+                order["change_seq"] = change_seq
+                self.store.put("orders", order)
+        return order
+
+    # Order items
+    async def insert_items(self, items: List[dict]):
+        with self.store.transaction():
+            self.store.insert("order_items", items)
+
+    async def merge_items(self, order_id: str, items: List[dict], change_seq: int) -> List[dict]:
+        stored = []
+        with self.store.transaction():
+            unsent = self.store.find("order_items", order_id=order_id, sent_batch=None)
+            lines = {order_line_key(line): line for line in unsent}
+            for item in items:
+                line = lines.get(order_line_key(item))
+                if line is None:
+                    self.store.insert("order_items", [item])
+                    stored.append(dict(item))
+                    continue
+                line["quantity"] += item["quantity"]
+                line["total_price"] += item["total_price"]
+                line["change_seq"] = change_seq
+                self.store.put("order_items", line)
+                stored.append(dict(line))
+        return stored
+
+    async def decrement_item(self, item_id: str, quantity: int, change_seq: int) -> Optional[dict]:
+        with self.store.transaction():
+            item = self.find_one("order_items", id=item_id)
+            if not item or item.get("quantity", 1) <= quantity:
+                return None
+            item["quantity"] -= quantity
+            item["total_price"] -= quantity * item["unit_price"]
+            item["change_seq"] = change_seq
+            self.store.put("order_items", item)
+        return item
+
+    async def list_items(self, order_ids: List[str], since: Optional[int] = None) -> List[dict]:
+        items = self.store.find("order_items", order_id=list(order_ids))
+        if since is not None:
+            items = [item for item in items if item.get("change_seq", 0) > since]
+        return items
+
+    async def delete_item(self, item_id: str, change_seq: int) -> Optional[dict]:
+        with self.store.transaction():
+            item = self.find_one("order_items", id=item_id)
+            if item:
+                self.store.delete("order_items", item_id)
+                self.store.put("tombstones", {"id": item_id, "order_id": item["order_id"], "change_seq": change_seq})
+        return item
+
+    async def list_deleted_items(self, order_id: str, since: int) -> List[str]:
+        return [
+            tombstone["id"] for tombstone in self.store.find("tombstones", order_id=order_id)
+            if tombstone["change_seq"] > since
+        ]
+
+    async def claim_unsent_items(self, order_id: str, batch_id: str, change_seq: int) -> List[dict]:
+        with self.store.transaction():
+            items = self.store.find("order_items", order_id=order_id, sent_batch=None)
+            for item in items:
+                item["sent_batch"] = batch_id
+                item["change_seq"] = change_seq
+                self.store.put("order_items", item)
+        return items
+
+    # Receipts
+    async def save_receipts(self, receipts: List[dict]):
+        with self.store.transaction():
+            for receipt in receipts:
+                self.store.put("receipts", receipt)
+
+    async def get_stored_receipt(self, order_id: str) -> Optional[dict]:
+        receipt = self.find_one("receipts", order_id=order_id)
+        if receipt:
+            del receipt["order_id"]
+        return receipt
+
+    # Station tickets
+    async def next_sequence(self, name: str) -> int:
+        with self.store.transaction():
+            counter = self.find_one("counters", id=name) or {"id": name, "seq": 0}
+            counter["seq"] += 1
+            self.store.put("counters", counter)
+        return counter["seq"]
+
+    async def get_sequence(self, name: str) -> int:
+        counter = self.find_one("counters", id=name)
+        return counter["seq"] if counter else 0
+
+    async def insert_tickets(self, tickets: List[dict]):
+        with self.store.transaction():
+            self.store.insert("station_tickets", tickets)
+
+    async def list_pending_tickets(self, station: str, limit: int) -> List[dict]:
+        tickets = self.store.find("station_tickets", station=station, status="pending")
+        return sorted(tickets, key=lambda ticket: ticket["seq"])[:limit]
+
+    async def ack_ticket(self, station: str, ticket_id: str, acked_at) -> bool:
+        with self.store.transaction():
+            ticket = self.find_one("station_tickets", id=ticket_id, station=station)
+            if ticket:
+                ticket["status"] = "acked"
+                ticket["acked_at"] = acked_at
+                self.store.put("station_tickets", ticket)
+        return ticket is not None
+
+    # Sales rollups
+    def fold_rollups(self, increments: List[dict]):
+        for increment in increments:
+            rollup = self.find_one("sales_rollups", id=increment["id"])
+            if rollup:
+                for field in ("revenue", "items_count", "orders_count"):
+                    rollup[field] += increment[field]
+                if "name" in increment:
+                    rollup["name"] = increment["name"]
+            else:
+                rollup = dict(increment)
+            self.store.put("sales_rollups", rollup)
+
+    async def add_to_rollups(self, increments: List[dict]):
+        with self.store.transaction():
+            self.fold_rollups(increments)
+
+    # Deferred writes
+    async def apply_writes(self, writes: List[dict]):
+        with self.store.transaction():
+            for write in writes:
+                if "insert" in write:
+                    self.store.insert(write["collection"], [dict(write["insert"])])
+                    continue
+                doc = self.find_one(write["collection"], id=write["id"])
+                if doc:
+                    for field, amount in write["inc"].items():
+                        doc[field] = doc.get(field, 0) + amount
+                    self.store.put(write["collection"], doc)
+
+    async def list_rollups(self, dimension: str, start: Optional[str] = None, end: Optional[str] = None) -> List[dict]:
+        rollups = [
+            rollup for rollup in self.store.find("sales_rollups", dimension=dimension)
+            if (start is None or rollup["key"] >= start) and (end is None or rollup["key"] <= end)
+        ]
+        return sorted(rollups, key=lambda rollup: rollup["key"])
+
+    async def rebuild_rollups(self) -> int:
+        products = {product["id"]: product for product in self.store.find("products")}
+        orders = self.store.find("orders", is_closed=True)
+        items = {}
+        for item in self.store.find("order_items", order_id=[order["id"] for order in orders]):
+            items.setdefault(item["order_id"], []).append(item)
+        for archived in self.store.find("archived_orders"):
+            items[archived["id"]] = archived.pop("items")
+            orders.append(archived)
+
+        with self.store.transaction():
+            for rollup in self.store.find("sales_rollups"):
+                self.store.delete("sales_rollups", rollup["id"])
+            for order in orders:
+                self.fold_rollups(rollup_increments(order, items.get(order["id"], []), products))
+        return len(self.store.find("sales_rollups"))
+
+    # Maintenance
+    async def audit_order_totals(self) -> AsyncIterator[dict]:
+        actual = {}
+        for item in self.store.find("order_items"):
+            count, total = actual.get(item["order_id"], (0, 0.0))
+            actual[item["order_id"]] = (count + item.get("quantity", 1), total + item["total_price"])
+
+        for order in self.store.find("orders"):
+            count, total = actual.get(order["id"], (0, 0.0))
+            yield {
+                "id": order["id"],
+                "table_id": order["table_id"],
+                "items_count": order.get("items_count"),
+                "total": order.get("total"),
+                "actual_items_count": count,
+                "actual_total": total
+            }
+
+    async def set_order_totals(self, totals: List[Dict]):
+        with self.store.transaction():
+            for entry in totals:
+                order = self.find_one("orders", id=entry["id"])
+                if order:
+                    order["items_count"] = entry["items_count"]
+                    order["total"] = entry["total"]
+                    self.store.put("orders", order)
@@ -0,0 +1,115 @@
+import copy
+import heapq
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from .base import COLLECTIONS, Storage
+from .documents import INDEXED_FIELDS, SORTED_FIELDS, DocumentRepository, DocumentStore, key_field
+
+
+def matches(doc: dict, filters: dict) -> bool:
+    for field, value in filters.items():
+        if isinstance(value, list):
+            if doc.get(field) not in value:
+                return False
+        elif doc.get(field) != value:
+            return False
+    return True
+
+
+class MemoryStore(DocumentStore):
+    """Documents in dicts of the process, for tests and local runs"""
+
+    def __init__(self):
+        self.clear()
+
+    def transaction(self):
+        return nullcontext()
+
+    def clear(self):
+        # Dicts keep insertion order, which is the order find returns
+        self.collections: Dict[str, Dict[str, dict]] = {name: {} for name in COLLECTIONS}
+        self.indexes = {
+            name: {field: {} for field in fields}
+            for name, fields in INDEXED_FIELDS.items()
+        }
+
+    def candidates(self, collection: str, filters: dict) -> List[dict]:
+        docs = self.collections[collection]
+        key = key_field(collection)
+        if isinstance(filters.get(key), str):
+            doc = docs.get(filters[key])
+            return [doc] if doc else []
+
+        for field, keys in self.indexes.get(collection, {}).items():
+            value = filters.get(field)
+            if isinstance(value, str):
+                return [docs[doc_key] for doc_key in keys.get(value, ())]
+            if isinstance(value, list):
+                return [docs[doc_key] for one in value for doc_key in keys.get(one, ())]
+        return list(docs.values())
+
+    def find(self, collection: str, **filters) -> List[dict]:
+        return [
+            copy.deepcopy(doc)
+            for doc in self.candidates(collection, filters)
+            if matches(doc, filters)
+        ]
+
+    def find_range(self, collection: str, start: datetime, end: datetime,
+                   after: Optional[Tuple[datetime, str]], limit: int) -> List[dict]:
+        field, key = SORTED_FIELDS[collection], key_field(collection)
+        docs = (
+            doc for doc in self.collections[collection].values()
+            if start <= doc[field] < end and (after is None or (doc[field], doc[key]) > after)
+        )
+        return [
+            copy.deepcopy(doc)
+            for doc in heapq.nsmallest(limit, docs, key=lambda doc: (doc[field], doc[key]))
+        ]
+
+    def index(self, collection: str, doc: dict):
+        for field, keys in self.indexes.get(collection, {}).items():
+            keys.setdefault(doc.get(field), {})[doc[key_field(collection)]] = None
+
+    def unindex(self, collection: str, doc: dict):
+        for field, keys in self.indexes.get(collection, {}).items():
+            keys.get(doc.get(field), {}).pop(doc[key_field(collection)], None)
+
+    def insert(self, collection: str, docs: List[dict]):
+        key = key_field(collection)
+        for doc in docs:
+            if doc[key] in self.collections[collection]:
+                raise ValueError(f"Duplicate {key} {doc[key]!r} in {collection}")
+        for doc in docs:
+            self.put(collection, doc)
+
+    def put(self, collection: str, doc: dict):
+        docs = self.collections[collection]
+        key = doc[key_field(collection)]
+        if key in docs:
+            self.unindex(collection, docs[key])
+        docs[key] = copy.deepcopy(doc)
+        self.index(collection, doc)
+
+    def delete(self, collection: str, key: str):
+        doc = self.collections[collection].pop(key, None)
+        if doc:
+            self.unindex(collection, doc)
+
+
+class MemoryRepository(DocumentRepository):
+    """Storage held in the process; lost when it exits"""
+
+    def __init__(self):
+        super().__init__(MemoryStore())
+
+
+class MemoryStorage(Storage):
+    """Every restaurant in its own MemoryStore"""
+
+    shared = False
+
+    def open_repository(self, restaurant_id: str) -> MemoryRepository:
+        return MemoryRepository()
@@ -0,0 +1,805 @@
+import asyncio
+import logging
+import uuid
+from itertools import groupby
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import InsertOne, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from .base import COLLECTIONS, Repository, Storage, merge_sorted, order_line_key
+from .rollups import DAY_FORMAT, HOUR_FORMAT, ROLLUP_DIMENSIONS, rollup_id
+
+# Every index leads with the restaurant, so a query of one restaurant never
+# walks the entries of another; see tenant_keys
+INDEXES = [
+    # Catalog and tables are addressed by their UUID
+    ("tables", ["id"], {"unique": True}),
+    ("tables", ["is_closed"], {}),
+    ("products", ["id"], {"unique": True}),
+    ("products", ["category"], {}),
+    ("dough_types", ["id"], {"unique": True}),
+    ("dough_types", ["name"], {}),
+    ("extras", ["id"], {"unique": True}),
+    # Stable catalog codes, which imports match on
+    ("products", ["code"], {"unique": True, "partialFilterExpression": {"code": {"$exists": True}}}),
+    ("dough_types", ["code"], {"unique": True, "partialFilterExpression": {"code": {"$exists": True}}}),
+    ("extras", ["code"], {"unique": True, "partialFilterExpression": {"code": {"$exists": True}}}),
+    ("meta", ["id"], {"unique": True}),
+
+    # Orders are looked up by id, and per table by their open/closed state
+    ("orders", ["id"], {"unique": True}),
+    ("orders", ["table_id", "is_closed"], {}),
+    # Open orders only, so the floor view stays small as history grows
+    ("orders", ["is_closed", "table_id"], {"name": "open_orders", "partialFilterExpression": {"is_closed": False}}),
+
+    ("order_items", ["id"], {"unique": True}),
+    ("order_items", ["order_id"], {}),
+    # Delta sync: what changed after a change sequence number
+    ("tables", ["change_seq"], {}),
+    ("orders", ["change_seq"], {}),
+    ("order_items", ["order_id", "change_seq"], {}),
+    ("tombstones", ["id"], {"unique": True}),
+    ("tombstones", ["order_id", "change_seq"], {}),
+
+    # Station queues are read oldest-first among the pending tickets
+    ("station_tickets", ["id"], {"unique": True}),
+    ("station_tickets", ["station", "status", "seq"], {}),
+    ("counters", ["id"], {"unique": True}),
+    ("receipts", ["order_id"], {"unique": True}),
+
+    # The archiver picks closed orders by closing time
+    ("orders", ["is_closed", "closed_at"], {}),
+    ("archived_orders", ["id"], {"unique": True}),
+
+    # Exports page through orders by creation time
+    ("orders", ["created_at", "id"], {}),
+    ("archived_orders", ["created_at", "id"], {}),
+
+    # Reports read one dimension over a key range
+    ("sales_rollups", ["id"], {"unique": True}),
+    ("sales_rollups", ["dimension", "key"], {}),
+]
+
+
+def tenant_keys(fields: List[str]) -> List[tuple]:
+    return [("restaurant_id", 1)] + [(field, 1) for field in fields]
+
+
+def tenant_lookup(restaurant_id: str, collection: str, local_field: str, foreign_field: str,
+                  as_field: str, *stages) -> dict:
+    """$lookup of one restaurant's documents
+
+    The restaurant match joins the foreign field match (MongoDB 5.0+), so the
+    join runs on the restaurant-prefixed index of the foreign collection.
+    """
+    return {"$lookup": {
+        "from": collection,
+        "localField": local_field,
+        "foreignField": foreign_field,
+        "pipeline": [{"$match": {"restaurant_id": restaurant_id}}, *stages],
+        "as": as_field
+    }}
+
+
+# Aggregation pipelines, run after a match on the restaurant
+OPEN_ORDER_TOTALS_PIPELINE = [
+    {"$match": {"is_closed": False}},
+    {"$group": {
+        "_id": "$table_id",
+        "items_count": {"$sum": "$items_count"},
+        "total": {"$sum": "$total"}
+    }}
+]
+
+
+def order_totals_audit_pipeline(restaurant_id: str) -> List[dict]:
+    """Stored order totals next to the totals recomputed from the items"""
+    return [
+        tenant_lookup(restaurant_id, "order_items", "id", "order_id", "items"),
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "table_id": 1,
+            "items_count": 1,
+            "total": 1,
+            # Lines stored before quantities existed count once
+            "actual_items_count": {"$sum": {"$map": {"input": "$items", "in": {"$ifNull": ["$$this.quantity", 1]}}}},
+            "actual_total": {"$sum": "$items.total_price"}
+        }}
+    ]
+
+
+def rollup_facet(field: str, match: Optional[dict] = None) -> List[dict]:
+    """Group joined sales lines by one dimension, counting each order once"""
+    stages = [{"$match": match}] if match else []
+    return stages + [
+        {"$group": {
+            "_id": {"key": f"${field}", "order_id": "$order_id"},
+            "revenue": {"$sum": "$revenue"},
+            "items_count": {"$sum": "$quantity"},
+            "name": {"$first": "$name"}
+        }},
+        {"$group": {
+            "_id": "$_id.key",
+            "revenue": {"$sum": "$revenue"},
+            "items_count": {"$sum": "$items_count"},
+            "orders_count": {"$sum": 1},
+            "name": {"$first": "$name"}
+        }}
+    ]
+
+
+def sales_lines_rollup_stages(restaurant_id: str) -> List[dict]:
+    """Sales rollups of order lines joined as "item" to their order"""
+    return [
+        tenant_lookup(restaurant_id, "products", "item.product_id", "id", "product",
+                      {"$project": {"_id": 0, "category": 1}}),
+        {"$project": {
+            "_id": 0,
+            "order_id": "$id",
+            "day": {"$dateToString": {"format": DAY_FORMAT, "date": "$created_at"}},
+            "hour": {"$dateToString": {"format": HOUR_FORMAT, "date": "$created_at"}},
+            "product": "$item.product_id",
+            "name": "$item.name",
+            "category": {"$ifNull": [{"$arrayElemAt": ["$product.category", 0]}, "unknown"]},
+            "product_type": "$item.product_type",
+            "dough": "$item.dough_type",
+            "revenue": "$item.total_price",
+            "quantity": {"$ifNull": ["$item.quantity", 1]}
+        }},
+        {"$facet": {
+            "day": rollup_facet("day"),
+            "hour": rollup_facet("hour"),
+            "product": rollup_facet("product"),
+            "category": rollup_facet("category"),
+            "dough": rollup_facet("dough", {"product_type": "pizzeria", "dough": {"$nin": [None, ""]}})
+        }}
+    ]
+
+
+def live_sales_rollups_pipeline(restaurant_id: str) -> List[dict]:
+    """Every sales rollup of the closed orders still in the live collections..."""
+    return [
+        {"$match": {"is_closed": True}},
+        tenant_lookup(restaurant_id, "order_items", "id", "order_id", "item"),
+        {"$unwind": "$item"},
+    ] + sales_lines_rollup_stages(restaurant_id)
+
+
+def archived_sales_rollups_pipeline(restaurant_id: str) -> List[dict]:
+    """...and of the archived ones, which embed their items"""
+    return [
+        {"$unwind": "$items"},
+        {"$project": {"id": 1, "created_at": 1, "item": "$items"}},
+    ] + sales_lines_rollup_stages(restaurant_id)
+
+
+# Fields the repositories never hand out
+HIDDEN = {"_id": 0, "restaurant_id": 0}
+
+# Order exports walk orders in this order, resuming from a (created_at, id) pair
+EXPORT_SORT = [("created_at", 1), ("id", 1)]
+EXPORT_BATCH_SIZE = 200
+
+
+class MongoRepository(Repository):
+    """Storage of one restaurant on MongoDB through Motor
+
+    Every document carries the restaurant_id, and every filter and pipeline
+    starts with it.
+    """
+
+    def __init__(self, database, restaurant_id: str):
+        self.db = database
+        self.restaurant_id = restaurant_id
+
+    def scoped(self, query: dict) -> dict:
+        """``query`` confined to the restaurant"""
+        return {"restaurant_id": self.restaurant_id, **query}
+
+    def owned(self, doc: dict) -> dict:
+        """A copy of ``doc`` to store for the restaurant"""
+        return {**doc, "restaurant_id": self.restaurant_id}
+
+    def pipeline(self, stages: List[dict], match: Optional[dict] = None) -> List[dict]:
+        return [{"$match": self.scoped(match or {})}] + stages
+
+    async def reset(self):
+        for name in COLLECTIONS:
+            await self.db[name].delete_many({"restaurant_id": self.restaurant_id})
+
+    # Seeding
+    async def is_seeded(self) -> bool:
+        return await self.db.meta.find_one(self.scoped({"id": "seed", "done": True}), HIDDEN) is not None
+
+    async def claim_seed_lock(self, owner: str, lease_seconds: float) -> bool:
+        now = datetime.now()
+        try:
+            # Matches only a lock that is free, expired or already ours; otherwise the
+            # upsert collides with the existing lock on the unique restaurant and id
+            await self.db.meta.update_one(
+                self.scoped({
+                    "id": "seed",
+                    "done": {"$ne": True},
+                    "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]
+                }),
+                {"$set": {
+                    "owner": owner,
+                    "expires_at": now + timedelta(seconds=lease_seconds),
+                    "done": False
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def mark_seeded(self, owner: str):
+        await self.db.meta.update_one(self.scoped({"id": "seed", "owner": owner}), {"$set": {"done": True}})
+
+    async def insert_missing(self, collection: str, field: str, docs: List[dict]):
+        await self.db[collection].bulk_write([
+            UpdateOne(self.scoped({field: doc[field]}), {"$setOnInsert": doc}, upsert=True)
+            for doc in docs
+        ])
+
+    async def insert_tables(self, tables: List[dict]):
+        await self.db.tables.insert_many([self.owned(table) for table in tables])
+
+    # Catalog
+    async def load_catalog(self):
+        return await asyncio.gather(
+            self.db.products.find(self.scoped({}), HIDDEN).to_list(None),
+            self.db.dough_types.find(self.scoped({}), HIDDEN).to_list(None),
+            self.db.extras.find(self.scoped({}), HIDDEN).to_list(None),
+        )
+
+    async def find_catalog_entries(self, collection: str, field: str, keys: Iterable[str]) -> List[dict]:
+        return await self.db[collection].find(self.scoped({field: {"$in": list(keys)}}), HIDDEN).to_list(None)
+
+    async def get_catalog_version(self) -> int:
+        meta = await self.db.meta.find_one(self.scoped({"id": "catalog"}), HIDDEN)
+        return meta["version"] if meta else 0
+
+    async def bump_catalog_version(self) -> int:
+        meta = await self.db.meta.find_one_and_update(
+            self.scoped({"id": "catalog"}),
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return meta["version"]
+
+    async def upsert_catalog_entries(self, collection: str, entries: List[dict]) -> Dict[str, int]:
+        if not entries:
+            return {"inserted": 0, "updated": 0, "unchanged": 0}
+        # One round trip for the whole collection; Mongo leaves equal documents unmodified
+        result = await self.db[collection].bulk_write([
+            UpdateOne(
+                self.scoped({"code": entry["code"]}),
+                {"$set": {field: value for field, value in entry.items() if field != "id"},
+                 "$setOnInsert": {"id": entry["id"]}},
+                upsert=True
+            )
+            for entry in entries
+        ])
+        return {
+            "inserted": result.upserted_count,
+            "updated": result.modified_count,
+            "unchanged": result.matched_count - result.modified_count
+        }
+
+    # Tables
+    async def list_floor(self, since: Optional[int] = None) -> List[dict]:
+        if since is None:
+            query, pipeline = {"is_closed": False}, self.pipeline(OPEN_ORDER_TOTALS_PIPELINE)
+        else:
+            changed = self.scoped({"change_seq": {"$gt": since}})
+            order_table_ids, changed_tables = await asyncio.gather(
+                self.db.orders.distinct("table_id", changed),
+                self.db.tables.distinct("id", changed),
+            )
+            table_ids = sorted(set(order_table_ids) | set(changed_tables))
+            if not table_ids:
+                return []
+            query = {"is_closed": False, "id": {"$in": table_ids}}
+            pipeline = self.pipeline(OPEN_ORDER_TOTALS_PIPELINE, {"table_id": {"$in": table_ids}})
+
+        # Item count and total of every open order, folded per table by Mongo
+        tables, summaries = await asyncio.gather(
+            self.db.tables.find(self.scoped(query), HIDDEN).to_list(None),
+            self.db.orders.aggregate(pipeline).to_list(None),
+        )
+        totals = {summary["_id"]: summary for summary in summaries}
+
+        for table in tables:
+            summary = totals.get(table["id"])
+            table["items_count"] = summary["items_count"] if summary else 0
+            table["total"] = float(summary["total"]) if summary else 0.0
+        return tables
+
+    async def get_table(self, table_id: str) -> Optional[dict]:
+        return await self.db.tables.find_one(self.scoped({"id": table_id}), HIDDEN)
+
+    async def occupy_table(self, table_id: str, covers: int, order_id: str, change_seq: int) -> Optional[dict]:
+        # Conditional on the status, so only one of two racing opens wins
+        changes = {"status": "occupied", "covers": covers, "order_id": order_id, "change_seq": change_seq}
+        table = await self.db.tables.find_one_and_update(
+            self.scoped({"id": table_id, "status": "free"}),
+            {"$set": changes},
+            projection=HIDDEN
+        )
+        # The table as it was, brought up to date here
+        if table:
+            table.update(changes)
+        return table
+
+    async def release_table(self, table_id: str, change_seq: int) -> Optional[dict]:
+        return await self.db.tables.find_one_and_update(
+            self.scoped({"id": table_id, "status": "occupied"}),
+            {
+                "$set": {
+                    "status": "free",
+                    "covers": 0,
+                    "change_seq": change_seq
+                },
+                "$unset": {"order_id": ""}
+            },
+            projection=HIDDEN
+        )
+
+    # Orders
+    async def insert_orders(self, orders: List[dict]):
+        await self.db.orders.insert_many([self.owned(order) for order in orders])
+
+    async def get_order(self, order_id: str) -> Optional[dict]:
+        return await self.db.orders.find_one(self.scoped({"id": order_id}), HIDDEN)
+
+    async def get_open_order(self, table_id: str) -> Optional[dict]:
+        table = await self.get_table(table_id)
+        return await self.get_table_order(table) if table else None
+
+    async def get_table_order(self, table: dict) -> Optional[dict]:
+        if table.get("order_id"):
+            return await self.db.orders.find_one(self.scoped({"id": table["order_id"], "is_closed": False}), HIDDEN)
+        if table["status"] == "occupied":
+            return await self.db.orders.find_one(self.scoped({"table_id": table["id"], "is_closed": False}), HIDDEN)
+        return None
+
+    async def list_open_orders(self, table_id: str) -> List[dict]:
+        return await self.db.orders.find(self.scoped({"table_id": table_id, "is_closed": False}), HIDDEN).to_list(None)
+
+    async def close_order(self, order_id: str, closed_at: datetime, change_seq: int) -> Optional[dict]:
+        changes = {"is_closed": True, "closed_at": closed_at, "change_seq": change_seq}
+        order = await self.db.orders.find_one_and_update(
+            self.scoped({"id": order_id, "is_closed": False}),
+            {"$set": changes},
+            projection=HIDDEN
+        )
+        if order:
+            order.update(changes)
+        return order
+
+    async def archive_closed_orders(self, closed_before: datetime, limit: int) -> int:
+        orders = await self.db.orders.find(
+            self.scoped({
+                "is_closed": True,
+                "$or": [{"closed_at": {"$lt": closed_before}}, {"closed_at": {"$exists": False}}]
+            }),
+            HIDDEN
+        ).limit(limit).to_list(None)
+        if not orders:
+            return 0
+
+        order_ids = [order["id"] for order in orders]
+        items = await self.db.order_items.find(self.scoped({"order_id": {"$in": order_ids}}), HIDDEN).to_list(None)
+        by_order = {}
+        for item in items:
+            by_order.setdefault(item["order_id"], []).append(item)
+
+        # Insert-only, so rerunning a batch that was interrupted after the
+        # items were deleted keeps the complete copy archived the first time
+        await self.db.archived_orders.bulk_write([
+            UpdateOne(
+                self.scoped({"id": order["id"]}),
+                {"$setOnInsert": {**order, "items": by_order.get(order["id"], [])}},
+                upsert=True
+            )
+            for order in orders
+        ], ordered=False)
+        await self.db.order_items.delete_many(self.scoped({"order_id": {"$in": order_ids}}))
+        await self.db.tombstones.delete_many(self.scoped({"order_id": {"$in": order_ids}}))
+        await self.db.orders.delete_many(self.scoped({"id": {"$in": order_ids}}))
+        return len(orders)
+
+    async def iter_live_orders(self, query: dict) -> AsyncIterator[dict]:
+        """Orders matching ``query`` with their items, fetched one batch of orders at a time"""
+        cursor = self.db.orders.find(query, HIDDEN).sort(EXPORT_SORT).batch_size(EXPORT_BATCH_SIZE)
+        batch = []
+        async for order in cursor:
+            batch.append(order)
+            if len(batch) == EXPORT_BATCH_SIZE:
+                for order_with_items in await self.attach_items(batch):
+                    yield order_with_items
+                batch = []
+        for order_with_items in await self.attach_items(batch):
+            yield order_with_items
+
+    async def attach_items(self, orders: List[dict]) -> List[dict]:
+        if not orders:
+            return []
+        items = await self.list_items([order["id"] for order in orders])
+        by_order = {}
+        for item in items:
+            by_order.setdefault(item["order_id"], []).append(item)
+        for order in orders:
+            order["items"] = by_order.get(order["id"], [])
+        return orders
+
+    async def iter_orders(self, start: datetime, end: datetime,
+                          after: Optional[Tuple[datetime, str]] = None) -> AsyncIterator[dict]:
+        query = self.scoped({"created_at": {"$gte": start, "$lt": end}})
+        if after:
+            created_at, order_id = after
+            query = {"$and": [query, {"$or": [
+                {"created_at": {"$gt": created_at}},
+                {"created_at": created_at, "id": {"$gt": order_id}}
+            ]}]}
+
+        archived = self.db.archived_orders.find(query, HIDDEN).sort(EXPORT_SORT).batch_size(EXPORT_BATCH_SIZE)
+        last_key = None
+        async for order in merge_sorted(lambda order: (order["created_at"], order["id"]),
+                                        self.iter_live_orders(query), archived):
+            # An order being archived right now can show up on both sides
+            key = (order["created_at"], order["id"])
+            if key != last_key:
+                last_key = key
+                yield order
+
+    async def get_archived_order(self, order_id: str) -> Optional[dict]:
+        return await self.db.archived_orders.find_one(self.scoped({"id": order_id}), HIDDEN)
+
+    async def mark_order_sent(self, order_id: str, change_seq: int) -> Optional[dict]:
+        return await self.db.orders.find_one_and_update(
+            self.scoped({"id": order_id}),
+            {"$set": {"is_sent": True, "change_seq": change_seq}},
+            projection=HIDDEN,
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def add_to_order_totals(self, order_id: str, items_count: int, total: float,
+                                  change_seq: int) -> Optional[dict]:
+        return await self.db.orders.find_one_and_update(
+            self.scoped({"id": order_id}),
+            {"$inc": {"items_count": items_count, "total": total}, "$set": {"change_seq": change_seq}},
+            projection=HIDDEN,
+            return_document=ReturnDocument.AFTER
+        )
+
+    # Order items
+    async def insert_items(self, items: List[dict]):
+        await self.db.order_items.insert_many([self.owned(item) for item in items])
+
+    async def merge_items(self, order_id: str, items: List[dict], change_seq: int) -> List[dict]:
+        product_ids = list({item["product_id"] for item in items})
+        unsent = await self.db.order_items.find(
+            self.scoped({"order_id": order_id, "sent_batch": None, "product_id": {"$in": product_ids}}), HIDDEN
+        ).to_list(None)
+        lines = {order_line_key(line): line for line in unsent}
+
+        async def merge(item) -> Optional[dict]:
+            line = lines.get(order_line_key(item))
+            if line is None:
+                return None
+            # Conditional on the line still being unsent; a send in between makes this a new line
+            merged = await self.db.order_items.find_one_and_update(
+                self.scoped({"id": line["id"], "sent_batch": None}),
+                {
+                    "$inc": {"quantity": item["quantity"], "total_price": item["total_price"]},
+                    "$set": {"change_seq": change_seq}
+                },
+                projection=HIDDEN
+            )
+            # The line as it was, brought up to date here
+            if merged:
+                merged["quantity"] += item["quantity"]
+                merged["total_price"] += item["total_price"]
+                merged["change_seq"] = change_seq
+            return merged
+
+        merged = await asyncio.gather(*(merge(item) for item in items))
+        new_items = [item for item, line in zip(items, merged) if line is None]
+        if new_items:
+            await self.db.order_items.insert_many([self.owned(item) for item in new_items])
+        return [line or item for item, line in zip(items, merged)]
+
+    async def decrement_item(self, item_id: str, quantity: int, change_seq: int) -> Optional[dict]:
+        # A line's unit price never changes, so the new total can be an $inc
+        item = await self.db.order_items.find_one(self.scoped({"id": item_id, "quantity": {"$gt": quantity}}), HIDDEN)
+        if not item:
+            return None
+        item = await self.db.order_items.find_one_and_update(
+            self.scoped({"id": item_id, "quantity": {"$gt": quantity}}),
+            {
+                "$inc": {"quantity": -quantity, "total_price": -quantity * item["unit_price"]},
+                "$set": {"change_seq": change_seq}
+            },
+            projection=HIDDEN
+        )
+        # The line as it was, brought up to date here
+        if item:
+            item["quantity"] -= quantity
+            item["total_price"] -= quantity * item["unit_price"]
+            item["change_seq"] = change_seq
+        return item
+
+    async def list_items(self, order_ids: List[str], since: Optional[int] = None) -> List[dict]:
+        if len(order_ids) == 1:
+            query = {"order_id": order_ids[0]}
+        else:
+            query = {"order_id": {"$in": list(order_ids)}}
+        if since is not None:
+            query["change_seq"] = {"$gt": since}
+        return await self.db.order_items.find(self.scoped(query), HIDDEN).to_list(None)
+
+    async def delete_item(self, item_id: str, change_seq: int) -> Optional[dict]:
+        item = await self.db.order_items.find_one_and_delete(self.scoped({"id": item_id}), projection=HIDDEN)
+        if item:
+            await self.db.tombstones.replace_one(
+                self.scoped({"id": item_id}),
+                self.owned({"id": item_id, "order_id": item["order_id"], "change_seq": change_seq}),
+                upsert=True
+            )
+        return item
+
+    async def list_deleted_items(self, order_id: str, since: int) -> List[str]:
+        tombstones = await self.db.tombstones.find(
+            self.scoped({"order_id": order_id, "change_seq": {"$gt": since}}), {"_id": 0, "id": 1}
+        ).to_list(None)
+        return [tombstone["id"] for tombstone in tombstones]
+
+    async def claim_unsent_items(self, order_id: str, batch_id: str, change_seq: int) -> List[dict]:
+        await self.db.order_items.update_many(
+            self.scoped({"order_id": order_id, "sent_batch": None}),
+            {"$set": {"sent_batch": batch_id, "change_seq": change_seq}}
+        )
+        return await self.db.order_items.find(
+            self.scoped({"order_id": order_id, "sent_batch": batch_id}), HIDDEN
+        ).to_list(None)
+
+    # Receipts
+    async def save_receipts(self, receipts: List[dict]):
+        await self.db.receipts.bulk_write([
+            ReplaceOne(self.scoped({"order_id": receipt["order_id"]}), self.owned(receipt), upsert=True)
+            for receipt in receipts
+        ])
+
+    async def get_stored_receipt(self, order_id: str) -> Optional[dict]:
+        return await self.db.receipts.find_one(self.scoped({"order_id": order_id}), {**HIDDEN, "order_id": 0})
+
+    # Station tickets
+    async def next_sequence(self, name: str) -> int:
+        counter = await self.db.counters.find_one_and_update(
+            self.scoped({"id": name}),
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"]
+
+    async def get_sequence(self, name: str) -> int:
+        counter = await self.db.counters.find_one(self.scoped({"id": name}), HIDDEN)
+        return counter["seq"] if counter else 0
+
+    async def insert_tickets(self, tickets: List[dict]):
+        await self.db.station_tickets.insert_many([self.owned(ticket) for ticket in tickets])
+
+    async def list_pending_tickets(self, station: str, limit: int) -> List[dict]:
+        return await self.db.station_tickets.find(
+            self.scoped({"station": station, "status": "pending"}),
+            HIDDEN
+        ).sort("seq", 1).limit(limit).to_list(None)
+
+    async def ack_ticket(self, station: str, ticket_id: str, acked_at) -> bool:
+        result = await self.db.station_tickets.update_one(
+            self.scoped({"id": ticket_id, "station": station}),
+            {"$set": {"status": "acked", "acked_at": acked_at}}
+        )
+        return result.matched_count > 0
+
+    # Sales rollups
+    async def add_to_rollups(self, increments: List[dict]):
+        if not increments:
+            return
+        updates = []
+        for increment in increments:
+            labels = {"dimension": increment["dimension"], "key": increment["key"]}
+            if "name" in increment:
+                labels["name"] = increment["name"]
+            updates.append(UpdateOne(
+                self.scoped({"id": increment["id"]}),
+                {
+                    "$inc": {
+                        "revenue": increment["revenue"],
+                        "items_count": increment["items_count"],
+                        "orders_count": increment["orders_count"]
+                    },
+                    "$set": labels
+                },
+                upsert=True
+            ))
+        await self.db.sales_rollups.bulk_write(updates, ordered=False)
+
+    # Deferred writes
+    async def apply_writes(self, writes: List[dict]):
+        # One ordered bulk write per run of writes to the same collection
+        for collection, run in groupby(writes, key=lambda write: write["collection"]):
+            operations = [
+                InsertOne(self.owned(write["insert"])) if "insert" in write
+                else UpdateOne(self.scoped({"id": write["id"]}), {"$inc": write["inc"]})
+                for write in run
+            ]
+            await self.db[collection].bulk_write(operations, ordered=True)
+
+    async def list_rollups(self, dimension: str, start: Optional[str] = None, end: Optional[str] = None) -> List[dict]:
+        query = self.scoped({"dimension": dimension})
+        key_range = {}
+        if start is not None:
+            key_range["$gte"] = start
+        if end is not None:
+            key_range["$lte"] = end
+        if key_range:
+            query["key"] = key_range
+        return await self.db.sales_rollups.find(query, HIDDEN).sort("key", 1).to_list(None)
+
+    async def rebuild_rollups(self) -> int:
+        # Each order is either live or archived, so the two results add up
+        facets = await asyncio.gather(
+            self.db.orders.aggregate(
+                self.pipeline(live_sales_rollups_pipeline(self.restaurant_id)), allowDiskUse=True
+            ).to_list(None),
+            self.db.archived_orders.aggregate(
+                self.pipeline(archived_sales_rollups_pipeline(self.restaurant_id)), allowDiskUse=True
+            ).to_list(None),
+        )
+        rollups = {}
+        for result in facets:
+            for dimension in ROLLUP_DIMENSIONS:
+                for group in result[0][dimension] if result else []:
+                    rollup = rollups.get((dimension, group["_id"]))
+                    if rollup is None:
+                        rollup = rollups[(dimension, group["_id"])] = {
+                            "id": rollup_id(dimension, group["_id"]),
+                            "dimension": dimension,
+                            "key": group["_id"],
+                            "revenue": 0.0,
+                            "items_count": 0,
+                            "orders_count": 0
+                        }
+                        if dimension == "product":
+                            rollup["name"] = group["name"]
+                    rollup["revenue"] += group["revenue"]
+                    rollup["items_count"] += group["items_count"]
+                    rollup["orders_count"] += group["orders_count"]
+        rollups = list(rollups.values())
+
+        await self.db.sales_rollups.delete_many(self.scoped({}))
+        if rollups:
+            await self.db.sales_rollups.insert_many([self.owned(rollup) for rollup in rollups])
+        return len(rollups)
+
+    # Maintenance
+    async def audit_order_totals(self) -> AsyncIterator[dict]:
+        async for order in self.db.orders.aggregate(self.pipeline(order_totals_audit_pipeline(self.restaurant_id))):
+            yield order
+
+    async def set_order_totals(self, totals: List[Dict]):
+        await self.db.orders.bulk_write([
+            UpdateOne(
+                self.scoped({"id": order["id"]}),
+                {"$set": {"items_count": order["items_count"], "total": order["total"]}}
+            )
+            for order in totals
+        ])
+
+
+# Storage-wide bookkeeping lives in meta under a restaurant id no restaurant
+# can have (see RESTAURANT_ID_PATTERN), so no repository ever reads it
+STORAGE_SCOPE = {"restaurant_id": "*"}
+MIGRATION_ID = "restaurant_ids"
+# How long a worker may hold the migration lock before another one takes over
+MIGRATION_LOCK_SECONDS = 300
+
+# Index errors of workers racing through setup, or of an index left by an
+# older version under another name
+INDEX_NOT_FOUND = 27
+INDEX_CONFLICTS = {85, 86}
+
+logger = logging.getLogger(__name__)
+
+
+class MongoStorage(Storage):
+    """Every restaurant in one MongoDB database, told apart by restaurant_id
+
+    Documents stored before restaurants existed belong to ``legacy_restaurant_id``.
+    """
+
+    def __init__(self, database, legacy_restaurant_id: str):
+        super().__init__()
+        self.db = database
+        self.legacy_restaurant_id = legacy_restaurant_id
+
+    async def setup(self):
+        # The migration lock relies on the unique index of meta
+        await self.create_index("meta", ["id"], {"unique": True})
+        owner = str(uuid.uuid4())
+        while not await self.is_migrated():
+            if await self.claim_migration_lock(owner):
+                await self.migrate()
+                await self.db.meta.update_one({**STORAGE_SCOPE, "id": MIGRATION_ID}, {"$set": {"done": True}})
+                break
+            # Another worker is migrating; create the indexes once it is done
+            await asyncio.sleep(0.5)
+
+        for collection, fields, options in INDEXES:
+            await self.create_index(collection, fields, options)
+
+    async def is_migrated(self) -> bool:
+        return await self.db.meta.find_one({**STORAGE_SCOPE, "id": MIGRATION_ID, "done": True}) is not None
+
+    async def claim_migration_lock(self, owner: str) -> bool:
+        now = datetime.now()
+        try:
+            # Same lease as the seed lock of a restaurant, see MongoRepository.claim_seed_lock
+            await self.db.meta.update_one(
+                {
+                    **STORAGE_SCOPE,
+                    "id": MIGRATION_ID,
+                    "done": {"$ne": True},
+                    "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]
+                },
+                {"$set": {
+                    "owner": owner,
+                    "expires_at": now + timedelta(seconds=MIGRATION_LOCK_SECONDS),
+                    "done": False
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def migrate(self):
+        """Hand documents from before restaurants existed to the legacy restaurant
+        and drop the indexes that did not lead with the restaurant
+        """
+        db = self.db
+        for name in COLLECTIONS:
+            await db[name].update_many(
+                {"restaurant_id": {"$exists": False}},
+                {"$set": {"restaurant_id": self.legacy_restaurant_id}}
+            )
+            for index_name, index in (await db[name].index_information()).items():
+                if index_name != "_id_" and index["key"][0][0] != "restaurant_id":
+                    try:
+                        await db[name].drop_index(index_name)
+                    except OperationFailure as error:
+                        # A worker whose lock lease ran out may have dropped it already
+                        if error.code != INDEX_NOT_FOUND:
+                            raise
+
+    async def create_index(self, collection: str, fields: List[str], options: dict):
+        try:
+            await self.db[collection].create_index(tenant_keys(fields), **options)
+        except OperationFailure as error:
+            if error.code not in INDEX_CONFLICTS:
+                raise
+            logger.warning("Keeping the existing index of %s on %s: %s", collection, fields, error)
+
+    async def close(self):
+        self.db.client.close()
+
+    def open_repository(self, restaurant_id: str) -> MongoRepository:
+        return MongoRepository(self.db, restaurant_id)
@@ -0,0 +1,48 @@
+from typing import Dict, List
+
+# Ways sales are rolled up; day and hour come from when the order was opened
+ROLLUP_DIMENSIONS = ["day", "hour", "product", "category", "dough"]
+TIME_DIMENSIONS = {"day", "hour"}
+
+DAY_FORMAT = "%Y-%m-%d"
+HOUR_FORMAT = "%Y-%m-%dT%H"
+
+
+def rollup_id(dimension: str, key: str) -> str:
+    return f"{dimension}:{key}"
+
+
+def rollup_increments(order: dict, items: List[dict], products: Dict[str, dict]) -> List[dict]:
+    """Revenue, item and order counts one closed order adds to each rollup it touches
+
+    ``products`` maps product ids to products, for their category.
+    """
+    created_at = order["created_at"]
+    rollups = {}
+    for item in items:
+        keys = [
+            ("day", created_at.strftime(DAY_FORMAT), None),
+            ("hour", created_at.strftime(HOUR_FORMAT), None),
+            ("product", item["product_id"], item["name"]),
+            ("category", products.get(item["product_id"], {}).get("category", "unknown"), None),
+        ]
+        # Doughs are counted on pizzas only, as on the receipt
+        if item["product_type"] == "pizzeria" and item.get("dough_type"):
+            keys.append(("dough", item["dough_type"], None))
+
+        for dimension, key, name in keys:
+            rollup = rollups.get((dimension, key))
+            if rollup is None:
+                rollup = rollups[(dimension, key)] = {
+                    "id": rollup_id(dimension, key),
+                    "dimension": dimension,
+                    "key": key,
+                    "revenue": 0.0,
+                    "items_count": 0,
+                    "orders_count": 1
+                }
+                if name:
+                    rollup["name"] = name
+            rollup["revenue"] += item["total_price"]
+            rollup["items_count"] += item.get("quantity", 1)
+    return list(rollups.values())
@@ -0,0 +1,147 @@
+import json
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from .base import COLLECTIONS, Storage
+from .documents import INDEXED_FIELDS, SORTED_FIELDS, DocumentRepository, DocumentStore, key_field
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Cannot store {type(value).__name__}")
+
+
+def decode_object(obj: dict):
+    if obj.keys() == {"$date"}:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+def field_path(field: str) -> str:
+    return f"json_extract(doc, '$.{field}')"
+
+
+def date_path(field: str) -> str:
+    # ISO timestamps of naive datetimes sort the way the datetimes do
+    return f"json_extract(doc, '$.{field}.\"$date\"')"
+
+
+class SqliteStore(DocumentStore):
+    """Documents stored as JSON in one SQLite table per collection, named after ``prefix``"""
+
+    def __init__(self, connection: sqlite3.Connection, prefix: str):
+        self.connection = connection
+        self.tables = {name: f'"{prefix}{name}"' for name in COLLECTIONS}
+        self.depth = 0
+        for name, table in self.tables.items():
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, doc TEXT NOT NULL)")
+            for field in INDEXED_FIELDS.get(name, []):
+                self.connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{prefix}{name}_{field}" ON {table} ({field_path(field)})'
+                )
+            if name in SORTED_FIELDS:
+                field = SORTED_FIELDS[name]
+                self.connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{prefix}{name}_{field}_key" ON {table} ({date_path(field)}, key)'
+                )
+
+    @contextmanager
+    def transaction(self):
+        if self.depth == 0:
+            self.connection.execute("BEGIN IMMEDIATE")
+        self.depth += 1
+        try:
+            yield
+        except BaseException:
+            self.depth -= 1
+            if self.depth == 0:
+                self.connection.execute("ROLLBACK")
+            raise
+        self.depth -= 1
+        if self.depth == 0:
+            self.connection.execute("COMMIT")
+
+    def find(self, collection: str, **filters) -> List[dict]:
+        clauses, params = [], []
+        for field, value in filters.items():
+            column = "key" if field == key_field(collection) else field_path(field)
+            if value is None:
+                clauses.append(f"{column} IS NULL")
+            elif isinstance(value, list):
+                if not value:
+                    return []
+                clauses.append(f"{column} IN ({', '.join('?' * len(value))})")
+                params.extend(value)
+            else:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.connection.execute(f"SELECT doc FROM {self.tables[collection]}{where} ORDER BY rowid", params)
+        return [json.loads(doc, object_hook=decode_object) for (doc,) in rows]
+
+    def find_range(self, collection: str, start: datetime, end: datetime,
+                   after: Optional[Tuple[datetime, str]], limit: int) -> List[dict]:
+        column = date_path(SORTED_FIELDS[collection])
+        clauses, params = [f"{column} >= ?", f"{column} < ?"], [start.isoformat(), end.isoformat()]
+        if after is not None:
+            clauses.append(f"({column}, key) > (?, ?)")
+            params.extend([after[0].isoformat(), after[1]])
+        rows = self.connection.execute(
+            f"SELECT doc FROM {self.tables[collection]} WHERE {' AND '.join(clauses)} "
+            f"ORDER BY {column}, key LIMIT ?",
+            params + [limit]
+        )
+        return [json.loads(doc, object_hook=decode_object) for (doc,) in rows]
+
+    def insert(self, collection: str, docs: List[dict]):
+        key = key_field(collection)
+        self.connection.executemany(
+            f"INSERT INTO {self.tables[collection]} (key, doc) VALUES (?, ?)",
+            [(doc[key], json.dumps(doc, default=encode_value)) for doc in docs]
+        )
+
+    def put(self, collection: str, doc: dict):
+        # An upsert keeps the rowid, so replaced documents keep their place
+        self.connection.execute(
+            f"INSERT INTO {self.tables[collection]} (key, doc) VALUES (?, ?) "
+            f"ON CONFLICT (key) DO UPDATE SET doc = excluded.doc",
+            (doc[key_field(collection)], json.dumps(doc, default=encode_value))
+        )
+
+    def delete(self, collection: str, key: str):
+        self.connection.execute(f"DELETE FROM {self.tables[collection]} WHERE key = ?", (key,))
+
+    def clear(self):
+        for table in self.tables.values():
+            self.connection.execute(f"DELETE FROM {table}")
+
+
+class SqliteRepository(DocumentRepository):
+    """One restaurant's tables in a shared SQLite file"""
+
+    def __init__(self, connection: sqlite3.Connection, restaurant_id: str):
+        super().__init__(SqliteStore(connection, f"{restaurant_id}__"))
+
+
+class SqliteStorage(Storage):
+    """Storage in a single SQLite file, for running without a Mongo server
+
+    Each restaurant gets its own set of tables, prefixed with its id.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        # An in-memory or temporary database belongs to the connection alone
+        self.shared = path not in ("", ":memory:")
+        # Autocommit; SqliteStore.transaction() opens explicit transactions
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+
+    async def close(self):
+        self.connection.close()
+
+    def open_repository(self, restaurant_id: str) -> SqliteRepository:
+        return SqliteRepository(self.connection, restaurant_id)
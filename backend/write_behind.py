@@ -0,0 +1,125 @@
+"""Write-behind buffering for writes no response depends on
+
+Counters like a table's use_count, and audit records, don't need to be stored
+before the request that caused them answers. They are queued per restaurant
+and applied in ordered batches once ``max_writes`` are waiting or
+``max_delay`` seconds have passed, whichever comes first, and on shutdown.
+Increments of the same document are folded into one write while they wait.
+A failed flush keeps its writes queued for the next one.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Tuple
+
+import metrics
+from storage import Repository
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """Queued writes of one restaurant, flushed by a background task"""
+
+    def __init__(self, repo: Repository, restaurant_id: str, max_writes: int, max_delay: float):
+        self.repo = repo
+        self.restaurant_id = restaurant_id
+        self.max_writes = max_writes
+        self.max_delay = max_delay
+        self.pending: List[dict] = []
+        # Pending increment write of each (collection, id), to fold new increments into
+        self.increments: Dict[Tuple[str, str], dict] = {}
+        # Writes of the flush in progress
+        self.flushing: List[dict] = []
+        self.flush_lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+        self.closing = False
+        self.task = None
+
+    def increment(self, collection: str, doc_id: str, field: str, amount: int = 1):
+        """Queue adding ``amount`` to a field of the document with ``doc_id``"""
+        write = self.increments.get((collection, doc_id))
+        if write is None:
+            write = self.increments[(collection, doc_id)] = {"collection": collection, "id": doc_id, "inc": {}}
+            self.queue(write)
+        write["inc"][field] = write["inc"].get(field, 0) + amount
+
+    def insert(self, collection: str, doc: dict):
+        """Queue inserting a document"""
+        self.queue({"collection": collection, "insert": doc})
+
+    def queue(self, write: dict):
+        self.pending.append(write)
+        self.record_depth()
+        if len(self.pending) >= self.max_writes:
+            self.wakeup.set()
+
+    def unapplied_increment(self, collection: str, doc_id: str, field: str) -> int:
+        """What is queued or being flushed for a field, on top of its stored value"""
+        return sum(
+            write["inc"].get(field, 0) for write in self.flushing + self.pending
+            if "inc" in write and write["collection"] == collection and write["id"] == doc_id
+        )
+
+    def record_depth(self):
+        metrics.write_behind_queue_depth.set(len(self.flushing) + len(self.pending), self.restaurant_id)
+
+    async def flush(self):
+        """Apply every queued write"""
+        async with self.flush_lock:
+            if not self.pending:
+                return
+            self.flushing, self.pending, self.increments = self.pending, [], {}
+            started = time.perf_counter()
+            try:
+                await self.repo.apply_writes(self.flushing)
+            except Exception:
+                metrics.write_behind_flush_failures.inc(self.restaurant_id)
+                self.requeue(self.flushing)
+                raise
+            finally:
+                self.flushing = []
+                self.record_depth()
+                metrics.write_behind_flush_duration.observe(time.perf_counter() - started, self.restaurant_id)
+
+    def requeue(self, writes: List[dict]):
+        """Put the writes of a failed flush back in front of those queued since"""
+        increments = {(write["collection"], write["id"]): write for write in writes if "inc" in write}
+        queued_since = []
+        for write in self.pending:
+            failed = increments.get((write["collection"], write["id"])) if "inc" in write else None
+            if failed is None:
+                queued_since.append(write)
+                continue
+            for field, amount in write["inc"].items():
+                failed["inc"][field] = failed["inc"].get(field, 0) + amount
+        self.pending = writes + queued_since
+        self.increments = {(write["collection"], write["id"]): write for write in self.pending if "inc" in write}
+
+    async def run(self):
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Flushing buffered writes of restaurant %s failed", self.restaurant_id)
+                if not self.closing:
+                    await asyncio.sleep(self.max_delay)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def close(self):
+        """Stop the background task and flush what is left"""
+        self.closing = True
+        self.wakeup.set()
+        if self.task is not None:
+            await self.task
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Dropping %d buffered writes of restaurant %s", len(self.pending), self.restaurant_id)
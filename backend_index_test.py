@@ -0,0 +1,262 @@
+import asyncio
+import os
+import sys
+import unittest
+from datetime import date
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient, monitoring
+from pymongo.errors import ServerSelectionTimeoutError
+from starlette.routing import Match
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+import server  # noqa: E402
+from storage.base import COLLECTIONS  # noqa: E402
+from storage.mongo import MongoStorage  # noqa: E402
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+TEST_DATABASE = "ristorante_manager_index_test"
+LEGACY_DATABASE = "ristorante_manager_legacy_test"
+RESTAURANT_ID = "default"
+
+# Commands that go through the query planner; inserts and getMores don't
+EXPLAINED_COMMANDS = {"find", "aggregate", "distinct", "count", "findAndModify", "update", "delete"}
+# Session and transport fields of a sent command that explain doesn't take
+SESSION_FIELDS = {
+    "lsid", "txnNumber", "autocommit", "startTransaction", "writeConcern", "readConcern",
+    "$db", "$clusterTime", "$readPreference", "ordered", "bypassDocumentValidation"
+}
+# Routes that never touch the database
+ROUTES_WITHOUT_QUERIES = {"/events"}
+
+
+class QueryRecorder(monitoring.CommandListener):
+    """Keep the commands sent while a route runs, with the route that sent them"""
+
+    def __init__(self):
+        self.route = None
+        self.commands = []
+
+    def started(self, event):
+        if self.route is not None and event.command_name in EXPLAINED_COMMANDS:
+            command = {key: value for key, value in event.command.items() if key not in SESSION_FIELDS}
+            self.commands.append((self.route, command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def shape(value):
+    """A command with its values replaced by their types, so the same query sent twice is explained once"""
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [shape(item) for item in value[:1]]
+    return type(value).__name__
+
+
+def explainable(command):
+    """One command per statement; explain takes a single update or delete"""
+    for statements in ("updates", "deletes"):
+        if statements in command:
+            for statement in command[statements]:
+                yield {**command, statements: [statement]}
+            return
+    yield command
+
+
+def find_scans(plan):
+    """Collect the collection scans and unindexed joins in an explain() document"""
+    scans = []
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            scans.append("COLLSCAN")
+        if plan.get("strategy") in ("NestedLoopJoin", "HashJoin"):
+            scans.append(plan["strategy"])
+        for key, value in plan.items():
+            if key != "rejectedPlans":
+                scans.extend(find_scans(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            scans.extend(find_scans(value))
+    return scans
+
+
+async def exercise(client, recorder):
+    """Call every route the way the app uses them, recording what each one sends; returns the requests made"""
+    requests = []
+
+    async def call(method, path, **kwargs):
+        recorder.route = f"{method} {path}"
+        try:
+            response = await client.request(method, f"/api{path}", **kwargs)
+        finally:
+            recorder.route = None
+        response.raise_for_status()
+        requests.append((method, path))
+        return response
+
+    restaurant = server.restaurants[RESTAURANT_ID]
+    tables = (await call("GET", "/tables")).json()
+    seq = int((await call("GET", f"/tables/{tables[0]['id']}/bootstrap")).headers["X-Change-Seq"])
+    table_id = tables[0]["id"]
+    product = next(product for product in restaurant.catalog.products if product["type"] == "pizzeria")
+    other = next(candidate for candidate in restaurant.catalog.products if candidate["id"] != product["id"])
+    extra = restaurant.catalog.extras[0]
+    dough = restaurant.catalog.dough_types[0]
+
+    order_id = (await call("POST", "/tables/open", json={"table_id": table_id, "covers": 2})).json()["order_id"]
+    await call("GET", "/tables", params={"since": seq})
+    await call("GET", f"/tables/{table_id}")
+    line = {
+        "table_id": table_id, "product_id": product["id"], "dough_type": dough["name"], "extra_ids": [extra["id"]]
+    }
+    item = (await call("POST", "/orders/add-item", json={**line, "quantity": 3})).json()["item"]
+    await call("POST", "/orders/add-items", json={"table_id": table_id, "items": [line, {"product_id": other["id"]}]})
+    await call("DELETE", f"/orders/items/{item['id']}", params={"quantity": 1})
+    await call("GET", f"/orders/table/{table_id}", params={"since": seq})
+    await call("GET", f"/orders/table/{table_id}")
+    await call("DELETE", f"/orders/items/{item['id']}")
+    await call("POST", "/orders/add-item", json=line)
+    tickets = (await call("POST", f"/orders/{order_id}/send")).json()["tickets"]
+    await call("GET", "/stations/pizzeria/tickets")
+    await call("POST", f"/stations/{tickets[0]['station']}/tickets/{tickets[0]['id']}/ack")
+    await call("GET", f"/orders/{order_id}")
+    await call("GET", f"/orders/{order_id}/receipt")
+
+    recorder.route = "write-behind flush"
+    await restaurant.writes.flush()
+    recorder.route = None
+
+    await call("POST", f"/tables/{table_id}/close")
+    await call("GET", f"/orders/{order_id}/receipt")
+    recorder.route = "archive job"
+    await server.archive_closed_orders(restaurant.repo, older_than=-60)
+    recorder.route = None
+    await call("GET", f"/orders/{order_id}")
+    await call("GET", f"/orders/{order_id}/receipt")
+
+    today = date.today().isoformat()
+    export = (await call("GET", "/exports/orders", params={"start": today, "end": today})).text
+    cursor = export.splitlines()[0].split('"cursor":"', 1)[1].split('"', 1)[0]
+    await call("GET", "/exports/orders", params={"start": today, "end": today, "format": "csv", "after": cursor})
+    for dimension in ("day", "product"):
+        await call("GET", f"/reports/{dimension}", params={"start": today})
+
+    await call("GET", "/products")
+    await call("GET", "/products", params={"category": product["category"]})
+    await call("GET", "/products/categories")
+    await call("GET", "/dough-types")
+    await call("GET", "/extras")
+    catalog = (await call("GET", "/catalog/export")).content
+    await call("POST", "/catalog/import", content=catalog)
+    await call("POST", "/catalog/refresh")
+    return requests
+
+
+class IndexCoverageTest(unittest.TestCase):
+    """Check with explain() that every query the routes send is served by an index"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=2000)
+        try:
+            cls.client.admin.command("ping")
+        except ServerSelectionTimeoutError:
+            raise unittest.SkipTest(f"MongoDB not reachable at {MONGO_URL}")
+
+        cls.client.drop_database(TEST_DATABASE)
+        cls.db = cls.client[TEST_DATABASE]
+        cls.recorder = QueryRecorder()
+
+        async def prepare():
+            motor_client = AsyncIOMotorClient(MONGO_URL, event_listeners=[cls.recorder])
+            server.storage = MongoStorage(motor_client[TEST_DATABASE], RESTAURANT_ID)
+            await server.storage.setup()
+            restaurant = await server.open_restaurant(RESTAURANT_ID)
+            transport = httpx.ASGITransport(app=server.app)
+            try:
+                async with httpx.AsyncClient(transport=transport, base_url="http://index-test") as client:
+                    return await exercise(client, cls.recorder)
+            finally:
+                await restaurant.writes.close()
+                motor_client.close()
+
+        cls.requests = asyncio.run(prepare())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.drop_database(TEST_DATABASE)
+        cls.client.close()
+
+    def test_every_route_is_exercised(self):
+        """A new route fails here until exercise() calls it, so its queries get explained"""
+        for route in server.api.routes:
+            if route.path in ROUTES_WITHOUT_QUERIES:
+                continue
+            with self.subTest(route=route.path, methods=route.methods):
+                self.assertTrue(any(
+                    route.matches({"type": "http", "path": path, "method": method})[0] == Match.FULL
+                    for method, path in self.requests
+                ))
+
+    def test_route_queries_use_indexes(self):
+        """Every query a route sent has an index-backed winning plan"""
+        explained = set()
+        for route, sent in self.recorder.commands:
+            for command in explainable(sent):
+                key = repr(shape(command))
+                if key in explained:
+                    continue
+                explained.add(key)
+                with self.subTest(route=route, command=shape(command)):
+                    plan = self.db.command("explain", command, verbosity="queryPlanner")
+                    self.assertEqual(find_scans(plan), [])
+        self.assertTrue(explained)
+
+    def test_categories_distinct_uses_index(self):
+        """The categories listing is answered from the category index"""
+        plan = self.db.command("explain", {
+            "distinct": "products", "key": "category", "query": {"restaurant_id": RESTAURANT_ID}
+        })
+        self.assertEqual(find_scans(plan["queryPlanner"]), [])
+
+    def test_indexes_lead_with_restaurant(self):
+        """No index lets a query of one restaurant walk the entries of another"""
+        for collection in COLLECTIONS:
+            for name, index in self.db[collection].index_information().items():
+                if name != "_id_":
+                    with self.subTest(collection=collection, index=name):
+                        self.assertEqual(index["key"][0][0], "restaurant_id")
+
+    def test_setup_migrates_once_across_workers(self):
+        """Workers starting together on a database from before restaurants get through setup, and so do restarts"""
+        self.client.drop_database(LEGACY_DATABASE)
+        legacy = self.client[LEGACY_DATABASE]
+        legacy.tables.insert_one({"id": "legacy-table", "number": 1})
+        legacy.tables.create_index("number")
+
+        async def start_workers():
+            motor_client = AsyncIOMotorClient(MONGO_URL)
+            try:
+                await asyncio.gather(*(
+                    MongoStorage(motor_client[LEGACY_DATABASE], RESTAURANT_ID).setup() for _ in range(3)
+                ))
+                await MongoStorage(motor_client[LEGACY_DATABASE], RESTAURANT_ID).setup()
+            finally:
+                motor_client.close()
+
+        try:
+            asyncio.run(start_workers())
+            self.assertEqual(legacy.tables.find_one({"id": "legacy-table"})["restaurant_id"], RESTAURANT_ID)
+            self.assertNotIn("number_1", legacy.tables.index_information())
+        finally:
+            self.client.drop_database(LEGACY_DATABASE)
+
+
+if __name__ == "__main__":
+    unittest.main()
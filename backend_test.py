@@ -1,15 +1,67 @@
 import requests
+import asyncio
+import datetime
 import json
+import marshal
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
+import uuid
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
 
-# Get the backend URL from frontend/.env
-with open('/app/frontend/.env', 'r') as f:
-    for line in f:
-        if line.startswith('REACT_APP_BACKEND_URL='):
-            BACKEND_URL = line.strip().split('=')[1]
-            break
+# Second restaurant served next to the default one, for the isolation test
+OTHER_RESTAURANT = os.getenv("BACKEND_TEST_OTHER_RESTAURANT", "trattoria")
+# Operator token for profiling requests, see backend/profiling.py
+PROFILE_TOKEN = os.getenv("BACKEND_TEST_PROFILE_TOKEN", "backend-test")
+# Event loop of the API when it runs in this process, for tests that reach into the server
+LOCAL_LOOP = None
+
+def start_local_backend(storage: str) -> str:
+    """Run the API in this process on the given storage backend and return its URL"""
+    global LOCAL_LOOP
+    os.environ["STORAGE_BACKEND"] = storage
+    os.environ.setdefault("RESTAURANTS", f"default,{OTHER_RESTAURANT}")
+    os.environ.setdefault("PROFILE_TOKEN", PROFILE_TOKEN)
+    if storage == "sqlite":
+        os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "ristorante_manager.db")
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+    import uvicorn
+    import server
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    uvicorn_server = uvicorn.Server(uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning"))
+    LOCAL_LOOP = asyncio.new_event_loop()
+    threading.Thread(target=LOCAL_LOOP.run_until_complete, args=(uvicorn_server.serve(),), daemon=True).start()
+    while not uvicorn_server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+def run_in_server(coroutine):
+    """Run a coroutine on the event loop of the API running in this process"""
+    return asyncio.run_coroutine_threadsafe(coroutine, LOCAL_LOOP).result(timeout=30)
+
+# BACKEND_TEST_STORAGE=memory|sqlite|mongo tests a local server on that storage;
+# otherwise BACKEND_URL, or the backend URL from frontend/.env
+if os.getenv("BACKEND_TEST_STORAGE"):
+    BACKEND_URL = start_local_backend(os.environ["BACKEND_TEST_STORAGE"])
+elif os.getenv("BACKEND_URL"):
+    BACKEND_URL = os.environ["BACKEND_URL"]
+else:
+    with open('/app/frontend/.env', 'r') as f:
+        for line in f:
+            if line.startswith('REACT_APP_BACKEND_URL='):
+                BACKEND_URL = line.strip().split('=')[1]
+                break
 
 # Ensure the URL doesn't have quotes
 BACKEND_URL = BACKEND_URL.strip('"\'')
@@ -306,6 +358,723 @@ class RistoranteManagerBackendTest(unittest.TestCase):
         self.assertEqual(response.status_code, 404)
         print("✅ Correctly handles invalid item ID")
 
+    def test_10_station_tickets(self):
+        """Test sending an order queues tickets per station"""
+        print("\n--- Testing Station Ticket Queues ---")
+        if not self.free_table or not self.pizza_product or not self.kitchen_product:
+            self.skipTest("Missing required test data")
+        
+        table_id = self.free_table['id']
+        order_id = self.open_table(table_id, 2)['order_id']
+        self.add_item_to_order(table_id, self.kitchen_product['id'])
+        self.add_item_to_order(table_id, self.pizza_product['id'], dough_type="Senza Glutine")
+        
+        response = requests.post(f"{API_URL}/orders/{order_id}/send")
+        self.assertEqual(response.status_code, 200)
+        stations = sorted(ticket['station'] for ticket in response.json()['tickets'])
+        self.assertEqual(stations, ['gluten_free', 'kitchen'])
+        print("✅ Order split into kitchen and gluten-free tickets")
+        
+        # Sending again queues nothing new
+        response = requests.post(f"{API_URL}/orders/{order_id}/send")
+        self.assertEqual(response.json()['tickets'], [])
+        print("✅ Re-sending an order does not duplicate tickets")
+        
+        response = requests.get(f"{API_URL}/stations/kitchen/tickets")
+        self.assertEqual(response.status_code, 200)
+        ticket = next(ticket for ticket in response.json() if ticket['order_id'] == order_id)
+        self.assertEqual(ticket['items'][0]['product_id'], self.kitchen_product['id'])
+        
+        response = requests.post(f"{API_URL}/stations/kitchen/tickets/{ticket['id']}/ack")
+        self.assertEqual(response.status_code, 200)
+        response = requests.get(f"{API_URL}/stations/kitchen/tickets")
+        self.assertNotIn(ticket['id'], [pending['id'] for pending in response.json()])
+        print("✅ Acknowledged ticket leaves the kitchen queue")
+        
+        # Long poll returns once the wait expires
+        started = time.time()
+        response = requests.get(f"{API_URL}/stations/pizzeria/tickets", params={"wait": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(order_id, [pending['order_id'] for pending in response.json()])
+        if not response.json():
+            self.assertGreaterEqual(time.time() - started, 0.9)
+        print("✅ Pizzeria long poll returned without this order")
+        
+        response = requests.get(f"{API_URL}/stations/bar/tickets")
+        self.assertEqual(response.status_code, 404)
+        response = requests.post(f"{API_URL}/stations/kitchen/tickets/invalid-id/ack")
+        self.assertEqual(response.status_code, 404)
+        print("✅ Correctly handles invalid station and ticket ID")
+
+        self.close_table(table_id)
+
+    def test_11_metrics(self):
+        """Test request latency is exposed per route template"""
+        print("\n--- Testing Metrics Endpoint ---")
+        table_id = self.tables[0]['id']
+        requests.get(f"{API_URL}/tables/{table_id}")
+        requests.get(f"{API_URL}/no-such-route")
+
+        response = requests.get(f"{BACKEND_URL}/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['content-type'].startswith('text/plain'))
+        body = response.text
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/api/tables/{table_id}"}', body)
+        self.assertIn('http_requests_total{method="GET",route="unmatched",status="404"}', body)
+        self.assertIn('http_request_mongo_round_trips_count{method="GET",route="/api/tables/{table_id}"}', body)
+        self.assertNotIn(table_id, body)
+        print("✅ Latency recorded under the route template, not the raw path")
+
+    def test_12_sales_reports(self):
+        """Test closing a table folds its sales into the report rollups"""
+        print("\n--- Testing Sales Reports ---")
+        if not self.free_table or not self.pizza_product:
+            self.skipTest("Missing required test data")
+
+        def product_row():
+            response = requests.get(f"{API_URL}/reports/product")
+            self.assertEqual(response.status_code, 200)
+            rows = response.json()['rows']
+            return next((row for row in rows if row['key'] == self.pizza_product['id']),
+                        {'revenue': 0.0, 'items_count': 0, 'orders_count': 0})
+
+        before = product_row()
+        table_id = self.free_table['id']
+        self.open_table(table_id, 2)
+        self.add_item_to_order(table_id, self.pizza_product['id'])
+        self.add_item_to_order(table_id, self.pizza_product['id'])
+
+        # Open orders are not reported yet
+        self.assertEqual(product_row()['items_count'], before['items_count'])
+        self.close_table(table_id)
+
+        after = product_row()
+        self.assertEqual(after['items_count'], before['items_count'] + 2)
+        self.assertEqual(after['orders_count'], before['orders_count'] + 1)
+        self.assertAlmostEqual(after['revenue'], before['revenue'] + 2 * self.pizza_product['price'])
+        self.assertEqual(after['name'], self.pizza_product['name'])
+        print("✅ Closed order folded into the product rollup")
+
+        response = requests.get(f"{API_URL}/reports/category")
+        self.assertIn('pizza', [row['key'] for row in response.json()['rows']])
+        response = requests.get(f"{API_URL}/reports/day", params={"start": "2000-01-01", "end": "2000-12-31"})
+        self.assertEqual(response.json()['rows'], [])
+        response = requests.get(f"{API_URL}/reports/waiter")
+        self.assertEqual(response.status_code, 404)
+        print("✅ Category, date range and unknown report handled")
+
+    def test_13_order_history(self):
+        """Test closed orders stay readable with their items"""
+        print("\n--- Testing Order History ---")
+        if not self.free_table or not self.kitchen_product:
+            self.skipTest("Missing required test data")
+
+        table_id = self.free_table['id']
+        order_id = self.open_table(table_id, 2)['order_id']
+        self.add_item_to_order(table_id, self.kitchen_product['id'])
+        self.close_table(table_id)
+
+        response = requests.get(f"{API_URL}/orders/{order_id}")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['order']['is_closed'])
+        self.assertIn('closed_at', data['order'])
+        self.assertEqual([item['product_id'] for item in data['items']], [self.kitchen_product['id']])
+        self.assertEqual(data['total'], self.kitchen_product['price'])
+        print("✅ Closed order returned with its items and closing time")
+
+        response = requests.get(f"{API_URL}/orders/invalid-id")
+        self.assertEqual(response.status_code, 404)
+        print("✅ Correctly handles invalid order ID")
+
+    def test_14_order_export(self):
+        """Test order history streams as NDJSON and CSV and resumes from a cursor"""
+        print("\n--- Testing Order Export ---")
+        if not self.free_table or not self.kitchen_product:
+            self.skipTest("Missing required test data")
+
+        table_id = self.free_table['id']
+        order_id = self.open_table(table_id, 2)['order_id']
+        self.add_item_to_order(table_id, self.kitchen_product['id'])
+        self.close_table(table_id)
+
+        # A window around today, whatever the server's time zone
+        today = datetime.date.today()
+        window = {"start": (today - datetime.timedelta(days=1)).isoformat(),
+                  "end": (today + datetime.timedelta(days=1)).isoformat()}
+
+        response = requests.get(f"{API_URL}/exports/orders", params=window)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['content-type'].startswith('application/x-ndjson'))
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        positions = [(line['order']['created_at'], line['order']['id']) for line in lines]
+        self.assertEqual(positions, sorted(positions))
+        exported = next(line for line in lines if line['order']['id'] == order_id)
+        self.assertEqual([item['product_id'] for item in exported['items']], [self.kitchen_product['id']])
+        print("✅ NDJSON export ordered by creation time with items")
+
+        response = requests.get(f"{API_URL}/exports/orders", params={**window, "after": lines[0]['cursor']})
+        resumed = [json.loads(line)['order']['id'] for line in response.text.splitlines()]
+        self.assertEqual(resumed, [line['order']['id'] for line in lines[1:]])
+        print("✅ Export resumes after a cursor")
+
+        response = requests.get(f"{API_URL}/exports/orders", params={**window, "format": "csv"})
+        self.assertEqual(response.status_code, 200)
+        header, *rows = response.text.splitlines()
+        self.assertTrue(header.startswith('cursor,order_id,table_id,created_at'))
+        self.assertTrue(any(order_id in row and self.kitchen_product['id'] in row for row in rows))
+        print("✅ CSV export has one row per item")
+
+        response = requests.get(f"{API_URL}/exports/orders", params={**window, "after": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+        response = requests.get(f"{API_URL}/exports/orders", params={**window, "format": "xml"})
+        self.assertEqual(response.status_code, 400)
+        print("✅ Correctly rejects invalid cursor and format")
+
+    def test_15_catalog_import_export(self):
+        """Test the catalog round-trips through export and import and upserts on code"""
+        print("\n--- Testing Catalog Import/Export ---")
+        response = requests.get(f"{API_URL}/catalog/export")
+        self.assertEqual(response.status_code, 200)
+        exported = response.json()
+        self.assertTrue(all(entry['code'] for entry in exported['products']))
+
+        # Importing an export unchanged touches nothing
+        version = requests.post(f"{API_URL}/catalog/refresh").json()['version']
+        result = requests.post(f"{API_URL}/catalog/import", data=response.content).json()
+        self.assertEqual(result['products'], {"inserted": 0, "updated": 0, "unchanged": len(exported['products'])})
+        self.assertEqual(result['version'], version)
+        print("✅ Re-importing the export leaves the catalog unchanged")
+
+        code = f"test-{uuid.uuid4().hex[:8]}"
+        product = {"code": code, "name": "Pizza del Test", "price": 10.0, "category": "pizza",
+                   "type": "pizzeria", "is_customizable": True}
+        result = requests.post(f"{API_URL}/catalog/import", json={"products": [product]}).json()
+        self.assertEqual(result['products']['inserted'], 1)
+        self.assertGreater(result['version'], version)
+        result = requests.post(f"{API_URL}/catalog/import", json={"products": [{**product, "price": 11.0}]}).json()
+        self.assertEqual(result['products'], {"inserted": 0, "updated": 1, "unchanged": 0})
+        imported = [p for p in self.get_all_products() if p.get('code') == code]
+        self.assertEqual([p['price'] for p in imported], [11.0])
+        print("✅ Import inserts new codes, updates changed ones and bumps the catalog version")
+
+        response = requests.get(f"{API_URL}/catalog/export", params={"format": "csv"})
+        self.assertEqual(response.status_code, 200)
+        result = requests.post(f"{API_URL}/catalog/import", params={"format": "csv"}, data=response.content).json()
+        self.assertEqual(result['extras']['unchanged'], len(exported['extras']))
+        self.assertEqual(result['products']['updated'] + result['products']['inserted'], 0)
+        print("✅ CSV export re-imports unchanged")
+
+        response = requests.post(f"{API_URL}/catalog/import", json={"products": [{"code": code}]})
+        self.assertEqual(response.status_code, 422)
+        response = requests.post(f"{API_URL}/catalog/import", json={"extras": [{"code": "x", "name": "X", "price": 1}] * 2})
+        self.assertEqual(response.status_code, 400)
+        print("✅ Correctly rejects invalid entries and duplicate codes")
+
+    def test_16_concurrent_open_close(self):
+        """Test racing opens and closes of one table leave exactly one active order"""
+        print("\n--- Testing Concurrent Open/Close ---")
+        if not self.free_table:
+            self.skipTest("No free tables available for testing")
+
+        table_id = self.free_table['id']
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            opens = list(pool.map(
+                lambda _: requests.post(f"{API_URL}/tables/open", json={"table_id": table_id, "covers": 2}),
+                range(8)
+            ))
+        self.assertEqual(sorted(response.status_code for response in opens), [200] + [409] * 7)
+        order_id = next(response.json()['order_id'] for response in opens if response.status_code == 200)
+        response = requests.get(f"{API_URL}/orders/table/{table_id}")
+        self.assertEqual(response.json()['order']['id'], order_id)
+        print("✅ Only one of 8 racing opens wins; the rest get 409")
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            closes = list(pool.map(lambda _: requests.post(f"{API_URL}/tables/{table_id}/close"), range(8)))
+        self.assertEqual(sorted(response.status_code for response in closes), [200] + [409] * 7)
+        self.assertEqual(requests.get(f"{API_URL}/orders/{order_id}").json()['order']['is_closed'], True)
+        print("✅ Only one of 8 racing closes wins; the rest get 409")
+
+        response = requests.post(f"{API_URL}/tables/{table_id}/close")
+        self.assertEqual(response.status_code, 409)
+        response = requests.post(f"{API_URL}/tables/invalid-id/close")
+        self.assertEqual(response.status_code, 404)
+        response = requests.post(f"{API_URL}/tables/open", json={"table_id": "invalid-id", "covers": 2})
+        self.assertEqual(response.status_code, 404)
+        print("✅ Correctly rejects closing a free table and unknown tables")
+
+    def test_17_delta_sync(self):
+        """Test ?since= returns only what changed after a change sequence number"""
+        print("\n--- Testing Delta Sync ---")
+        if not self.free_table or not self.kitchen_product:
+            self.skipTest("Missing required test data")
+
+        response = requests.get(f"{API_URL}/tables")
+        seq = int(response.headers['X-Change-Seq'])
+        response = requests.get(f"{API_URL}/tables", params={"since": seq})
+        self.assertEqual(response.json(), {"seq": seq, "tables": []})
+        print("✅ Idle floor refresh returns no tables")
+
+        table_id = self.free_table['id']
+        self.open_table(table_id, 3)
+        delta = requests.get(f"{API_URL}/tables", params={"since": seq}).json()
+        self.assertGreater(delta['seq'], seq)
+        changed = next(table for table in delta['tables'] if table['id'] == table_id)
+        self.assertEqual((changed['status'], changed['covers']), ('occupied', 3))
+        print("✅ Floor delta includes the table just opened")
+
+        # Different products, so the two lines are not merged
+        other_product = next(product for product in self.products if product['id'] != self.kitchen_product['id'])
+        first = self.add_item_to_order(table_id, self.kitchen_product['id'])['item']
+        response = requests.get(f"{API_URL}/orders/table/{table_id}")
+        seq = int(response.headers['X-Change-Seq'])
+        second = self.add_item_to_order(table_id, other_product['id'])['item']
+        requests.delete(f"{API_URL}/orders/items/{first['id']}")
+
+        delta = requests.get(f"{API_URL}/orders/table/{table_id}", params={"since": seq}).json()
+        self.assertEqual([item['id'] for item in delta['items']], [second['id']])
+        self.assertEqual(delta['deleted_item_ids'], [first['id']])
+        self.assertEqual(delta['total'], second['total_price'])
+        self.assertEqual(delta['order']['items_count'], 1)
+
+        idle = requests.get(f"{API_URL}/orders/table/{table_id}", params={"since": delta['seq']}).json()
+        self.assertEqual((idle['order'], idle['items'], idle['deleted_item_ids']), (None, [], []))
+        print("✅ Order delta has the new item, a tombstone for the removed one, and nothing when idle")
+
+        self.close_table(table_id)
+
+    def test_18_restaurant_isolation(self):
+        """Test each restaurant sees only its own tables, menu and orders"""
+        print("\n--- Testing Restaurant Isolation ---")
+        other_url = f"{API_URL}/restaurants/{OTHER_RESTAURANT}"
+        other_tables = requests.get(f"{other_url}/tables")
+        if other_tables.status_code == 404:
+            self.skipTest(f"Restaurant {OTHER_RESTAURANT} is not served")
+        if not self.kitchen_product:
+            self.skipTest("Missing required test data")
+
+        default_tables = requests.get(f"{API_URL}/restaurants/default/tables").json()
+        self.assertEqual({table['id'] for table in default_tables}, {table['id'] for table in self.tables})
+        other_tables = other_tables.json()
+        self.assertTrue(other_tables)
+        self.assertFalse({table['id'] for table in other_tables} & {table['id'] for table in self.tables})
+        other_products = requests.get(f"{other_url}/products").json()
+        self.assertFalse({product['id'] for product in other_products} & {product['id'] for product in self.products})
+        print("✅ Each restaurant has its own tables and menu")
+
+        table_id = next(table['id'] for table in other_tables if table['status'] == 'free')
+        response = requests.post(f"{other_url}/tables/open", json={"table_id": table_id, "covers": 2})
+        self.assertEqual(response.status_code, 200)
+        order_id = response.json()['order_id']
+        product_id = other_products[0]['id']
+        response = requests.post(f"{other_url}/orders/add-item", json={"table_id": table_id, "product_id": product_id})
+        self.assertEqual(response.status_code, 200)
+
+        # Ids of one restaurant mean nothing to another
+        self.assertEqual(requests.get(f"{API_URL}/tables/{table_id}").status_code, 404)
+        self.assertEqual(requests.get(f"{API_URL}/orders/{order_id}").status_code, 404)
+        self.assertEqual(requests.post(f"{API_URL}/tables/{table_id}/close").status_code, 404)
+        response = requests.post(f"{API_URL}/tables/open", json={"table_id": table_id, "covers": 2})
+        self.assertEqual(response.status_code, 404)
+        response = requests.post(f"{API_URL}/orders/add-item", json={"table_id": table_id, "product_id": product_id})
+        self.assertEqual(response.status_code, 404)
+        print("✅ Another restaurant's tables and orders are not found")
+
+        self.assertEqual(requests.get(f"{other_url}/orders/{order_id}").json()['total'], other_products[0]['price'])
+        self.assertEqual(requests.post(f"{other_url}/tables/{table_id}/close").status_code, 200)
+        self.assertEqual(requests.get(f"{API_URL}/restaurants/unknown/tables").status_code, 404)
+        print("✅ Unknown restaurants are not found")
+
+    def test_19_request_profiling(self):
+        """Test operators can profile a single request"""
+        print("\n--- Testing Request Profiling ---")
+        headers = {"X-Profile": "speedscope", "X-Profile-Token": PROFILE_TOKEN}
+        response = requests.get(f"{API_URL}/tables", headers=headers)
+        if "X-Profile-Breakdown" not in response.headers:
+            self.skipTest("Request profiling is not enabled")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Profiled-Status'], "200")
+        profile = response.json()
+        self.assertIn("$schema", profile)
+        self.assertTrue(profile['profiles'][0]['samples'])
+        breakdown = dict(part.split("=") for part in response.headers['X-Profile-Breakdown'].split(";"))
+        self.assertTrue({"storage_wait", "storage", "json_encoding", "wall"} <= set(breakdown))
+        print(f"✅ Speedscope profile, time split {response.headers['X-Profile-Breakdown']}")
+
+        response = requests.get(f"{API_URL}/tables", params={"profile": "pstats"},
+                                headers={"X-Profile-Token": PROFILE_TOKEN})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(marshal.loads(response.content))
+        print("✅ pstats profile")
+
+        response = requests.get(f"{API_URL}/tables", headers={"X-Profile": "speedscope"})
+        self.assertEqual(response.status_code, 403)
+        response = requests.get(f"{API_URL}/tables", headers={**headers, "X-Profile": "flamegraph"})
+        self.assertEqual(response.status_code, 400)
+        print("✅ Profiles need the operator token and a known format")
+
+    def test_20_table_bootstrap(self):
+        """Test the menu screen loads table, menu and order in one request"""
+        print("\n--- Testing Table Bootstrap ---")
+        if not self.free_table or not self.kitchen_product:
+            self.skipTest("Missing required test data")
+
+        table_id = self.free_table['id']
+        order_id = self.open_table(table_id, 2)['order_id']
+        item = self.add_item_to_order(table_id, self.kitchen_product['id'])['item']
+
+        response = requests.get(f"{API_URL}/tables/{table_id}/bootstrap")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('X-Change-Seq', response.headers)
+        bootstrap = response.json()
+        self.assertEqual(bootstrap['table']['id'], table_id)
+        catalog = bootstrap['catalog']
+        self.assertEqual(catalog['categories'], requests.get(f"{API_URL}/products/categories").json())
+        grouped = [product['id'] for category in catalog['categories'] for product in catalog['products'][category]]
+        self.assertEqual(sorted(grouped), sorted(product['id'] for product in self.products))
+        self.assertEqual(catalog['dough_types'], self.dough_types)
+        self.assertEqual(catalog['extras'], self.extras)
+        self.assertEqual(bootstrap['order']['order']['id'], order_id)
+        self.assertEqual([line['id'] for line in bootstrap['order']['items']], [item['id']])
+        self.assertEqual(bootstrap['order']['total'], item['total_price'])
+        print("✅ Bootstrap has the table, the menu by category and the active order")
+
+        params = {"catalog_version": bootstrap['catalog_version']}
+        cached = requests.get(f"{API_URL}/tables/{table_id}/bootstrap", params=params).json()
+        self.assertIsNone(cached['catalog'])
+        self.assertEqual(cached['order']['order']['id'], order_id)
+        print("✅ An unchanged menu is not sent again")
+
+        self.close_table(table_id)
+        self.assertEqual(requests.get(f"{API_URL}/tables/{table_id}/bootstrap").json()['order'], None)
+        self.assertEqual(requests.get(f"{API_URL}/tables/invalid-id/bootstrap").status_code, 404)
+        print("✅ Free tables have no order and unknown tables are not found")
+
+    def test_21_buffered_use_count(self):
+        """Test table use counts are stored in the background"""
+        print("\n--- Testing Buffered Use Counts ---")
+        if not self.free_table:
+            self.skipTest("No free tables available for testing")
+
+        depth_line = 'write_behind_queue_depth{restaurant="default"} 0'
+
+        def wait_for_flush():
+            deadline = time.time() + 10
+            while depth_line not in requests.get(f"{BACKEND_URL}/metrics").text.splitlines():
+                self.assertLess(time.time(), deadline, "Buffered writes were not flushed")
+                time.sleep(0.2)
+
+        table_id = self.free_table['id']
+        wait_for_flush()
+        use_count = requests.get(f"{API_URL}/tables/{table_id}").json()['use_count']
+        self.open_table(table_id, 2)
+        self.close_table(table_id)
+        self.open_table(table_id, 2)
+        self.close_table(table_id)
+
+        wait_for_flush()
+        self.assertEqual(requests.get(f"{API_URL}/tables/{table_id}").json()['use_count'], use_count + 2)
+        print("✅ Both uses were stored")
+
+        metrics_text = requests.get(f"{BACKEND_URL}/metrics").text
+        self.assertIn("write_behind_flush_duration_seconds_count", metrics_text)
+        print("✅ Write buffer depth and flush latency are exported")
+
+    def test_22_order_line_quantities(self):
+        """Test identical unsent lines are merged and can be reduced"""
+        print("\n--- Testing Order Line Quantities ---")
+        if not self.free_table or not self.pizza_product or not self.dough_types or len(self.extras) < 2:
+            self.skipTest("Missing required test data")
+
+        table_id = self.free_table['id']
+        order_id = self.open_table(table_id, 2)['order_id']
+        product_id = self.pizza_product['id']
+        dough = self.dough_types[0]['name']
+        extra_ids = [extra['id'] for extra in self.extras[:2]]
+
+        first = self.add_item_to_order(table_id, product_id, dough, extra_ids)['item']
+        self.assertEqual(first['quantity'], 1)
+        # Same dish with the extras in another order
+        second = self.add_item_to_order(table_id, product_id, dough, list(reversed(extra_ids)))['item']
+        self.assertEqual(second['id'], first['id'])
+        self.assertEqual(second['quantity'], 2)
+        self.assertAlmostEqual(second['total_price'], 2 * first['unit_price'])
+        response = requests.post(f"{API_URL}/orders/add-items", json={"table_id": table_id, "items": [
+            {"product_id": product_id, "dough_type": dough, "extra_ids": extra_ids, "quantity": 2},
+            {"product_id": product_id, "dough_type": dough, "extra_ids": extra_ids},
+            {"product_id": product_id, "dough_type": dough},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        lines = {item['id']: item for item in response.json()['items']}
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[first['id']]['quantity'], 5)
+        order = requests.get(f"{API_URL}/orders/{order_id}").json()
+        self.assertEqual(len(order['items']), 2)
+        self.assertEqual(order['order']['items_count'], 6)
+        print("✅ Identical unsent lines are merged, quantities add up")
+
+        response = requests.delete(f"{API_URL}/orders/items/{first['id']}", params={"quantity": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['item']['quantity'], 3)
+        order = requests.get(f"{API_URL}/orders/{order_id}").json()
+        self.assertEqual(order['order']['items_count'], 4)
+        self.assertAlmostEqual(order['total'], sum(item['total_price'] for item in order['items']))
+        response = requests.delete(f"{API_URL}/orders/items/{first['id']}", params={"quantity": 0})
+        self.assertEqual(response.status_code, 400)
+        print("✅ Removing part of a line lowers its quantity and the order totals")
+
+        receipt = requests.get(f"{API_URL}/orders/{order_id}/receipt").json()
+        self.assertEqual(receipt['dough_summary'], {dough: 4})
+        print("✅ Dough summary counts quantities")
+
+        requests.post(f"{API_URL}/orders/{order_id}/send")
+        sent_again = self.add_item_to_order(table_id, product_id, dough, extra_ids)['item']
+        self.assertNotEqual(sent_again['id'], first['id'])
+        self.assertEqual(sent_again['quantity'], 1)
+        print("✅ Lines already sent are not merged into")
+
+        response = requests.delete(f"{API_URL}/orders/items/{first['id']}", params={"quantity": 3})
+        self.assertIsNone(response.json().get('item'))
+        items = requests.get(f"{API_URL}/orders/{order_id}").json()['items']
+        self.assertNotIn(first['id'], [item['id'] for item in items])
+        self.close_table(table_id)
+        print("✅ Taking off every one removes the line")
+
+
+    def test_23_catalog_etags(self):
+        """Test the menu routes answer 304 to a current ETag and 200 once the catalog changed"""
+        print("\n--- Testing Catalog ETags ---")
+        for path in ("products", "products/categories", "dough-types", "extras"):
+            response = requests.get(f"{API_URL}/{path}")
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+            cached = requests.get(f"{API_URL}/{path}", headers={"If-None-Match": etag})
+            self.assertEqual(cached.status_code, 304)
+            self.assertEqual(cached.content, b"")
+            self.assertEqual(cached.headers['ETag'], etag)
+        print("✅ A current ETag gets 304 with no body")
+
+        version = requests.post(f"{API_URL}/catalog/refresh").json()['version']
+        etag = requests.get(f"{API_URL}/products").headers['ETag']
+        code = f"etag-{uuid.uuid4().hex[:8]}"
+        result = requests.post(f"{API_URL}/catalog/import", json={"products": [{
+            "code": code, "name": "Pizza ETag", "price": 9.0, "category": "pizza", "type": "pizzeria",
+            "is_customizable": True
+        }]}).json()
+        self.assertGreater(result['version'], version)
+
+        response = requests.get(f"{API_URL}/products", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertIn(code, [product.get('code') for product in response.json()])
+        cached = requests.get(f"{API_URL}/products", headers={"If-None-Match": response.headers['ETag']})
+        self.assertEqual(cached.status_code, 304)
+        print("✅ A catalog write bumps the version and the old ETag gets the new menu")
+
+    def test_24_order_totals(self):
+        """Test orders without a stored total add up their items and reconcile --fix repairs drifted totals"""
+        print("\n--- Testing Order Totals ---")
+        if LOCAL_LOOP is None:
+            self.skipTest("Needs the API running in this process (BACKEND_TEST_STORAGE)")
+        if not self.free_table or not self.kitchen_product:
+            self.skipTest("Missing required test data")
+        import server
+        repo = server.restaurants["default"].repo
+        price = self.kitchen_product['price']
+
+        # An order closed before running totals were kept
+        legacy_id = str(uuid.uuid4())
+        now = datetime.datetime.now()
+        run_in_server(repo.insert_orders([{
+            "id": legacy_id, "table_id": self.free_table['id'], "created_at": now, "closed_at": now,
+            "is_sent": True, "is_closed": True
+        }]))
+        run_in_server(repo.insert_items([{
+            "id": str(uuid.uuid4()), "order_id": legacy_id, "product_id": self.kitchen_product['id'],
+            "name": self.kitchen_product['name'], "price": price, "product_type": "kitchen", "dough_type": None,
+            "extras": [], "total_price": price
+        }]))
+        self.assertEqual(requests.get(f"{API_URL}/orders/{legacy_id}").json()['total'], price)
+        self.assertEqual(requests.get(f"{API_URL}/orders/{legacy_id}/receipt").json()['total'], price)
+        print("✅ An order without a stored total adds up its items")
+
+        table_id = self.free_table['id']
+        order_id = self.open_table(table_id, 2)['order_id']
+        self.add_item_to_order(table_id, self.kitchen_product['id'])
+        self.close_table(table_id)
+        run_in_server(repo.set_order_totals([{"id": order_id, "items_count": 7, "total": 999.0}]))
+        self.assertEqual(requests.get(f"{API_URL}/orders/{order_id}").json()['total'], 999.0)
+
+        self.assertEqual(run_in_server(server.reconcile_order_totals(repo)), 1)
+        self.assertEqual(run_in_server(server.reconcile_order_totals(repo, fix=True)), 0)
+        for fixed_id in (order_id, legacy_id):
+            order = requests.get(f"{API_URL}/orders/{fixed_id}").json()['order']
+            self.assertEqual((order['items_count'], order['total']), (1, price))
+        self.assertEqual(run_in_server(server.reconcile_order_totals(repo)), 0)
+        print("✅ reconcile reports the drifted totals and --fix rewrites them")
+
+    def test_25_event_stream(self):
+        """Test a subscriber to /api/events hears about a table being opened"""
+        print("\n--- Testing Event Stream ---")
+        if not self.free_table:
+            self.skipTest("No free tables available for testing")
+
+        table_id = self.free_table['id']
+        with requests.get(f"{API_URL}/events", stream=True, timeout=10) as stream:
+            self.assertEqual(stream.status_code, 200)
+            self.assertTrue(stream.headers['content-type'].startswith('text/event-stream'))
+            lines = stream.iter_lines(decode_unicode=True)
+            # The retry hint comes once the stream is subscribed
+            self.assertEqual(next(lines), "retry: 3000")
+            order_id = self.open_table(table_id, 2)['order_id']
+
+            event_type = None
+            for line in lines:
+                if line.startswith("event: "):
+                    event_type = line[len("event: "):]
+                elif line.startswith("data: ") and event_type == "table_opened":
+                    data = json.loads(line[len("data: "):])
+                    if data['table_id'] == table_id:
+                        break
+            else:
+                self.fail("The stream ended without a table_opened event")
+        self.assertEqual((data['order_id'], data['covers']), (order_id, 2))
+        self.close_table(table_id)
+        print("✅ table_opened arrives on the event stream")
+
+    def test_26_changes_from_other_workers(self):
+        """Test a write numbered by another worker process makes this one's event streams resync"""
+        print("\n--- Testing Changes From Other Workers ---")
+        if LOCAL_LOOP is None:
+            self.skipTest("Needs the API running in this process (BACKEND_TEST_STORAGE)")
+        import server
+        if not server.storage.shared:
+            self.skipTest("Only one process can serve this storage")
+        repo = server.restaurants["default"].repo
+
+        with requests.get(f"{API_URL}/events", stream=True, timeout=10) as stream:
+            lines = stream.iter_lines(decode_unicode=True)
+            self.assertEqual(next(lines), "retry: 3000")
+            # What another worker's open_table does first, without this process hearing of it
+            run_in_server(repo.next_sequence(server.CHANGES_SEQUENCE))
+            for line in lines:
+                if line == "event: resync":
+                    break
+            else:
+                self.fail("The stream ended without a resync event")
+        print("✅ Streams resync after another worker writes")
+
+    def test_27_archived_orders(self):
+        """Test an order moved to the archive is still served with its receipt"""
+        print("\n--- Testing Archived Orders ---")
+        if LOCAL_LOOP is None:
+            self.skipTest("Needs the API running in this process (BACKEND_TEST_STORAGE)")
+        if not self.free_table or not self.kitchen_product:
+            self.skipTest("Missing required test data")
+        import server
+        repo = server.restaurants["default"].repo
+
+        table_id = self.free_table['id']
+        order_id = self.open_table(table_id, 2)['order_id']
+        self.add_item_to_order(table_id, self.kitchen_product['id'])
+        self.close_table(table_id)
+        order = requests.get(f"{API_URL}/orders/{order_id}").json()
+        receipt = requests.get(f"{API_URL}/orders/{order_id}/receipt").json()
+
+        # Archive everything closed so far, as the background job does hours later
+        self.assertGreaterEqual(run_in_server(server.archive_closed_orders(repo, older_than=-60)), 1)
+        self.assertIsNone(run_in_server(repo.get_order(order_id)))
+        self.assertIsNotNone(run_in_server(repo.get_archived_order(order_id)))
+
+        response = requests.get(f"{API_URL}/orders/{order_id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), order)
+        response = requests.get(f"{API_URL}/orders/{order_id}/receipt")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), receipt)
+        self.assertEqual(receipt['total'], self.kitchen_product['price'])
+        print("✅ Archived order and receipt served as before archiving")
+
+    def test_28_export_pages(self):
+        """Test an export read a few orders at a time matches one read in whole pages"""
+        print("\n--- Testing Export Pages ---")
+        if LOCAL_LOOP is None:
+            self.skipTest("Needs the API running in this process (BACKEND_TEST_STORAGE)")
+        if not self.free_table or not self.kitchen_product:
+            self.skipTest("Missing required test data")
+        from storage import documents, mongo
+
+        # Live orders next to the ones earlier tests left or archived
+        table_id = self.free_table['id']
+        for _ in range(3):
+            self.open_table(table_id, 2)
+            self.add_item_to_order(table_id, self.kitchen_product['id'])
+            self.close_table(table_id)
+
+        today = datetime.date.today()
+        window = {"start": (today - datetime.timedelta(days=1)).isoformat(),
+                  "end": (today + datetime.timedelta(days=1)).isoformat()}
+        whole = requests.get(f"{API_URL}/exports/orders", params=window).text
+        page_sizes = documents.EXPORT_BATCH_SIZE, mongo.EXPORT_BATCH_SIZE
+        documents.EXPORT_BATCH_SIZE = mongo.EXPORT_BATCH_SIZE = 2
+        try:
+            paged = requests.get(f"{API_URL}/exports/orders", params=window).text
+        finally:
+            documents.EXPORT_BATCH_SIZE, mongo.EXPORT_BATCH_SIZE = page_sizes
+        self.assertGreater(len(whole.splitlines()), 4)
+        self.assertEqual(paged, whole)
+        print("✅ Paged export matches the whole one")
+
+    def test_29_capture_replay(self):
+        """Test a captured session replays on a fresh copy with every status as recorded"""
+        print("\n--- Testing Capture Replay ---")
+        if LOCAL_LOOP is None:
+            self.skipTest("Needs the API running in this process (BACKEND_TEST_STORAGE)")
+        if not self.free_table or not self.kitchen_product or not self.pizza_product:
+            self.skipTest("Missing required test data")
+        import httpx
+        import capture
+        import server
+
+        path = os.path.join(tempfile.mkdtemp(), "capture.jsonl")
+        table_id = self.free_table['id']
+        line = {"product_id": self.kitchen_product['id']}
+
+        async def record():
+            log = capture.CaptureLog(path)
+            log.write_snapshot(await server.capture_snapshot(server.restaurants["default"]))
+            transport = httpx.ASGITransport(app=capture.CaptureMiddleware(server.app, log=log))
+            try:
+                async with httpx.AsyncClient(transport=transport, base_url="http://capture") as client:
+                    opened = await client.post("/api/tables/open", json={"table_id": table_id, "covers": 2})
+                    order_id = opened.json()['order_id']
+                    added = await client.post("/api/orders/add-item", json={"table_id": table_id, **line})
+                    await client.post("/api/orders/add-items", json={
+                        "table_id": table_id, "items": [line, {"product_id": self.pizza_product['id']}]
+                    })
+                    await client.get(f"/api/orders/table/{table_id}")
+                    await client.delete(f"/api/orders/items/{added.json()['item']['id']}", params={"quantity": 1})
+                    await client.post(f"/api/orders/{order_id}/send")
+                    await client.get(f"/api/tables/{table_id}")
+                    await client.post(f"/api/tables/{table_id}/close")
+                    await client.get(f"/api/orders/{order_id}/receipt")
+                    await client.post(f"/api/tables/{table_id}/close")
+                    await client.get(f"/api/orders/table/{table_id}")
+            finally:
+                log.close()
+
+        run_in_server(record())
+        # Fast enough that every request is due at once, so only the replay's ordering keeps them in order
+        replay = subprocess.run(
+            [sys.executable, "-m", "benchmarks.replay", path, "--storage", "memory", "--speed", "1000", "--strict"],
+            cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"),
+            capture_output=True, text=True, timeout=120
+        )
+        self.assertEqual(replay.returncode, 0, replay.stdout + replay.stderr)
+        print("✅ Replayed capture gets the recorded statuses")
+
 
 if __name__ == "__main__":
     print(f"Testing Ristorante Manager Backend API at: {API_URL}")
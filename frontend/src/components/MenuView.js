@@ -1,6 +1,6 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
-import { productsAPI, ordersAPI, tablesAPI } from '../services/api';
+import { ordersAPI, tablesAPI, eventsAPI } from '../services/api';
 import ProductCard from './ProductCard';
 import OrderSidebar from './OrderSidebar';
 
@@ -8,7 +8,7 @@ const MenuView = () => {
   const { tableId } = useParams();
   const navigate = useNavigate();
   const [table, setTable] = useState(null);
-  const [products, setProducts] = useState([]);
+  const [menu, setMenu] = useState({});
   const [categories, setCategories] = useState([]);
   const [activeCategory, setActiveCategory] = useState('antipasti');
   const [doughTypes, setDoughTypes] = useState([]);
@@ -16,38 +16,61 @@ const MenuView = () => {
   const [currentOrder, setCurrentOrder] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  // Change sequence number and id of the order last fetched in full
+  const orderSeqRef = useRef(null);
+  const orderIdRef = useRef(null);
 
   useEffect(() => {
     fetchData();
-  }, [tableId]);
 
-  useEffect(() => {
-    fetchProducts();
-  }, [activeCategory]);
+    // Keep the order in sync with changes made from any tablet
+    return eventsAPI.subscribe({
+      items_added: ({ table_id, items, total }) => {
+        if (table_id === tableId) {
+          addItemsToOrder(items, total);
+        }
+      },
+      item_removed: ({ table_id, item_id, total }) => {
+        if (table_id === tableId) {
+          removeItemFromOrder(item_id, total);
+        }
+      },
+      item_updated: ({ table_id, item, total }) => {
+        if (table_id === tableId) {
+          addItemsToOrder([item], total);
+        }
+      },
+      order_sent: ({ table_id }) => {
+        if (table_id === tableId) {
+          setCurrentOrder((order) => order && { ...order, order: { ...order.order, is_sent: true } });
+        }
+      },
+      table_closed: ({ table_id }) => {
+        if (table_id === tableId) {
+          navigate('/tables');
+        }
+      },
+    }, syncCurrentOrder);
+  }, [tableId]);
 
   const fetchData = async () => {
     try {
       setLoading(true);
       
-      // Fetch table info
-      const tableResponse = await tablesAPI.getTable(tableId);
-      setTable(tableResponse.data);
-      
-      // Fetch categories
-      const categoriesResponse = await productsAPI.getCategories();
-      setCategories(categoriesResponse.data);
-      
-      // Fetch dough types and extras
-      const [doughTypesResponse, extrasResponse] = await Promise.all([
-        productsAPI.getDoughTypes(),
-        productsAPI.getExtras()
-      ]);
+      // Table, menu and current order in one request
+      const response = await tablesAPI.getBootstrap(tableId);
+      const { table, catalog, order } = response.data;
+      setTable(table);
+      setCategories(catalog.categories);
+      setMenu(catalog.products);
+      setDoughTypes(catalog.dough_types);
+      setExtras(catalog.extras);
       
-      setDoughTypes(doughTypesResponse.data);
-      setExtras(extrasResponse.data);
-      
-      // Fetch current order
-      await fetchCurrentOrder();
+      if (order) {
+        setCurrentOrder(order);
+        orderSeqRef.current = response.headers['x-change-seq'];
+        orderIdRef.current = order.order.id;
+      }
       
       setError(null);
     } catch (err) {
@@ -58,38 +81,101 @@ const MenuView = () => {
     }
   };
 
-  const fetchProducts = async () => {
+  const fetchCurrentOrder = async () => {
     try {
-      const response = await productsAPI.getProducts(activeCategory);
-      setProducts(response.data);
+      const response = await ordersAPI.getOrderForTable(tableId);
+      setCurrentOrder(response.data);
+      orderSeqRef.current = response.headers['x-change-seq'];
+      orderIdRef.current = response.data.order.id;
     } catch (err) {
-      console.error('Error fetching products:', err);
+      console.error('Error fetching current order:', err);
     }
   };
 
-  const fetchCurrentOrder = async () => {
+  // After a reconnect, fetch only the items changed or removed while events were missed
+  const syncCurrentOrder = async () => {
+    if (orderSeqRef.current == null) {
+      fetchCurrentOrder();
+      return;
+    }
     try {
-      const response = await ordersAPI.getOrderForTable(tableId);
-      setCurrentOrder(response.data);
+      const response = await ordersAPI.getOrderForTable(tableId, orderSeqRef.current);
+      const { seq, order, items, deleted_item_ids: deletedItemIds, total } = response.data;
+      if (order && order.id !== orderIdRef.current) {
+        // The table was closed and opened again meanwhile
+        fetchCurrentOrder();
+        return;
+      }
+
+      const deleted = new Set(deletedItemIds);
+      const changed = new Map(items.map((item) => [item.id, item]));
+      setCurrentOrder((current) => {
+        if (!current) {
+          return current;
+        }
+        const kept = current.items
+          .filter((item) => !deleted.has(item.id))
+          .map((item) => changed.get(item.id) || item);
+        const known = new Set(kept.map((item) => item.id));
+        return {
+          order: order || current.order,
+          items: [...kept, ...items.filter((item) => !known.has(item.id))],
+          total: total ?? current.total,
+        };
+      });
+      orderSeqRef.current = seq;
     } catch (err) {
-      console.error('Error fetching current order:', err);
+      console.error('Error syncing current order:', err);
     }
   };
 
+  // Items are matched by id, so the response and the echoed event can both be applied;
+  // a line whose quantity changed replaces the one shown
+  const addItemsToOrder = (items, total) => {
+    setCurrentOrder((order) => {
+      if (!order) {
+        return order;
+      }
+      const changed = new Map(items.map((item) => [item.id, item]));
+      const known = new Set(order.items.map((item) => item.id));
+      return {
+        ...order,
+        items: [
+          ...order.items.map((item) => changed.get(item.id) || item),
+          ...items.filter((item) => !known.has(item.id)),
+        ],
+        total,
+      };
+    });
+  };
+
+  const removeItemFromOrder = (itemId, total) => {
+    setCurrentOrder((order) => order && {
+      ...order,
+      items: order.items.filter((item) => item.id !== itemId),
+      total,
+    });
+  };
+
   const handleAddItem = async (productId, doughType, extraIds) => {
     try {
-      await ordersAPI.addItem(tableId, productId, doughType, extraIds);
-      await fetchCurrentOrder();
+      const response = await ordersAPI.addItem(tableId, productId, doughType, extraIds);
+      addItemsToOrder([response.data.item], response.data.total);
     } catch (err) {
       console.error('Error adding item:', err);
       setError('Errore nell\'aggiunta dell\'articolo');
     }
   };
 
-  const handleRemoveItem = async (itemId) => {
+  // With a quantity, takes that many off the line; the line goes when none are left
+  const handleRemoveItem = async (itemId, quantity) => {
     try {
-      await ordersAPI.removeItem(itemId);
-      await fetchCurrentOrder();
+      const response = await ordersAPI.removeItem(itemId, quantity);
+      if (response.data.item) {
+        addItemsToOrder([response.data.item], response.data.total);
+      } else {
+        removeItemFromOrder(itemId, response.data.total);
+      }
     } catch (err) {
       console.error('Error removing item:', err);
       setError('Errore nella rimozione dell\'articolo');
@@ -160,7 +246,7 @@ const MenuView = () => {
 
           {/* Products Grid */}
           <div className="grid grid-cols-1 md:grid-cols-2 gap-4">
-            {products.map((product) => (
+            {(menu[activeCategory] || []).map((product) => (
               <ProductCard
                 key={product.id}
                 product={product}
@@ -46,7 +46,7 @@ const OrderSidebar = ({ currentOrder, onRemoveItem, onGoToSummary }) => {
         {currentOrder.items.map((item) => (
           <div key={item.id} className="order-item">
             <div className="flex-1">
-              <div className="font-medium text-gray-900">{item.name}</div>
+              <div className="font-medium text-gray-900">{item.quantity > 1 && `${item.quantity} × `}{item.name}</div>
               {formatCustomizations(item).length > 0 && (
                 <div className="text-xs text-gray-500 mt-1">
                   {formatCustomizations(item).join(', ')}
@@ -56,6 +56,14 @@ const OrderSidebar = ({ currentOrder, onRemoveItem, onGoToSummary }) => {
                 {formatPrice(item.total_price)}
               </div>
             </div>
+            {item.quantity > 1 && (
+              <button
+                onClick={() => onRemoveItem(item.id, 1)}
+                className="text-red-600 hover:text-red-800 ml-3"
+              >
+                −
+              </button>
+            )}
             <button
               onClick={() => onRemoveItem(item.id)}
               className="text-red-600 hover:text-red-800 ml-3"
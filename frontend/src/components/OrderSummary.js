@@ -160,7 +160,7 @@ const OrderSummary = () => {
               {groupedItems.kitchen.map((item) => (
                 <div key={item.id} className="flex justify-between items-start p-3 bg-gray-50 rounded-lg">
                   <div className="flex-1">
-                    <div className="font-medium text-gray-900">{item.name}</div>
+                    <div className="font-medium text-gray-900">{item.quantity > 1 && `${item.quantity} × `}{item.name}</div>
                     {formatCustomizations(item).length > 0 && (
                       <div className="text-sm text-gray-500 mt-1">
                         {formatCustomizations(item).join(', ')}
@@ -188,7 +188,7 @@ const OrderSummary = () => {
               {groupedItems.pizzeria.map((item) => (
                 <div key={item.id} className="flex justify-between items-start p-3 bg-gray-50 rounded-lg">
                   <div className="flex-1">
-                    <div className="font-medium text-gray-900">{item.name}</div>
+                    <div className="font-medium text-gray-900">{item.quantity > 1 && `${item.quantity} × `}{item.name}</div>
                     {formatCustomizations(item).length > 0 && (
                       <div className="text-sm text-gray-500 mt-1">
                         {formatCustomizations(item).join(', ')}
@@ -216,7 +216,7 @@ const OrderSummary = () => {
               {groupedItems.glutenFree.map((item) => (
                 <div key={item.id} className="flex justify-between items-start p-3 bg-gray-50 rounded-lg">
                   <div className="flex-1">
-                    <div className="font-medium text-gray-900">{item.name}</div>
+                    <div className="font-medium text-gray-900">{item.quantity > 1 && `${item.quantity} × `}{item.name}</div>
                     {formatCustomizations(item).length > 0 && (
                       <div className="text-sm text-gray-500 mt-1">
                         {formatCustomizations(item).join(', ')}
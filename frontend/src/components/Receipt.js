@@ -133,7 +133,7 @@ const Receipt = () => {
               {receiptData.kitchen_items.map((item) => (
                 <div key={item.id} className="flex justify-between items-start">
                   <div className="flex-1">
-                    <div className="font-medium text-gray-900">{item.name}</div>
+                    <div className="font-medium text-gray-900">{item.quantity > 1 && `${item.quantity} × `}{item.name}</div>
                     {formatCustomizations(item).length > 0 && (
                       <div className="text-sm text-gray-500 mt-1">
                         {formatCustomizations(item).join(', ')}
@@ -161,7 +161,7 @@ const Receipt = () => {
               {receiptData.pizzeria_items.map((item) => (
                 <div key={item.id} className="flex justify-between items-start">
                   <div className="flex-1">
-                    <div className="font-medium text-gray-900">{item.name}</div>
+                    <div className="font-medium text-gray-900">{item.quantity > 1 && `${item.quantity} × `}{item.name}</div>
                     {formatCustomizations(item).length > 0 && (
                       <div className="text-sm text-gray-500 mt-1">
                         {formatCustomizations(item).join(', ')}
@@ -189,7 +189,7 @@ const Receipt = () => {
               {receiptData.gluten_free_items.map((item) => (
                 <div key={item.id} className="flex justify-between items-start">
                   <div className="flex-1">
-                    <div className="font-medium text-gray-900">{item.name}</div>
+                    <div className="font-medium text-gray-900">{item.quantity > 1 && `${item.quantity} × `}{item.name}</div>
                     {formatCustomizations(item).length > 0 && (
                       <div className="text-sm text-gray-500 mt-1">
                         {formatCustomizations(item).join(', ')}
@@ -1,6 +1,6 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
-import { tablesAPI } from '../services/api';
+import { tablesAPI, eventsAPI } from '../services/api';
 import TableCard from './TableCard';
 import OpenTableModal from './OpenTableModal';
 
@@ -11,16 +11,41 @@ const TablesView = () => {
   const [selectedTable, setSelectedTable] = useState(null);
   const [isModalOpen, setIsModalOpen] = useState(false);
   const navigate = useNavigate();
+  // Change sequence number the floor is current to
+  const seqRef = useRef(null);
 
   useEffect(() => {
     fetchTables();
+
+    // Patch the floor from live events instead of refetching it
+    return eventsAPI.subscribe({
+      table_opened: ({ table_id, covers, use_count }) =>
+        updateTable(table_id, { status: 'occupied', covers, use_count, items_count: 0, total: 0 }),
+      table_closed: ({ table_id }) =>
+        updateTable(table_id, { status: 'free', covers: 0, items_count: 0, total: 0 }),
+      items_added: ({ table_id, items_count, total }) =>
+        updateTable(table_id, { items_count, total }),
+      item_removed: ({ table_id, items_count, total }) =>
+        updateTable(table_id, { items_count, total }),
+      item_updated: ({ table_id, items_count, total }) =>
+        updateTable(table_id, { items_count, total }),
+    }, syncTables);
   }, []);
 
-  const fetchTables = async () => {
+  const updateTable = (tableId, changes) => {
+    setTables((current) =>
+      current.map((table) => (table.id === tableId ? { ...table, ...changes } : table))
+    );
+  };
+
+  const fetchTables = async (showLoading = true) => {
     try {
-      setLoading(true);
+      if (showLoading) {
+        setLoading(true);
+      }
       const response = await tablesAPI.getTables();
       setTables(response.data);
+      seqRef.current = response.headers['x-change-seq'];
       setError(null);
     } catch (err) {
       setError('Errore nel caricamento dei tavoli');
@@ -30,6 +55,22 @@ const TablesView = () => {
     }
   };
 
+  // After a reconnect, fetch only the tables that changed while events were missed
+  const syncTables = async () => {
+    if (seqRef.current == null) {
+      fetchTables(false);
+      return;
+    }
+    try {
+      const response = await tablesAPI.getTables(seqRef.current);
+      const changed = new Map(response.data.tables.map((table) => [table.id, table]));
+      setTables((current) => current.map((table) => changed.get(table.id) || table));
+      seqRef.current = response.data.seq;
+    } catch (err) {
+      console.error('Error syncing tables:', err);
+    }
+  };
+
   const handleTableClick = (table) => {
     if (table.status === 'free') {
       setSelectedTable(table);
@@ -44,7 +85,8 @@ const TablesView = () => {
       await tablesAPI.openTable(tableId, covers);
       setIsModalOpen(false);
       setSelectedTable(null);
-      fetchTables();
+      // Don't wait on the event: the stream may be served by another worker
+      syncTables();
     } catch (err) {
       console.error('Error opening table:', err);
       setError('Errore nell\'apertura del tavolo');
@@ -54,7 +96,7 @@ const TablesView = () => {
   const handleCloseTable = async (tableId) => {
     try {
       await tablesAPI.closeTable(tableId);
-      fetchTables();
+      syncTables();
     } catch (err) {
       console.error('Error closing table:', err);
       setError('Errore nella chiusura del tavolo');
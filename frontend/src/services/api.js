@@ -2,6 +2,10 @@ import axios from 'axios';
 
 const API_BASE_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
 
+// Restaurant this tablet serves; without one the backend's default restaurant
+const RESTAURANT_ID = process.env.REACT_APP_RESTAURANT_ID;
+const API_PREFIX = RESTAURANT_ID ? `/api/restaurants/${encodeURIComponent(RESTAURANT_ID)}` : '/api';
+
 const api = axios.create({
   baseURL: API_BASE_URL,
   headers: {
@@ -9,58 +13,118 @@ const api = axios.create({
   },
 });
 
+// Menu last downloaded by getBootstrap, sent again only when its version changes
+let cachedCatalog = null;
+let cachedCatalogVersion = null;
+
 // Tables API
 export const tablesAPI = {
-  // Get all tables
-  getTables: () => api.get('/api/tables'),
+  // Get all tables, or with `since` only those changed after that change sequence number
+  getTables: (since) => api.get(`${API_PREFIX}/tables`, { params: since != null ? { since } : {} }),
   
   // Get table by ID
-  getTable: (tableId) => api.get(`/api/tables/${tableId}`),
+  getTable: (tableId) => api.get(`${API_PREFIX}/tables/${tableId}`),
+  
+  // Get a table with the menu and its active order in one request
+  getBootstrap: async (tableId) => {
+    const params = cachedCatalog ? { catalog_version: cachedCatalogVersion } : {};
+    const response = await api.get(`${API_PREFIX}/tables/${tableId}/bootstrap`, { params });
+    if (response.data.catalog) {
+      cachedCatalog = response.data.catalog;
+      cachedCatalogVersion = response.data.catalog_version;
+    }
+    return { ...response, data: { ...response.data, catalog: cachedCatalog } };
+  },
   
   // Open table
-  openTable: (tableId, covers) => api.post('/api/tables/open', { table_id: tableId, covers }),
+  openTable: (tableId, covers) => api.post(`${API_PREFIX}/tables/open`, { table_id: tableId, covers }),
   
   // Close table
-  closeTable: (tableId) => api.post(`/api/tables/${tableId}/close`),
+  closeTable: (tableId) => api.post(`${API_PREFIX}/tables/${tableId}/close`),
 };
 
 // Products API
 export const productsAPI = {
   // Get all products or by category
-  getProducts: (category) => api.get('/api/products', { params: category ? { category } : {} }),
+  getProducts: (category) => api.get(`${API_PREFIX}/products`, { params: category ? { category } : {} }),
   
   // Get categories
-  getCategories: () => api.get('/api/products/categories'),
+  getCategories: () => api.get(`${API_PREFIX}/products/categories`),
   
   // Get dough types
-  getDoughTypes: () => api.get('/api/dough-types'),
+  getDoughTypes: () => api.get(`${API_PREFIX}/dough-types`),
   
   // Get extras
-  getExtras: () => api.get('/api/extras'),
+  getExtras: () => api.get(`${API_PREFIX}/extras`),
 };
 
 // Orders API
 export const ordersAPI = {
   // Add item to order
   addItem: (tableId, productId, doughType, extraIds) => 
-    api.post('/api/orders/add-item', {
+    api.post(`${API_PREFIX}/orders/add-item`, {
       table_id: tableId,
       product_id: productId,
       dough_type: doughType,
       extra_ids: extraIds || []
     }),
   
-  // Remove item from order
-  removeItem: (itemId) => api.delete(`/api/orders/items/${itemId}`),
+  // Add several items to order in one request
+  // items: [{ product_id, dough_type, extra_ids }]
+  addItems: (tableId, items) => api.post(`${API_PREFIX}/orders/add-items`, { table_id: tableId, items }),
   
-  // Get order for table
-  getOrderForTable: (tableId) => api.get(`/api/orders/table/${tableId}`),
+  // Remove item from order, or with `quantity` only that many of it
+  removeItem: (itemId, quantity) =>
+    api.delete(`${API_PREFIX}/orders/items/${itemId}`, { params: quantity ? { quantity } : {} }),
+  
+  // Get order for table, or with `since` only what changed after that change sequence number
+  getOrderForTable: (tableId, since) =>
+    api.get(`${API_PREFIX}/orders/table/${tableId}`, { params: since != null ? { since } : {} }),
   
   // Send order
-  sendOrder: (orderId) => api.post(`/api/orders/${orderId}/send`),
+  sendOrder: (orderId) => api.post(`${API_PREFIX}/orders/${orderId}/send`),
   
   // Get receipt
-  getReceipt: (orderId) => api.get(`/api/orders/${orderId}/receipt`),
+  getReceipt: (orderId) => api.get(`${API_PREFIX}/orders/${orderId}/receipt`),
+};
+
+// Stations API (kitchen, pizzeria, gluten_free)
+export const stationsAPI = {
+  // Get pending tickets, waiting up to `wait` seconds for new ones
+  getTickets: (station, wait = 25) => api.get(`${API_PREFIX}/stations/${station}/tickets`, { params: { wait } }),
+  
+  // Acknowledge a ticket
+  ackTicket: (station, ticketId) => api.post(`${API_PREFIX}/stations/${station}/tickets/${ticketId}/ack`),
+};
+
+// Live updates API
+export const eventsAPI = {
+  // Subscribe to table and order change events.
+  // handlers: { [eventType]: (data) => void }
+  // onResync is called when events may have been missed (reconnect or backlog overflow)
+  subscribe: (handlers, onResync) => {
+    const source = new EventSource(`${API_BASE_URL}${API_PREFIX}/events`);
+    let connected = false;
+
+    Object.entries(handlers).forEach(([type, handler]) => {
+      source.addEventListener(type, (event) => handler(JSON.parse(event.data)));
+    });
+
+    source.addEventListener('open', () => {
+      if (connected && onResync) {
+        onResync();
+      }
+      connected = true;
+    });
+
+    source.addEventListener('resync', () => {
+      if (onResync) {
+        onResync();
+      }
+    });
+
+    return () => source.close();
+  },
 };
 
 export default api;
\ No newline at end of file